@@ -0,0 +1,54 @@
+"""add gl transaction store
+
+Revision ID: 0005_add_gl_transactions
+Revises: 0004_add_xero_tables
+Create Date: 2026-10-16 00:00:00.000000
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0005_add_gl_transactions"
+down_revision = "0004_add_xero_tables"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "gl_transactions",
+        sa.Column("id", sa.String(length=36), primary_key=True),
+        sa.Column("tenant_id", sa.String(length=40), nullable=False),
+        sa.Column("hash", sa.String(length=64), nullable=False),
+        sa.Column("account", sa.String(length=255), nullable=False),
+        sa.Column("date", sa.String(length=40), nullable=False),
+        sa.Column("txn_date", sa.Date(), nullable=False),
+        sa.Column("seq", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("source", sa.Text(), nullable=False, server_default=""),
+        sa.Column("description", sa.Text(), nullable=False, server_default=""),
+        sa.Column("reference", sa.Text(), nullable=False, server_default=""),
+        sa.Column("debit", sa.Float(), nullable=False, server_default="0"),
+        sa.Column("credit", sa.Float(), nullable=False, server_default="0"),
+        sa.Column("amount", sa.Float(), nullable=False, server_default="0"),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(timezone=True), server_default=sa.func.now(), onupdate=sa.func.now(), nullable=False),
+        sa.UniqueConstraint("tenant_id", "hash", name="uniq_gl_txn"),
+    )
+    op.create_index("ix_gl_transactions_tenant_date", "gl_transactions", ["tenant_id", "txn_date"])
+    op.create_table(
+        "gl_sync_states",
+        sa.Column("id", sa.String(length=36), primary_key=True),
+        sa.Column("tenant_id", sa.String(length=40), nullable=False, unique=True, index=True),
+        sa.Column("synced_from", sa.Date(), nullable=False),
+        sa.Column("synced_to", sa.Date(), nullable=False),
+        sa.Column("account_order", sa.JSON(), nullable=False),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(timezone=True), server_default=sa.func.now(), onupdate=sa.func.now(), nullable=False),
+    )
+
+
+def downgrade():
+    op.drop_table("gl_sync_states")
+    op.drop_index("ix_gl_transactions_tenant_date", table_name="gl_transactions")
+    op.drop_table("gl_transactions")
@@ -0,0 +1,40 @@
+"""add sync jobs
+
+Revision ID: 0006_add_sync_jobs
+Revises: 0005_add_gl_transactions
+Create Date: 2026-10-16 00:00:00.000000
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0006_add_sync_jobs"
+down_revision = "0005_add_gl_transactions"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "sync_jobs",
+        sa.Column("id", sa.String(length=36), primary_key=True),
+        sa.Column("user_id", sa.String(length=36), sa.ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True),
+        sa.Column("kind", sa.String(length=40), nullable=False),
+        sa.Column("status", sa.String(length=20), nullable=False, server_default="queued"),
+        sa.Column("params", sa.JSON(), nullable=False),
+        sa.Column("progress", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("stage", sa.String(length=40), nullable=True),
+        sa.Column("result", sa.JSON(), nullable=True),
+        sa.Column("error", sa.Text(), nullable=True),
+        sa.Column("started_at", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("finished_at", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(timezone=True), server_default=sa.func.now(), onupdate=sa.func.now(), nullable=False),
+    )
+    op.create_index("ix_sync_jobs_status_created", "sync_jobs", ["status", "created_at"])
+
+
+def downgrade():
+    op.drop_index("ix_sync_jobs_status_created", table_name="sync_jobs")
+    op.drop_table("sync_jobs")
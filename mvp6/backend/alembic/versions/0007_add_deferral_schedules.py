@@ -0,0 +1,51 @@
+"""add deferral schedules
+
+Revision ID: 0007_add_deferral_schedules
+Revises: 0006_add_sync_jobs
+Create Date: 2026-10-16 00:00:00.000000
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0007_add_deferral_schedules"
+down_revision = "0006_add_sync_jobs"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "deferral_schedules",
+        sa.Column("id", sa.String(length=36), primary_key=True),
+        sa.Column("tenant_id", sa.String(length=36), nullable=False),
+        sa.Column("user_id", sa.String(length=36), sa.ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True),
+        sa.Column("txn_hash", sa.String(length=64), nullable=False),
+        sa.Column("part", sa.Integer(), nullable=False),
+        sa.Column("account", sa.String(length=255), nullable=False),
+        sa.Column("month", sa.String(length=7), nullable=False),
+        sa.Column("amount", sa.Float(), nullable=False),
+        sa.Column("non_operating", sa.Boolean(), nullable=False, server_default=sa.text("false")),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+        sa.UniqueConstraint("tenant_id", "user_id", "txn_hash", "part", name="uniq_deferral_schedule"),
+    )
+    op.create_index("ix_deferral_schedules_month", "deferral_schedules", ["tenant_id", "user_id", "month"])
+    op.create_table(
+        "deferral_month_totals",
+        sa.Column("id", sa.String(length=36), primary_key=True),
+        sa.Column("tenant_id", sa.String(length=36), nullable=False),
+        sa.Column("user_id", sa.String(length=36), sa.ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True),
+        sa.Column("month", sa.String(length=7), nullable=False),
+        sa.Column("account", sa.String(length=255), nullable=False),
+        sa.Column("non_operating", sa.Boolean(), nullable=False, server_default=sa.text("false")),
+        sa.Column("amount", sa.Float(), nullable=False, server_default="0"),
+        sa.Column("updated_at", sa.DateTime(timezone=True), server_default=sa.func.now(), onupdate=sa.func.now(), nullable=False),
+        sa.UniqueConstraint("tenant_id", "user_id", "month", "account", "non_operating", name="uniq_deferral_month_total"),
+    )
+
+
+def downgrade():
+    op.drop_table("deferral_month_totals")
+    op.drop_index("ix_deferral_schedules_month", table_name="deferral_schedules")
+    op.drop_table("deferral_schedules")
@@ -0,0 +1,43 @@
+"""make the txn override key null-safe for upserts
+
+Revision ID: 0008_txn_override_key_index
+Revises: 0007_add_deferral_schedules
+Create Date: 2026-10-16 00:00:00.000000
+"""
+
+from alembic import op
+
+
+revision = "0008_txn_override_key_index"
+down_revision = "0007_add_deferral_schedules"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Rows that only differed by NULL line_item_id/hash were allowed before; keep the newest.
+    op.execute(
+        """
+        DELETE FROM txn_overrides WHERE id IN (
+            SELECT id FROM (
+                SELECT id, row_number() OVER (
+                    PARTITION BY tenant_id, user_id, source, document_id, coalesce(line_item_id, ''), coalesce(hash, '')
+                    ORDER BY updated_at DESC, id DESC
+                ) AS position
+                FROM txn_overrides
+            ) ranked WHERE position > 1
+        )
+        """
+    )
+    op.drop_constraint("uniq_txn_override", "txn_overrides", type_="unique")
+    op.execute(
+        "CREATE UNIQUE INDEX uniq_txn_override ON txn_overrides "
+        "(tenant_id, user_id, source, document_id, coalesce(line_item_id, ''), coalesce(hash, ''))"
+    )
+
+
+def downgrade():
+    op.drop_index("uniq_txn_override", table_name="txn_overrides")
+    op.create_unique_constraint(
+        "uniq_txn_override", "txn_overrides", ["tenant_id", "user_id", "source", "document_id", "line_item_id", "hash"]
+    )
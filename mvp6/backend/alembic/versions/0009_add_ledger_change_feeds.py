@@ -0,0 +1,40 @@
+"""add ledger tombstones and change feed indexes
+
+Revision ID: 0009_add_ledger_change_feeds
+Revises: 0008_txn_override_key_index
+Create Date: 2026-10-16 00:00:00.000000
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0009_add_ledger_change_feeds"
+down_revision = "0008_txn_override_key_index"
+branch_labels = None
+depends_on = None
+
+FEED_TABLES = ("txn_overrides", "doctor_rules", "user_preferences")
+
+
+def upgrade():
+    op.create_table(
+        "ledger_tombstones",
+        sa.Column("id", sa.String(length=36), primary_key=True),
+        sa.Column("tenant_id", sa.String(length=36), nullable=False),
+        sa.Column("user_id", sa.String(length=36), sa.ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True),
+        sa.Column("kind", sa.String(length=40), nullable=False),
+        sa.Column("record_id", sa.String(length=36), nullable=False),
+        sa.Column("record_key", sa.String(length=255), nullable=True),
+        sa.Column("deleted_at", sa.DateTime(timezone=True), nullable=False),
+    )
+    op.create_index("ix_ledger_tombstones_feed", "ledger_tombstones", ["tenant_id", "user_id", "kind", "deleted_at", "id"])
+    for table in FEED_TABLES:
+        op.create_index(f"ix_{table}_feed", table, ["tenant_id", "user_id", "updated_at", "id"])
+
+
+def downgrade():
+    for table in FEED_TABLES:
+        op.drop_index(f"ix_{table}_feed", table_name=table)
+    op.drop_index("ix_ledger_tombstones_feed", table_name="ledger_tombstones")
+    op.drop_table("ledger_tombstones")
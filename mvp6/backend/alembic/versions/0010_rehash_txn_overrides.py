@@ -0,0 +1,187 @@
+"""rehash transaction overrides onto canonical keys
+
+Revision ID: 0010_rehash_txn_overrides
+Revises: 0009_add_ledger_change_feeds
+Create Date: 2026-10-17 00:00:00.000000
+"""
+
+import hashlib
+import math
+from datetime import date, datetime
+from decimal import Decimal
+from types import SimpleNamespace
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0010_rehash_txn_overrides"
+down_revision = "0009_add_ledger_change_feeds"
+branch_labels = None
+depends_on = None
+
+txn_overrides = sa.table(
+    "txn_overrides",
+    sa.column("id", sa.String),
+    sa.column("tenant_id", sa.String),
+    sa.column("user_id", sa.String),
+    sa.column("source", sa.String),
+    sa.column("document_id", sa.String),
+    sa.column("line_item_id", sa.String),
+    sa.column("hash", sa.String),
+    sa.column("legacy_hash", sa.String),
+    sa.column("updated_at", sa.DateTime),
+)
+xero_connections = sa.table("xero_connections", sa.column("user_id", sa.String), sa.column("tenant_id", sa.String))
+gl_transactions = sa.table(
+    "gl_transactions",
+    sa.column("tenant_id", sa.String),
+    sa.column("account", sa.String),
+    sa.column("date", sa.String),
+    sa.column("amount", sa.Float),
+    sa.column("description", sa.String),
+    sa.column("reference", sa.String),
+    sa.column("source", sa.String),
+)
+
+# Frozen copy of the canonical and legacy browser keys (app/txn_hash.py) as of this
+# revision, so later changes there cannot alter what this migration writes.
+TXN_HASH_BYTES = 16
+FIELD_SEPARATOR = "\x1f"
+
+
+def _iso_day(value):
+    value = (value or "").strip()
+    try:
+        return date.fromisoformat(value[:10]).isoformat()
+    except ValueError:
+        pass
+    for fmt in ("%d %b %Y", "%d %B %Y", "%d/%m/%Y"):
+        try:
+            return datetime.strptime(value, fmt).date().isoformat()
+        except ValueError:
+            continue
+    return value
+
+
+def _text(value):
+    return " ".join(str(value or "").split())
+
+
+def _canonical_hash(txn):
+    amount = f"{round(float(txn['amount'] or 0.0), 2) + 0.0:.2f}"
+    canonical = FIELD_SEPARATOR.join(
+        (_text(txn["account"]), _iso_day(txn["date"]), amount, _text(txn["description"]), _text(txn["reference"]), _text(txn["source"]))
+    )
+    return hashlib.blake2b(canonical.encode(), digest_size=TXN_HASH_BYTES).hexdigest()
+
+
+def _js_number(value):
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "Infinity" if value > 0 else "-Infinity"
+    if value == 0:
+        return "0"
+    if value.is_integer() and abs(value) < 1e16:
+        return str(int(value))
+    text = repr(value)
+    if "e" not in text:
+        return text
+    sign = "-" if value < 0 else ""
+    parts = Decimal(repr(abs(value))).as_tuple()
+    digits = "".join(str(digit) for digit in parts.digits)
+    point = parts.exponent + len(digits)
+    digits = digits.rstrip("0")
+    k = len(digits)
+    if k <= point <= 21:
+        return sign + digits + "0" * (point - k)
+    if 0 < point <= 21:
+        return sign + digits[:point] + "." + digits[point:]
+    if -6 < point <= 0:
+        return sign + "0." + "0" * -point + digits
+    exponent = point - 1
+    mantissa = digits if k == 1 else digits[0] + "." + digits[1:]
+    return f"{sign}{mantissa}e{'+' if exponent > 0 else '-'}{abs(exponent)}"
+
+
+def _legacy_hash(txn):
+    text = (
+        f"{txn['account'] or ''}|{txn['date'] or ''}|{_js_number(float(txn['amount'] or 0.0))}"
+        f"|{txn['description'] or ''}|{txn['reference'] or ''}|{txn['source'] or ''}"
+    )
+    encoded = text.encode("utf-16-le")
+    h = 0
+    for offset in range(0, len(encoded), 2):
+        h = (h * 31 + int.from_bytes(encoded[offset:offset + 2], "little")) & 0xFFFFFFFF
+    return format(abs(h - 2 ** 32 if h >= 2 ** 31 else h), "x")
+
+
+def _rehash_plan(overrides, txns):
+    # Override id -> canonical key; legacy keys shared by several distinct lines are left alone.
+    legacy = [(record.id, record.hash) for record in overrides if record.hash and len(record.hash) != TXN_HASH_BYTES * 2]
+    if not legacy:
+        return {}
+    candidates = {}
+    for txn in txns:
+        candidates.setdefault(_legacy_hash(txn), set()).add(_canonical_hash(txn))
+    plan = {}
+    for override_id, old in legacy:
+        matches = candidates.get(old)
+        if matches and len(matches) == 1:
+            plan[override_id] = next(iter(matches))
+    return plan
+
+
+def upgrade():
+    op.add_column("txn_overrides", sa.Column("legacy_hash", sa.String(length=64), nullable=True))
+    op.create_index("ix_txn_overrides_hash", "txn_overrides", ["tenant_id", "user_id", "hash"])
+    if op.get_context().as_sql:
+        return
+
+    bind = op.get_bind()
+    connections = bind.execute(sa.select(xero_connections.c.user_id, xero_connections.c.tenant_id)).all()
+    for user_id, tenant_id in connections:
+        if not tenant_id:
+            continue
+        overrides = [
+            SimpleNamespace(**row._mapping)
+            for row in bind.execute(sa.select(txn_overrides).where(txn_overrides.c.user_id == user_id, txn_overrides.c.tenant_id == user_id))
+        ]
+        txns = [
+            dict(row._mapping)
+            for row in bind.execute(
+                sa.select(
+                    gl_transactions.c.account,
+                    gl_transactions.c.date,
+                    gl_transactions.c.amount,
+                    gl_transactions.c.description,
+                    gl_transactions.c.reference,
+                    gl_transactions.c.source,
+                ).where(gl_transactions.c.tenant_id == tenant_id)
+            )
+        ]
+        plan = _rehash_plan(overrides, txns)
+        # Two legacy overrides for the same line can't both take its canonical key.
+        taken = {(record.source, record.document_id, record.line_item_id or "", record.hash or "") for record in overrides}
+        for record in overrides:
+            canonical = plan.get(record.id)
+            key = (record.source, record.document_id, record.line_item_id or "", canonical)
+            if canonical is None or key in taken:
+                continue
+            taken.add(key)
+            bind.execute(
+                txn_overrides.update()
+                .where(txn_overrides.c.id == record.id)
+                .values(hash=canonical, legacy_hash=record.hash, updated_at=sa.func.now())
+            )
+
+
+def downgrade():
+    op.execute(
+        txn_overrides.update()
+        .where(txn_overrides.c.legacy_hash.isnot(None))
+        .values(hash=txn_overrides.c.legacy_hash)
+    )
+    op.drop_index("ix_txn_overrides_hash", table_name="txn_overrides")
+    op.drop_column("txn_overrides", "legacy_hash")
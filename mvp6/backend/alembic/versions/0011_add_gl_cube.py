@@ -0,0 +1,45 @@
+"""add gl cube
+
+Revision ID: 0011_add_gl_cube
+Revises: 0010_rehash_txn_overrides
+Create Date: 2026-10-17 00:00:00.000000
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0011_add_gl_cube"
+down_revision = "0010_rehash_txn_overrides"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Cubes are built on first read (ensure_gl_cube), so there is nothing to backfill here.
+    op.create_table(
+        "gl_cube_cells",
+        sa.Column("id", sa.String(length=36), primary_key=True),
+        sa.Column("tenant_id", sa.String(length=36), nullable=False),
+        sa.Column("user_id", sa.String(length=36), sa.ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True),
+        sa.Column("month", sa.String(length=7), nullable=False),
+        sa.Column("account", sa.String(length=255), nullable=False),
+        sa.Column("treatment", sa.String(length=20), nullable=False),
+        sa.Column("non_operating", sa.Boolean(), nullable=False, server_default=sa.text("false")),
+        sa.Column("amount", sa.Float(), nullable=False, server_default="0"),
+        sa.Column("count", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("updated_at", sa.DateTime(timezone=True), server_default=sa.func.now(), onupdate=sa.func.now(), nullable=False),
+        sa.UniqueConstraint("tenant_id", "user_id", "month", "account", "treatment", "non_operating", name="uniq_gl_cube_cell"),
+    )
+    op.create_table(
+        "gl_cube_states",
+        sa.Column("id", sa.String(length=36), primary_key=True),
+        sa.Column("user_id", sa.String(length=36), sa.ForeignKey("users.id", ondelete="CASCADE"), nullable=False, unique=True, index=True),
+        sa.Column("gl_tenant_id", sa.String(length=40), nullable=False),
+        sa.Column("built_at", sa.DateTime(timezone=True), nullable=False),
+    )
+
+
+def downgrade():
+    op.drop_table("gl_cube_states")
+    op.drop_table("gl_cube_cells")
@@ -0,0 +1,70 @@
+"""add snapshot summary, payload size and payload hash
+
+Revision ID: 0012_add_snapshot_metadata
+Revises: 0011_add_gl_cube
+Create Date: 2026-10-17 00:00:00.000000
+"""
+
+import hashlib
+import json
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0012_add_snapshot_metadata"
+down_revision = "0011_add_gl_cube"
+branch_labels = None
+depends_on = None
+
+BACKFILL_BATCH = 200
+
+snapshots = sa.table(
+    "snapshots",
+    sa.column("id", sa.String),
+    sa.column("payload", sa.JSON),
+    sa.column("summary", sa.JSON),
+    sa.column("payload_size", sa.Integer),
+    sa.column("payload_hash", sa.String),
+)
+
+
+def _payload_metadata(payload):
+    # Frozen copy of app/snapshot_store.py payload_metadata as of this revision.
+    encoded = json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str).encode()
+    summary = payload.get("summary") if isinstance(payload, dict) else None
+    return {
+        "summary": summary if isinstance(summary, dict) else None,
+        "payload_size": len(encoded),
+        "payload_hash": hashlib.blake2b(encoded, digest_size=16).hexdigest(),
+    }
+
+
+def upgrade():
+    op.add_column("snapshots", sa.Column("summary", sa.JSON(), nullable=True))
+    op.add_column("snapshots", sa.Column("payload_size", sa.Integer(), nullable=True))
+    op.add_column("snapshots", sa.Column("payload_hash", sa.String(length=64), nullable=True))
+    if op.get_context().as_sql:
+        return
+
+    # One pass over existing payloads, a batch at a time in id order.
+    bind = op.get_bind()
+    last_id = ""
+    while True:
+        rows = bind.execute(
+            sa.select(snapshots.c.id, snapshots.c.payload)
+            .where(snapshots.c.id > last_id)
+            .order_by(snapshots.c.id)
+            .limit(BACKFILL_BATCH)
+        ).all()
+        if not rows:
+            break
+        for snapshot_id, payload in rows:
+            bind.execute(snapshots.update().where(snapshots.c.id == snapshot_id).values(**_payload_metadata(payload)))
+        last_id = rows[-1][0]
+
+
+def downgrade():
+    op.drop_column("snapshots", "payload_hash")
+    op.drop_column("snapshots", "payload_size")
+    op.drop_column("snapshots", "summary")
@@ -0,0 +1,24 @@
+"""add snapshot listing indexes
+
+Revision ID: 0013_add_snapshot_listing_indexes
+Revises: 0012_add_snapshot_metadata
+Create Date: 2026-10-17 00:00:00.000000
+"""
+
+from alembic import op
+
+
+revision = "0013_add_snapshot_listing_indexes"
+down_revision = "0012_add_snapshot_metadata"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index("ix_snapshots_owner_updated", "snapshots", ["owner_user_id", "updated_at", "id"])
+    op.create_index("ix_snapshot_shares_user", "snapshot_shares", ["user_id", "role", "snapshot_id"])
+
+
+def downgrade():
+    op.drop_index("ix_snapshot_shares_user", table_name="snapshot_shares")
+    op.drop_index("ix_snapshots_owner_updated", table_name="snapshots")
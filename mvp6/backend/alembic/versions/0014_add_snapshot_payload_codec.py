@@ -0,0 +1,72 @@
+"""add compressed snapshot payload storage
+
+Revision ID: 0014_add_snapshot_payload_codec
+Revises: 0013_add_snapshot_listing_indexes
+Create Date: 2026-10-17 00:00:00.000000
+"""
+
+import gzip
+import json
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0014_add_snapshot_payload_codec"
+down_revision = "0013_add_snapshot_listing_indexes"
+branch_labels = None
+depends_on = None
+
+DOWNGRADE_BATCH = 200
+
+snapshots = sa.table(
+    "snapshots",
+    sa.column("id", sa.String),
+    sa.column("payload", sa.JSON),
+    sa.column("payload_blob", sa.LargeBinary),
+    sa.column("payload_codec", sa.String),
+)
+
+
+def upgrade():
+    # Existing rows keep their JSON payload; scripts/recompress_snapshots.py moves them over.
+    op.add_column("snapshots", sa.Column("payload_blob", sa.LargeBinary(), nullable=True))
+    op.add_column("snapshots", sa.Column("payload_codec", sa.String(length=16), nullable=True))
+    with op.batch_alter_table("snapshots") as batch:
+        batch.alter_column("payload", existing_type=sa.JSON(), nullable=True)
+
+
+def _decompress(blob, codec):
+    # Frozen copy of the codecs this revision knows about, independent of app code.
+    if codec == "gzip":
+        return gzip.decompress(blob)
+    if codec == "zstd":
+        import zstandard
+
+        return zstandard.ZstdDecompressor().decompress(blob)
+    raise ValueError(f"Unknown payload codec: {codec}")
+
+
+def downgrade():
+    if not op.get_context().as_sql:
+        # Compressed payloads go back into the JSON column before it is made NOT NULL again.
+        bind = op.get_bind()
+        while True:
+            rows = bind.execute(
+                sa.select(snapshots.c.id, snapshots.c.payload_blob, snapshots.c.payload_codec)
+                .where(snapshots.c.payload_codec.isnot(None))
+                .order_by(snapshots.c.id)
+                .limit(DOWNGRADE_BATCH)
+            ).all()
+            if not rows:
+                break
+            for snapshot_id, blob, codec in rows:
+                bind.execute(
+                    snapshots.update()
+                    .where(snapshots.c.id == snapshot_id)
+                    .values(payload=json.loads(_decompress(blob, codec)), payload_blob=None, payload_codec=None)
+                )
+    with op.batch_alter_table("snapshots") as batch:
+        batch.alter_column("payload", existing_type=sa.JSON(), nullable=False)
+    op.drop_column("snapshots", "payload_codec")
+    op.drop_column("snapshots", "payload_blob")
@@ -0,0 +1,111 @@
+"""add content-addressed snapshot chunks and manifests
+
+Revision ID: 0015_add_snapshot_chunks
+Revises: 0014_add_snapshot_payload_codec
+Create Date: 2026-10-17 00:00:00.000000
+"""
+
+import gzip
+import json
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0015_add_snapshot_chunks"
+down_revision = "0014_add_snapshot_payload_codec"
+branch_labels = None
+depends_on = None
+
+DOWNGRADE_BATCH = 200
+
+snapshots = sa.table(
+    "snapshots",
+    sa.column("id", sa.String),
+    sa.column("manifest", sa.JSON),
+    sa.column("payload", sa.JSON),
+)
+snapshot_chunks = sa.table(
+    "snapshot_chunks",
+    sa.column("hash", sa.String),
+    sa.column("codec", sa.String),
+    sa.column("data", sa.LargeBinary),
+)
+
+
+def upgrade():
+    # Existing rows keep their inline payload; scripts/recompress_snapshots.py moves them over.
+    op.create_table(
+        "snapshot_chunks",
+        sa.Column("hash", sa.String(length=32), primary_key=True),
+        sa.Column("codec", sa.String(length=16), nullable=True),
+        sa.Column("data", sa.LargeBinary(), nullable=False),
+        sa.Column("size", sa.Integer(), nullable=False),
+        sa.Column("refcount", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+    )
+    op.create_index("ix_snapshot_chunks_refcount", "snapshot_chunks", ["refcount"])
+    op.add_column("snapshots", sa.Column("manifest", sa.JSON(), nullable=True))
+
+
+def _unpack(data, codec):
+    # Frozen copy of the codecs this revision knows about, independent of app code.
+    if not codec:
+        return data
+    if codec == "gzip":
+        return gzip.decompress(data)
+    if codec == "zstd":
+        import zstandard
+
+        return zstandard.ZstdDecompressor().decompress(data)
+    raise ValueError(f"Unknown payload codec: {codec}")
+
+
+def _refs(manifest):
+    # Manifest values are a chunk hash, or {"frame": hash, "rows": {field: [hashes]}} for
+    # sections whose long lists are stored as row batches (field "" is the section itself).
+    for ref in manifest.values():
+        if isinstance(ref, str):
+            yield ref
+            continue
+        if ref.get("frame"):
+            yield ref["frame"]
+        for digests in ref["rows"].values():
+            yield from digests
+
+
+def _section(ref, sections):
+    if isinstance(ref, str):
+        return sections[ref]
+    rows = {field: [row for digest in digests for row in sections[digest]] for field, digests in ref["rows"].items()}
+    if "" in rows:
+        return rows[""]
+    return {**sections[ref["frame"]], **rows}
+
+
+def downgrade():
+    if not op.get_context().as_sql:
+        # Manifests are reassembled into the inline JSON column before the chunks go.
+        bind = op.get_bind()
+        while True:
+            rows = bind.execute(
+                sa.select(snapshots.c.id, snapshots.c.manifest)
+                .where(snapshots.c.manifest.isnot(None))
+                .order_by(snapshots.c.id)
+                .limit(DOWNGRADE_BATCH)
+            ).all()
+            if not rows:
+                break
+            for snapshot_id, manifest in rows:
+                digests = list(set(_refs(manifest)))
+                chunks = bind.execute(
+                    sa.select(snapshot_chunks.c.hash, snapshot_chunks.c.codec, snapshot_chunks.c.data).where(
+                        snapshot_chunks.c.hash.in_(digests)
+                    )
+                ).all()
+                sections = {digest: json.loads(_unpack(data, codec)) for digest, codec, data in chunks}
+                payload = {key: _section(ref, sections) for key, ref in manifest.items()}
+                bind.execute(snapshots.update().where(snapshots.c.id == snapshot_id).values(payload=payload, manifest=None))
+    op.drop_column("snapshots", "manifest")
+    op.drop_index("ix_snapshot_chunks_refcount", table_name="snapshot_chunks")
+    op.drop_table("snapshot_chunks")
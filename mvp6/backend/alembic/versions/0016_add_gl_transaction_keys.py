@@ -0,0 +1,120 @@
+"""add canonical hash and contact key to gl transactions
+
+Revision ID: 0016_add_gl_transaction_keys
+Revises: 0015_add_snapshot_chunks
+Create Date: 2026-10-17 00:00:00.000000
+"""
+
+import hashlib
+import re
+from datetime import date, datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0016_add_gl_transaction_keys"
+down_revision = "0015_add_snapshot_chunks"
+branch_labels = None
+depends_on = None
+
+BACKFILL_BATCH = 1000
+# Frozen copies of the canonical key (app/txn_hash.py) and doctor contact id
+# (app/effective_ledger.py) as of this revision, so later changes there cannot alter
+# what this migration writes.
+TXN_HASH_BYTES = 16
+FIELD_SEPARATOR = "\x1f"
+DOCTOR_PATTERN = re.compile(r"(?:dr\.?\s+|doctor\s+)([a-z][a-z'\-]*(?:\s+[a-z][a-z'\-]*){0,2})", re.IGNORECASE)
+CONTACT_ID_PATTERN = re.compile(r"[^a-z0-9]+")
+
+gl_transactions = sa.table(
+    "gl_transactions",
+    sa.column("id", sa.String),
+    sa.column("account", sa.String),
+    sa.column("date", sa.String),
+    sa.column("description", sa.Text),
+    sa.column("reference", sa.Text),
+    sa.column("source", sa.Text),
+    sa.column("amount", sa.Float),
+    sa.column("txn_hash", sa.String),
+    sa.column("contact_key", sa.String),
+)
+
+
+def _iso_day(value):
+    value = (value or "").strip()
+    try:
+        return date.fromisoformat(value[:10]).isoformat()
+    except ValueError:
+        pass
+    for fmt in ("%d %b %Y", "%d %B %Y", "%d/%m/%Y"):
+        try:
+            return datetime.strptime(value, fmt).date().isoformat()
+        except ValueError:
+            continue
+    return value
+
+
+def _text(value):
+    return " ".join(str(value or "").split())
+
+
+def _txn_hash(row):
+    amount = f"{round(float(row.amount or 0.0), 2) + 0.0:.2f}"
+    canonical = FIELD_SEPARATOR.join(
+        (_text(row.account), _iso_day(row.date), amount, _text(row.description), _text(row.reference), _text(row.source))
+    )
+    return hashlib.blake2b(canonical.encode(), digest_size=TXN_HASH_BYTES).hexdigest()
+
+
+def _contact_key(row):
+    haystack = f"{row.description or ''} {row.reference or ''}".strip()
+    match = DOCTOR_PATTERN.search(haystack) if haystack else None
+    if not match:
+        return None
+    return CONTACT_ID_PATTERN.sub("-", f"Dr {match.group(1).strip()}".lower()).strip("-")
+
+
+def upgrade():
+    op.add_column("gl_transactions", sa.Column("txn_hash", sa.String(length=32), nullable=True))
+    op.add_column("gl_transactions", sa.Column("contact_key", sa.String(length=255), nullable=True))
+    op.create_index("ix_gl_transactions_tenant_txn_hash", "gl_transactions", ["tenant_id", "txn_hash"])
+    op.create_index("ix_gl_transactions_tenant_contact", "gl_transactions", ["tenant_id", "contact_key"])
+    if op.get_context().as_sql:
+        # Offline: rows are keyed on their next sync; until then deferrals.refresh_deferrals
+        # falls back to scanning the tenant's ledger.
+        return
+
+    bind = op.get_bind()
+    update = (
+        gl_transactions.update()
+        .where(gl_transactions.c.id == sa.bindparam("row_id"))
+        .values(txn_hash=sa.bindparam("new_hash"), contact_key=sa.bindparam("new_contact"))
+    )
+    last_id = ""
+    while True:
+        rows = bind.execute(
+            sa.select(
+                gl_transactions.c.id,
+                gl_transactions.c.account,
+                gl_transactions.c.date,
+                gl_transactions.c.description,
+                gl_transactions.c.reference,
+                gl_transactions.c.source,
+                gl_transactions.c.amount,
+            )
+            .where(gl_transactions.c.id > last_id)
+            .order_by(gl_transactions.c.id)
+            .limit(BACKFILL_BATCH)
+        ).all()
+        if not rows:
+            break
+        bind.execute(update, [{"row_id": row.id, "new_hash": _txn_hash(row), "new_contact": _contact_key(row)} for row in rows])
+        last_id = rows[-1].id
+
+
+def downgrade():
+    op.drop_index("ix_gl_transactions_tenant_contact", table_name="gl_transactions")
+    op.drop_index("ix_gl_transactions_tenant_txn_hash", table_name="gl_transactions")
+    op.drop_column("gl_transactions", "contact_key")
+    op.drop_column("gl_transactions", "txn_hash")
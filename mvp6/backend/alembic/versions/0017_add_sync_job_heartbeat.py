@@ -0,0 +1,26 @@
+"""add sync job heartbeat
+
+Revision ID: 0017_add_sync_job_heartbeat
+Revises: 0016_add_gl_transaction_keys
+Create Date: 2026-10-17 00:00:00.000000
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0017_add_sync_job_heartbeat"
+down_revision = "0016_add_gl_transaction_keys"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Running jobs without a heartbeat count as stale and are requeued on the next sweep.
+    op.add_column("sync_jobs", sa.Column("heartbeat_at", sa.DateTime(timezone=True), nullable=True))
+    op.create_index("ix_sync_jobs_status_heartbeat", "sync_jobs", ["status", "heartbeat_at"])
+
+
+def downgrade():
+    op.drop_index("ix_sync_jobs_status_heartbeat", table_name="sync_jobs")
+    op.drop_column("sync_jobs", "heartbeat_at")
@@ -0,0 +1,156 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+import numpy as np
+
+from .dream_compute import CompiledTemplate, apply_bundled_scenario, compile_template, compute_line_values, dream_result
+from .pl_matrix import PLMatrix
+
+DREAM_CACHE_MAX_BYTES = int(os.environ.get("DREAM_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+LATEST_TEMPLATE_LIMIT = 1024
+
+
+def content_hash(value: Any) -> str:
+    canonical = json.dumps(value, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.blake2b(canonical.encode(), digest_size=16).hexdigest()
+
+
+def pl_hash(pl: PLMatrix) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(json.dumps([pl.months, pl.month_labels, pl.names, pl.sections], separators=(",", ":")).encode())
+    digest.update(np.ascontiguousarray(pl.values, dtype="<f8").tobytes())
+    return digest.hexdigest()
+
+
+class BaseEntry:
+    # Line values and rollups for one (P&L, template) pair, before any scenario.
+    __slots__ = ("compiled", "line_values", "totals")
+
+    def __init__(self, compiled: CompiledTemplate, line_values: np.ndarray, totals: np.ndarray):
+        self.compiled = compiled
+        self.line_values = line_values
+        self.totals = totals
+
+    @property
+    def nbytes(self) -> int:
+        return self.compiled.nbytes + self.line_values.nbytes + self.totals.nbytes
+
+
+class ComputeCache:
+    # Byte-budgeted LRU over two kinds of entry: ("base", pl, template) holds the line
+    # matrix used for incremental recompute, ("result", etag) the finished response.
+    def __init__(self, max_bytes: int = DREAM_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Hashable, Tuple[Any, int]]" = OrderedDict()
+        self._latest_template: "OrderedDict[str, str]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "incremental": 0, "full": 0, "linesRecomputed": 0, "evictions": 0}
+
+    def compute(self, pl: PLMatrix, template: Dict[str, Any], scenario: Optional[Dict[str, Any]] = None) -> Tuple[str, Dict[str, Any]]:
+        pl_key = pl_hash(pl)
+        template_key = content_hash(template)
+        scenario_key = content_hash(scenario if scenario and scenario.get("enabled") else None)
+        etag = content_hash([pl_key, template_key, scenario_key])
+        result = self._get(("result", etag))
+        if result is not None:
+            self._count("hits")
+            return etag, result
+        self._count("misses")
+
+        base = self._get(("base", pl_key, template_key))
+        if base is None:
+            base = self._compute_base(pl, pl_key, template)
+            self._put(("base", pl_key, template_key), base, base.nbytes)
+        with self._lock:
+            self._latest_template[pl_key] = template_key
+            self._latest_template.move_to_end(pl_key)
+            if len(self._latest_template) > LATEST_TEMPLATE_LIMIT:
+                self._latest_template.popitem(last=False)
+
+        totals = apply_bundled_scenario(base.totals, pl, scenario)
+        result = dream_result(pl, base.compiled, base.line_values, totals)
+        self._put(("result", etag), result, len(json.dumps(result, separators=(",", ":"))))
+        return etag, result
+
+    def _compute_base(self, pl: PLMatrix, pl_key: str, template: Dict[str, Any]) -> BaseEntry:
+        compiled = compile_template(template)
+        with self._lock:
+            previous_key = self._latest_template.get(pl_key)
+        previous = self._get(("base", pl_key, previous_key)) if previous_key else None
+        if previous is None:
+            line_values = compute_line_values(pl, compiled)
+            self._count("full")
+            self._count("linesRecomputed", len(compiled.line_ids))
+            return BaseEntry(compiled, line_values, compiled.rollup @ line_values)
+
+        # Same P&L, edited template: reuse rows whose line id and mapping are unchanged and
+        # re-sum only the rest. Rollups are patched by the changed rows when the group
+        # structure is unchanged, otherwise re-multiplied.
+        old = previous.compiled
+        old_rows = {line_id: row for row, line_id in enumerate(old.line_ids)}
+        line_values = np.empty((len(compiled.line_ids), len(pl.months)), dtype=np.float64)
+        stale = []
+        for row, (line_id, accounts) in enumerate(zip(compiled.line_ids, compiled.line_accounts)):
+            old_row = old_rows.get(line_id)
+            if old_row is not None and old.line_accounts[old_row] == accounts:
+                line_values[row] = previous.line_values[old_row]
+            else:
+                stale.append(row)
+        if stale:
+            stale_rows = np.array(stale, dtype=np.intp)
+            line_values[stale_rows] = compute_line_values(pl, compiled, stale_rows)
+        if old.line_ids == compiled.line_ids and np.array_equal(old.rollup, compiled.rollup):
+            totals = previous.totals.copy()
+            if stale:
+                totals += compiled.rollup[:, stale_rows] @ (line_values[stale_rows] - previous.line_values[stale_rows])
+        else:
+            totals = compiled.rollup @ line_values
+        self._count("incremental")
+        self._count("linesRecomputed", len(stale))
+        return BaseEntry(compiled, line_values, totals)
+
+    def _get(self, key: Hashable) -> Any:
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            self._entries.move_to_end(key)
+            return item[0]
+
+    def _put(self, key: Hashable, value: Any, size: int) -> None:
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+                self._counters["evictions"] += 1
+
+    def _count(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self._counters[name] += amount
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self._counters, "entries": len(self._entries), "bytes": self._bytes, "maxBytes": self.max_bytes}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._latest_template.clear()
+            self._bytes = 0
+            for name in self._counters:
+                self._counters[name] = 0
+
+
+compute_cache = ComputeCache()
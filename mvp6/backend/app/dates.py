@@ -0,0 +1,25 @@
+from datetime import date, datetime
+from typing import Optional
+
+from fastapi import HTTPException
+
+
+def parse_iso_date(value: str, field: str) -> date:
+    try:
+        return date.fromisoformat(str(value)[:10])
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=f"{field} must be an ISO date (YYYY-MM-DD)") from exc
+
+
+def gl_txn_date(value: str) -> Optional[date]:
+    value = (value or "").strip()
+    try:
+        return date.fromisoformat(value[:10])
+    except ValueError:
+        pass
+    for fmt in ("%d %b %Y", "%d %B %Y", "%d/%m/%Y"):
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            continue
+    return None
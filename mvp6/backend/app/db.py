@@ -20,3 +20,17 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+def dialect_insert(db, model):
+    # Dialect-specific insert so callers can use ON CONFLICT upserts on Postgres and SQLite.
+    if db.get_bind().dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(model)
+
+
+def chunked(items, size):
+    for idx in range(0, len(items), size):
+        yield items[idx:idx + size]
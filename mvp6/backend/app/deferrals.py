@@ -0,0 +1,194 @@
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from . import models
+from .db import chunked, dialect_insert
+from .effective_ledger import build_effective_ledger, doctor_labels, month_index, month_key, normalize_contact_id, txn_month_index
+from .gl_cube import refresh_gl_cube
+from .gl_store import gl_keys_complete, load_gl_txns, load_matching_gl_txns
+from .txn_hash import is_canonical_hash, legacy_txn_hashes, txn_hashes
+
+DEFERRAL_WRITE_CHUNK = 500
+# Month totals within half a cent of zero are float residue from repeated deltas.
+ZERO_TOLERANCE = 0.005
+
+TotalKey = Tuple[str, str, bool]
+
+
+def affected_txns(
+    txns: List[Dict[str, Any]],
+    hashes: Optional[Iterable[str]],
+    contact_ids: Optional[Iterable[str]],
+) -> List[Dict[str, Any]]:
+    # Transactions an override (by key hash) or doctor rule (by contact id) change touches.
+    if hashes is None and contact_ids is None:
+        return txns
+    wanted_hashes = set(hashes or ())
+    wanted_contacts = set(contact_ids or ())
+    selected = np.zeros(len(txns), dtype=bool)
+    if wanted_hashes:
+        selected |= np.fromiter((key in wanted_hashes for key in txn_hashes(txns)), dtype=bool, count=len(txns))
+        if any(not is_canonical_hash(value) for value in wanted_hashes):
+            selected |= np.fromiter((key in wanted_hashes for key in legacy_txn_hashes(txns)), dtype=bool, count=len(txns))
+    if wanted_contacts:
+        contacts: Dict[str, str] = {}
+        for idx, label in enumerate(doctor_labels(txns)):
+            if label is None:
+                continue
+            if label not in contacts:
+                contacts[label] = normalize_contact_id(label)
+            if contacts[label] in wanted_contacts:
+                selected[idx] = True
+    return [txns[idx] for idx in np.flatnonzero(selected)]
+
+
+def schedule_rows(txns: List[Dict[str, Any]], overrides: List[Any], rules: List[Any]) -> List[Dict[str, Any]]:
+    # Identical GL lines share a key hash and get the same treatment, so their instalments
+    # are combined into one row per (txn_hash, part).
+    ledger = build_effective_ledger(txns, overrides, rules)
+    rows: Dict[Tuple[str, int], Dict[str, Any]] = {}
+
+    def add(key: str, part: int, account: str, month: str, amount: float, non_operating: bool) -> None:
+        row = rows.get((key, part))
+        if row is None:
+            rows[(key, part)] = {
+                "txn_hash": key,
+                "part": part,
+                "account": account,
+                "month": month,
+                "amount": amount,
+                "non_operating": non_operating,
+            }
+        else:
+            row["amount"] += amount
+
+    reversed_txns = set()
+    for row in (ledger.part >= 0).nonzero()[0]:
+        src = int(ledger.source[row])
+        txn = txns[src]
+        if src not in reversed_txns:
+            reversed_txns.add(src)
+            original = month_key(txn_month_index(txn.get("date") or ""))
+            if original:
+                add(ledger.keys[src], -1, txn.get("account") or "", original, -float(txn.get("amount") or 0.0), False)
+        month = month_key(int(ledger.months[row]))
+        if month:
+            add(ledger.keys[src], int(ledger.part[row]), txn.get("account") or "", month, float(ledger.amounts[row]), bool(ledger.non_operating[row]))
+    return list(rows.values())
+
+
+def apply_month_deltas(db: Session, user_id: str, deltas: Dict[TotalKey, float]) -> None:
+    deltas = {key: amount for key, amount in deltas.items() if amount}
+    if not deltas:
+        return
+    values = [
+        {"tenant_id": user_id, "user_id": user_id, "month": month, "account": account, "non_operating": non_operating, "amount": amount}
+        for (month, account, non_operating), amount in deltas.items()
+    ]
+    for chunk in chunked(values, DEFERRAL_WRITE_CHUNK):
+        for value in chunk:
+            value["id"] = models.generate_uuid()
+        stmt = dialect_insert(db, models.DeferralMonthTotal).values(chunk)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["tenant_id", "user_id", "month", "account", "non_operating"],
+            set_={"amount": models.DeferralMonthTotal.amount + stmt.excluded.amount, "updated_at": func.now()},
+        )
+        db.execute(stmt)
+    months = {key[0] for key in deltas}
+    (
+        db.query(models.DeferralMonthTotal)
+        .filter(
+            models.DeferralMonthTotal.tenant_id == user_id,
+            models.DeferralMonthTotal.user_id == user_id,
+            models.DeferralMonthTotal.month.in_(months),
+            models.DeferralMonthTotal.amount.between(-ZERO_TOLERANCE, ZERO_TOLERANCE),
+        )
+        .delete(synchronize_session=False)
+    )
+
+
+def refresh_deferrals(
+    db: Session,
+    user_id: str,
+    hashes: Optional[Iterable[str]] = None,
+    contact_ids: Optional[Iterable[str]] = None,
+) -> int:
+    # Re-expand schedules for the transactions an override/rule write touched (everything
+    # when neither is given) and move the monthly totals by the difference. The caller
+    # commits. Returns the number of schedule rows written.
+    hashes = None if hashes is None else [value for value in hashes if value]
+    full = hashes is None and contact_ids is None
+    connection = db.query(models.XeroConnection).filter(models.XeroConnection.user_id == user_id).first()
+    tenant_id = connection.tenant_id if connection else None
+    if not tenant_id:
+        selected = []
+    elif full or any(not is_canonical_hash(value) for value in hashes or ()) or not gl_keys_complete(db, tenant_id):
+        # Legacy browser keys and lines stored before the key columns are only found by
+        # hashing the ledger itself.
+        selected = affected_txns(load_gl_txns(db, tenant_id), hashes, contact_ids)
+    else:
+        selected = load_matching_gl_txns(db, tenant_id, hashes, contact_ids)
+    overrides = db.query(models.TxnOverride).filter(models.TxnOverride.user_id == user_id, models.TxnOverride.tenant_id == user_id).all()
+    rules = db.query(models.DoctorRule).filter(models.DoctorRule.user_id == user_id, models.DoctorRule.tenant_id == user_id).all()
+    rows = schedule_rows(selected, overrides, rules)
+
+    stale_hashes = set(hashes or ()) | set(txn_hashes(selected))
+    query = db.query(models.DeferralSchedule).filter(
+        models.DeferralSchedule.tenant_id == user_id,
+        models.DeferralSchedule.user_id == user_id,
+    )
+    stale = query.all() if full else [
+        record for chunk in chunked(sorted(stale_hashes), DEFERRAL_WRITE_CHUNK)
+        for record in query.filter(models.DeferralSchedule.txn_hash.in_(chunk)).all()
+    ]
+
+    deltas: Dict[TotalKey, float] = defaultdict(float)
+    for record in stale:
+        deltas[(record.month, record.account, record.non_operating)] -= record.amount
+        db.delete(record)
+    db.flush()
+    for row in rows:
+        deltas[(row["month"], row["account"], row["non_operating"])] += row["amount"]
+        db.add(models.DeferralSchedule(tenant_id=user_id, user_id=user_id, **row))
+    apply_month_deltas(db, user_id, deltas)
+
+    # The GL cube moves with the schedules and with the posting-month cells of the lines
+    # whose treatment may have changed. A full rebuild only follows a GL sync, which
+    # refreshes the synced months itself (refresh_tenant_cubes).
+    touched = {(month_index(month), account) for month, account, _ in deltas}
+    if not full:
+        touched.update((txn_month_index(txn.get("date") or ""), txn.get("account") or "") for txn in selected)
+    refresh_gl_cube(db, user_id, cells=touched)
+    return len(rows)
+
+
+def rebuild_deferrals(db: Session, user_id: str) -> int:
+    # After a GL sync transaction keys may have changed; rebuild everything, but only for
+    # users who defer anything at all. The caller commits.
+    uses_deferrals = (
+        db.query(models.TxnOverride.id).filter(models.TxnOverride.user_id == user_id, models.TxnOverride.treatment == "DEFERRED").first()
+        or db.query(models.DoctorRule.id).filter(models.DoctorRule.user_id == user_id, models.DoctorRule.default_treatment == "DEFERRED").first()
+        or db.query(models.DeferralSchedule.id).filter(models.DeferralSchedule.user_id == user_id).first()
+    )
+    if not uses_deferrals:
+        return 0
+    return refresh_deferrals(db, user_id)
+
+
+def deferral_month_totals(db: Session, user_id: str, from_month: str, to_month: str, include_non_operating: bool = True) -> List[Dict[str, Any]]:
+    query = db.query(models.DeferralMonthTotal).filter(
+        models.DeferralMonthTotal.tenant_id == user_id,
+        models.DeferralMonthTotal.user_id == user_id,
+        models.DeferralMonthTotal.month >= from_month,
+        models.DeferralMonthTotal.month <= to_month,
+    )
+    if not include_non_operating:
+        query = query.filter(models.DeferralMonthTotal.non_operating.is_(False))
+    return [
+        {"month": record.month, "account": record.account, "nonOperating": record.non_operating, "amount": record.amount}
+        for record in query.order_by(models.DeferralMonthTotal.month, models.DeferralMonthTotal.account)
+    ]
@@ -0,0 +1,145 @@
+import bisect
+import itertools
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from sqlalchemy.orm import Session
+
+from . import models
+from .effective_ledger import TREATMENTS, doctor_labels, normalize_contact_id, resolve_treatments
+from .ledger_sync import TOMBSTONE_DOCTOR_RULE, list_etag
+from .txn_hash import legacy_txn_hashes, needs_legacy_hashes, txn_hashes
+
+DOCTOR_PATTERNS_PREF_KEY = "doctor_patterns_v1"
+DEFAULT_DOCTOR_PATTERNS = ["ryan", "roytowski", "teo", "roberts", "ho", "lesslar"]
+CLASSIFIER_CACHE_SIZE = 256
+
+
+class RuleSnapshot(NamedTuple):
+    # Detached copy of a DoctorRule so compiled classifiers can outlive the session.
+    contact_id: str
+    enabled: bool
+    default_treatment: str
+    deferral_start_month: Optional[str]
+    deferral_months: Optional[int]
+    deferral_include_in_operating_kpis: Optional[bool]
+
+
+def compile_patterns(patterns: Sequence[Any], whole_words: bool = False) -> Optional["re.Pattern[str]"]:
+    # One case-insensitive alternation; patterns that do not compile are skipped, as the
+    # browser drops them. whole_words keeps short names like "ho" from matching inside
+    # other words when searching raw descriptions rather than labels.
+    valid = []
+    for pattern in patterns:
+        trimmed = str(pattern or "").strip()
+        if not trimmed:
+            continue
+        try:
+            re.compile(trimmed)
+        except re.error:
+            continue
+        valid.append(rf"\b(?:{trimmed})\b" if whole_words else f"(?:{trimmed})")
+    return re.compile("|".join(valid), re.IGNORECASE) if valid else None
+
+
+class DoctorClassifier:
+    def __init__(self, rules: Sequence[RuleSnapshot], patterns: Sequence[Any]):
+        self.rules = [rule for rule in rules if rule.enabled]
+        self.patterns = list(patterns)
+        self.pattern = compile_patterns(patterns)
+        self.label_pattern = compile_patterns(patterns, whole_words=True)
+
+    def labels(self, txns: Sequence[Dict[str, Any]]) -> List[Optional[str]]:
+        # "Dr <name>" labels as the browser infers them; lines without one are labelled by
+        # the first user pattern they match, in one pass over their joined text.
+        labels = doctor_labels(txns)
+        missing = [idx for idx, label in enumerate(labels) if label is None]
+        if self.label_pattern is None or not missing:
+            return labels
+        texts = [f"{txns[idx].get('description') or ''} {txns[idx].get('reference') or ''}" for idx in missing]
+        ends = list(itertools.accumulate(len(text) + 1 for text in texts))
+        for match in self.label_pattern.finditer("\0".join(texts)):
+            name = match.group(0).strip()
+            if not name or "\0" in name:
+                continue
+            idx = missing[bisect.bisect_right(ends, match.start())]
+            if labels[idx] is None:
+                labels[idx] = f"Dr {name}"
+        return labels
+
+    def classify(self, txns: Sequence[Dict[str, Any]], overrides: Sequence[Any] = (), include_hashes: bool = False) -> Dict[str, Any]:
+        # Transaction hashes are only needed to match overrides, and cost more than the
+        # classification itself, so they are skipped unless asked for or required.
+        labels = self.labels(txns)
+        keys = txn_hashes(txns) if overrides or include_hashes else [""] * len(txns)
+        legacy_keys = legacy_txn_hashes(txns) if needs_legacy_hashes(overrides) else None
+        treatment, _ = resolve_treatments(keys, labels, overrides, self.rules, legacy_keys=legacy_keys)
+
+        distinct: Dict[str, Tuple[str, bool]] = {}
+        for label in set(labels):
+            if label is not None:
+                distinct[label] = (normalize_contact_id(label), bool(self.pattern and self.pattern.search(label)))
+        contact_ids = [distinct[label][0] if label else None for label in labels]
+        pattern_match = [distinct[label][1] if label else False for label in labels]
+        return {
+            "count": len(txns),
+            "hashes": keys if include_hashes else None,
+            "doctorLabels": labels,
+            "contactIds": contact_ids,
+            "doctorMatch": pattern_match,
+            "treatments": [TREATMENTS[code] for code in treatment.tolist()],
+        }
+
+
+_classifiers: "OrderedDict[str, Tuple[str, DoctorClassifier]]" = OrderedDict()
+_classifiers_lock = threading.Lock()
+
+
+def doctor_patterns(db: Session, user_id: str) -> Tuple[List[Any], Any]:
+    record = (
+        db.query(models.UserPreference)
+        .filter(
+            models.UserPreference.key == DOCTOR_PATTERNS_PREF_KEY,
+            models.UserPreference.user_id == user_id,
+            models.UserPreference.tenant_id == user_id,
+        )
+        .first()
+    )
+    patterns = (record.value_json or {}).get("patterns") if record else None
+    return (patterns if isinstance(patterns, list) and patterns else DEFAULT_DOCTOR_PATTERNS), record.updated_at if record else None
+
+
+def get_classifier(db: Session, user_id: str) -> DoctorClassifier:
+    # Compiled once per user and reused until the rules or the pattern preference change.
+    patterns, patterns_updated = doctor_patterns(db, user_id)
+    version = f"{list_etag(db, user_id, models.DoctorRule, TOMBSTONE_DOCTOR_RULE)}|{patterns_updated}"
+    with _classifiers_lock:
+        cached = _classifiers.get(user_id)
+        if cached is not None and cached[0] == version:
+            _classifiers.move_to_end(user_id)
+            return cached[1]
+    rules = [
+        RuleSnapshot(
+            rule.contact_id,
+            rule.enabled,
+            rule.default_treatment,
+            rule.deferral_start_month,
+            rule.deferral_months,
+            rule.deferral_include_in_operating_kpis,
+        )
+        for rule in db.query(models.DoctorRule).filter(models.DoctorRule.user_id == user_id, models.DoctorRule.tenant_id == user_id)
+    ]
+    classifier = DoctorClassifier(rules, patterns)
+    with _classifiers_lock:
+        _classifiers[user_id] = (version, classifier)
+        _classifiers.move_to_end(user_id)
+        while len(_classifiers) > CLASSIFIER_CACHE_SIZE:
+            _classifiers.popitem(last=False)
+    return classifier
+
+
+def clear_classifiers() -> None:
+    with _classifiers_lock:
+        _classifiers.clear()
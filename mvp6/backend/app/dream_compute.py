@@ -0,0 +1,254 @@
+import re
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from fastapi import HTTPException
+
+from .pl_matrix import PLMatrix
+
+# Template groups whose lines roll up into the headline totals (computeDreamTotals).
+ROLLUP_GROUPS = ("rev", "cogs", "opex")
+
+XERO_SECTION_ROLLUPS = {
+    "trading_income": "revenue",
+    "other_income": "revenue",
+    "cost_of_sales": "cogs",
+    "operating_expenses": "opex",
+}
+
+
+def iter_lines(node: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    for child in node.get("children") or []:
+        if child.get("kind") == "line":
+            yield child
+        else:
+            yield from iter_lines(child)
+
+
+def find_group(node: Dict[str, Any], group_id: str) -> Optional[Dict[str, Any]]:
+    if node.get("id") == group_id:
+        return node
+    for child in node.get("children") or []:
+        if child.get("kind") == "group":
+            hit = find_group(child, group_id)
+            if hit is not None:
+                return hit
+    return None
+
+
+class CompiledTemplate:
+    # A template flattened once into COO form: entry k adds account entry_accounts[k]
+    # into line entry_lines[k]. rollup is a (3 x lines) indicator for rev/cogs/opex.
+    __slots__ = ("line_ids", "line_accounts", "entry_lines", "entry_accounts", "rollup")
+
+    def __init__(
+        self,
+        line_ids: List[str],
+        line_accounts: List[Tuple[str, ...]],
+        entry_lines: np.ndarray,
+        entry_accounts: List[str],
+        rollup: np.ndarray,
+    ):
+        self.line_ids = line_ids
+        self.line_accounts = line_accounts
+        self.entry_lines = entry_lines
+        self.entry_accounts = entry_accounts
+        self.rollup = rollup
+
+    @property
+    def nbytes(self) -> int:
+        return self.entry_lines.nbytes + self.rollup.nbytes + 64 * (len(self.entry_accounts) + len(self.line_ids))
+
+
+def compile_template(template: Dict[str, Any]) -> CompiledTemplate:
+    root = template.get("root")
+    if not isinstance(root, dict):
+        raise HTTPException(status_code=400, detail="Template is missing its root group")
+    lines = list(iter_lines(root))
+    line_index = {line["id"]: idx for idx, line in enumerate(lines)}
+
+    entry_lines: List[int] = []
+    entry_accounts: List[str] = []
+    for idx, line in enumerate(lines):
+        for account in line.get("mappedAccounts") or []:
+            entry_lines.append(idx)
+            entry_accounts.append(account)
+
+    rollup = np.zeros((len(ROLLUP_GROUPS), len(lines)), dtype=np.float64)
+    for row, group_id in enumerate(ROLLUP_GROUPS):
+        group = find_group(root, group_id)
+        if group is None:
+            continue
+        for line in iter_lines(group):
+            # Lines are counted once per occurrence, as the browser does.
+            rollup[row, line_index[line["id"]]] += 1.0
+
+    return CompiledTemplate(
+        [line["id"] for line in lines],
+        [tuple(line.get("mappedAccounts") or []) for line in lines],
+        np.array(entry_lines, dtype=np.intp),
+        entry_accounts,
+        rollup,
+    )
+
+
+def compute_line_values(pl: PLMatrix, compiled: CompiledTemplate, lines: Optional[np.ndarray] = None) -> np.ndarray:
+    # Duplicate account names resolve to the last account, like byAccountName in the browser.
+    # With `lines`, only those line rows are computed (in that order).
+    account_rows = {name: row for row, name in enumerate(pl.names)}
+    entry_lines = compiled.entry_lines
+    entry_accounts: Sequence[str] = compiled.entry_accounts
+    out_rows = len(compiled.line_ids)
+    if lines is not None:
+        position = np.full(len(compiled.line_ids), -1, dtype=np.intp)
+        position[lines] = np.arange(len(lines))
+        selected = np.flatnonzero(position[entry_lines] >= 0)
+        entry_lines = position[entry_lines[selected]]
+        entry_accounts = [compiled.entry_accounts[idx] for idx in selected]
+        out_rows = len(lines)
+    resolved = np.array([account_rows.get(name, -1) for name in entry_accounts], dtype=np.intp)
+    mapped = resolved >= 0
+    line_values = np.zeros((out_rows, len(pl.months)), dtype=np.float64)
+    np.add.at(line_values, entry_lines[mapped], pl.values[resolved[mapped]])
+    return line_values
+
+
+def rollup_totals(revenue: np.ndarray, cogs: np.ndarray, opex: np.ndarray) -> Dict[str, List[float]]:
+    return {
+        "revenue": revenue.tolist(),
+        "cogs": cogs.tolist(),
+        "opex": opex.tolist(),
+        "net": (revenue - cogs - opex).tolist(),
+    }
+
+
+def xero_totals(pl: PLMatrix) -> Dict[str, List[float]]:
+    sums = {name: np.zeros(len(pl.months), dtype=np.float64) for name in ("revenue", "cogs", "opex")}
+    for section, values in pl.section_totals().items():
+        target = XERO_SECTION_ROLLUPS.get(section)
+        if target is not None:
+            sums[target] += values
+    return rollup_totals(sums["revenue"], sums["cogs"], sums["opex"])
+
+
+def scenario_number(scenario: Dict[str, Any], key: str, default: float = 0.0) -> float:
+    value = scenario.get(key)
+    return default if value is None else float(value)
+
+
+def compile_matchers(matchers: Sequence[str], fallback: Sequence[str]) -> List["re.Pattern[str]"]:
+    # Case-insensitive patterns; invalid regexes match literally. No usable matcher falls back.
+    patterns = []
+    for matcher in matchers:
+        if not isinstance(matcher, str) or not matcher.strip():
+            continue
+        try:
+            patterns.append(re.compile(matcher.strip(), re.IGNORECASE))
+        except re.error:
+            patterns.append(re.compile(re.escape(matcher.strip()), re.IGNORECASE))
+    return patterns or [re.compile(pattern, re.IGNORECASE) for pattern in fallback]
+
+
+def apply_bundled_scenario(totals: np.ndarray, pl: PLMatrix, scenario: Optional[Dict[str, Any]]) -> np.ndarray:
+    # Port of applyBundledScenario. `totals` is the (3 x months) revenue/cogs/opex block.
+    if not scenario or not scenario.get("enabled"):
+        return totals
+    totals = totals.copy()
+    revenue, cogs, opex = totals
+    n = len(pl.months)
+    rollup_row = {"revenue": revenue, "cogs": cogs, "opex": opex}
+
+    # Replacement rule: remove legacy streams (TMS; optionally consults), then add bundle revenue.
+    tms_accounts = set(scenario.get("legacyTmsAccounts") or [])
+    consult_accounts = set(scenario.get("legacyConsultAccounts") or [])
+    excluded_consults = set(scenario.get("excludedConsultAccounts") or [])
+    include_consults = bool(scenario.get("includeDoctorConsultsInBundle"))
+    if tms_accounts or consult_accounts:
+        for row, (name, section) in enumerate(zip(pl.names, pl.sections)):
+            if not (name in tms_accounts or (include_consults and name in consult_accounts)):
+                continue
+            if name in excluded_consults:
+                continue
+            target = XERO_SECTION_ROLLUPS.get(section)
+            if target is not None:
+                rollup_row[target] -= pl.values[row]
+
+    if scenario.get("machinesEnabled"):
+        machines = max(0.0, scenario_number(scenario, "tmsMachines"))
+        per_week = max(0.0, scenario_number(scenario, "patientsPerMachinePerWeek"))
+        utilisation = min(1.0, max(0.0, scenario_number(scenario, "utilisation")))
+        weeks_per_month = max(0.0, scenario_number(scenario, "weeksPerYear", 52.0) / 12)
+        program_count = machines * per_week * weeks_per_month * utilisation
+    else:
+        program_count = scenario_number(scenario, "programMonthlyCount")
+
+    cba_count = scenario_number(scenario, "cbaMonthlyCount")
+    cba_revenue = cba_count * scenario_number(scenario, "cbaPrice")
+    program_revenue = program_count * scenario_number(scenario, "programPrice")
+
+    state = scenario.get("state")
+    mri_default = 750.0 if state == "WA" else 0.0 if state == "VIC" else 380.0
+    payout_factor = 1 - min(1.0, max(0.0, scenario_number(scenario, "doctorServiceFeePct", 15.0) / 100))
+
+    def doctor_actual(fee: float) -> float:
+        return fee * payout_factor
+
+    cba_costs_per = (
+        (scenario_number(scenario, "cbaMriCost", mri_default) if scenario.get("cbaIncludeMRI") else 0.0)
+        + (scenario_number(scenario, "cbaQuicktomeCost") if scenario.get("cbaIncludeQuicktome") else 0.0)
+        + (scenario_number(scenario, "cbaCreyosCost") if scenario.get("cbaIncludeCreyos") else 0.0)
+        + (
+            doctor_actual(scenario_number(scenario, "cbaInitialConsultFee")) * scenario_number(scenario, "cbaInitialConsultCount")
+            if scenario.get("cbaIncludeInitialConsult")
+            else 0.0
+        )
+        + scenario_number(scenario, "cbaOtherCogsPerAssessment")
+    )
+    # cgTMS: Creyos is billed once in CBA (not repeated here)
+    program_consults = (
+        doctor_actual(scenario_number(scenario, "prog6WkConsultFee")) * scenario_number(scenario, "prog6WkConsultCount") * 2
+        if scenario.get("progInclude6WkConsult")
+        else 0.0
+    )
+    program_costs_per = (
+        (scenario_number(scenario, "progMriCost", mri_default) if scenario.get("progIncludePostMRI") else 0.0)
+        + (scenario_number(scenario, "progQuicktomeCost") if scenario.get("progIncludeQuicktome") else 0.0)
+        + program_consults
+        + (scenario_number(scenario, "progAdjunctAllowance") if scenario.get("progIncludeAdjunctAllowance") else 0.0)
+        + scenario_number(scenario, "progTreatmentDeliveryCost")
+        + scenario_number(scenario, "progOtherCogsPerProgram")
+    )
+    add_costs = bool(scenario.get("addBundleCostsToScenario"))
+    revenue += cba_revenue + program_revenue
+    cogs += (cba_count * cba_costs_per if add_costs else 0.0) + (program_count * program_costs_per if add_costs else 0.0)
+
+    if scenario.get("rentEnabled"):
+        patterns = compile_matchers(scenario.get("rentAccountMatchers") or [], ("rent", "lease"))
+        rent_rows = [
+            row for row, (name, section) in enumerate(zip(pl.names, pl.sections))
+            if section == "operating_expenses" and any(pattern.search(name) for pattern in patterns)
+        ]
+        base_rent = pl.values[rent_rows].sum(axis=0) if rent_rows else np.zeros(n, dtype=np.float64)
+        if scenario.get("rentMode") == "fixed":
+            opex += scenario_number(scenario, "rentFixedMonthly") - base_rent
+        else:
+            growth = (1 + scenario_number(scenario, "rentPercentPerMonth") / 100) ** np.arange(n)
+            opex += base_rent * growth - base_rent
+    return totals
+
+
+def dream_result(pl: PLMatrix, compiled: CompiledTemplate, line_values: np.ndarray, totals: np.ndarray) -> Dict[str, Any]:
+    revenue, cogs, opex = totals
+    return {
+        "months": pl.months,
+        "monthLabels": pl.month_labels,
+        "byLineId": dict(zip(compiled.line_ids, line_values.tolist())),
+        "totals": rollup_totals(revenue, cogs, opex),
+        "xeroTotals": xero_totals(pl),
+    }
+
+
+def compute_dream(pl: PLMatrix, compiled: CompiledTemplate, scenario: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    line_values = compute_line_values(pl, compiled)
+    totals = apply_bundled_scenario(compiled.rollup @ line_values, pl, scenario)
+    return dream_result(pl, compiled, line_values, totals)
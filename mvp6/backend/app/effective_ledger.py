@@ -0,0 +1,307 @@
+import bisect
+import itertools
+import re
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .dates import gl_txn_date
+from .pl_matrix import PLMatrix
+from .txn_hash import legacy_txn_hashes, needs_legacy_hashes, txn_hashes
+
+TREATMENTS = ("OPERATING", "NON_OPERATING", "DEFERRED", "EXCLUDE")
+OPERATING, NON_OPERATING, DEFERRED, EXCLUDE = range(len(TREATMENTS))
+INCOME_SECTIONS = {"trading_income", "other_income"}
+DEFAULT_DEFERRAL_MONTHS = 12
+
+DOCTOR_PATTERN = re.compile(r"(?:dr\.?\s+|doctor\s+)([a-z][a-z'\-]*(?:\s+[a-z][a-z'\-]*){0,2})", re.IGNORECASE)
+# DOCTOR_PATTERN for already-lowercased text; avoiding IGNORECASE makes the scan much cheaper.
+LOWER_DOCTOR_PATTERN = re.compile(r"d(?:r\.?\s+|octor\s+)([a-z][a-z'\-]*(?:\s+[a-z][a-z'\-]*){0,2})")
+MONTH_KEY_PATTERN = re.compile(r"^(\d{4})-(\d{2})$")
+CONTACT_ID_PATTERN = re.compile(r"[^a-z0-9]+")
+
+
+def infer_doctor_label(description: str, reference: str) -> Optional[str]:
+    haystack = f"{description} {reference}".strip()
+    if not haystack:
+        return None
+    match = DOCTOR_PATTERN.search(haystack)
+    return f"Dr {match.group(1).strip()}" if match else None
+
+
+def normalize_contact_id(label: str) -> str:
+    return CONTACT_ID_PATTERN.sub("-", label.lower()).strip("-")
+
+
+def month_index(value: Optional[str]) -> int:
+    # Months are counted as year * 12 + (month - 1); -1 when there is no usable month.
+    if not value:
+        return -1
+    match = MONTH_KEY_PATTERN.match(value)
+    if not match or not 1 <= int(match.group(2)) <= 12:
+        return -1
+    return int(match.group(1)) * 12 + int(match.group(2)) - 1
+
+
+def month_key(index: int) -> Optional[str]:
+    if index < 0:
+        return None
+    return f"{index // 12:04d}-{index % 12 + 1:02d}"
+
+
+def txn_month_index(value: str) -> int:
+    index = month_index((value or "")[:7])
+    if index >= 0:
+        return index
+    parsed = gl_txn_date(value)
+    return parsed.year * 12 + parsed.month - 1 if parsed else -1
+
+
+def pick(*values: Any) -> Any:
+    # JavaScript's `a ?? b ?? c`.
+    for value in values:
+        if value is not None:
+            return value
+    return None
+
+
+def js_round(value: np.ndarray) -> np.ndarray:
+    # Math.round rounds halves towards +infinity.
+    return np.floor(value + 0.5)
+
+
+class EffectiveLedger:
+    # Columnar result of buildEffectiveLedger. Effective row r comes from txns[source[r]];
+    # part[r] is the deferral instalment (-1 for rows that are not deferred).
+    def __init__(
+        self,
+        txns: Sequence[Dict[str, Any]],
+        keys: List[str],
+        doctor_labels: List[Optional[str]],
+        treatment: np.ndarray,
+        deferral: Dict[str, np.ndarray],
+        source: np.ndarray,
+        part: np.ndarray,
+        months: np.ndarray,
+        amounts: np.ndarray,
+        non_operating: np.ndarray,
+    ):
+        self.txns = txns
+        self.keys = keys
+        self.doctor_labels = doctor_labels
+        self.treatment = treatment
+        self.deferral = deferral
+        self.source = source
+        self.part = part
+        self.months = months
+        self.amounts = amounts
+        self.non_operating = non_operating
+
+    def __len__(self) -> int:
+        return int(self.source.size)
+
+    def rows(self, offset: int = 0, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        end = len(self) if limit is None else min(len(self), offset + limit)
+        out = []
+        for row in range(offset, end):
+            src = int(self.source[row])
+            txn = self.txns[src]
+            key = self.keys[src]
+            treatment = int(self.treatment[src])
+            label = self.doctor_labels[src]
+            source_text = (txn.get("source") or "").lower()
+            description = (txn.get("description") or "").lower()
+            is_payment = "payment" in source_text or "payment" in description
+            is_bill = ("payable" in (txn.get("account") or "").lower() or "bill" in source_text or "bill" in description) and not is_payment
+            deferral = None
+            if treatment == DEFERRED:
+                deferral = {
+                    "method": "STRAIGHT_LINE",
+                    "startMonth": month_key(int(self.deferral["start"][src])),
+                    "months": int(self.deferral["months"][src]),
+                    "includeInOperatingKPIs": bool(self.deferral["include"][src]),
+                }
+            part = int(self.part[row])
+            month = month_key(int(self.months[row]))
+            out.append({
+                **txn,
+                "amount": float(self.amounts[row]),
+                "date": f"{month}-01" if part >= 0 else txn.get("date"),
+                "key": f"{key}-def-{part}" if part >= 0 else key,
+                "month": month,
+                "treatment": TREATMENTS[treatment],
+                "nonOperating": bool(self.non_operating[row]),
+                "deferral": deferral,
+                "originalDate": txn.get("date"),
+                "doctorContactId": normalize_contact_id(label) if label else None,
+                "doctorLabel": label,
+                "billId": pick(txn.get("reference"), txn.get("description"), key),
+                "isBill": is_bill,
+                "isPayment": is_payment,
+            })
+        return out
+
+    def aggregate(self, pl: Optional[PLMatrix] = None, months: Optional[List[str]] = None, include_non_operating: bool = True) -> Dict[str, Any]:
+        # buildEffectivePl: with a P&L, ledger totals replace the values of the accounts they
+        # touch, and income accounts are sign-flipped. Without one, the result is the raw
+        # account x month movement over `months`.
+        month_keys = pl.months if pl is not None else list(months or [])
+        column = {month_index(key): idx for idx, key in enumerate(month_keys)}
+        keep = np.ones(len(self), dtype=bool) if include_non_operating else ~self.non_operating
+        columns = np.array([column.get(int(value), -1) for value in self.months], dtype=np.intp)
+        keep &= columns >= 0
+
+        account_names = [self.txns[int(src)].get("account") or "" for src in self.source]
+        row_accounts: Dict[str, int] = {}
+        account_idx = np.array([row_accounts.setdefault(name, len(row_accounts)) for name in account_names], dtype=np.intp)
+        sections = dict(zip(pl.names, pl.sections)) if pl is not None else {}
+        flip = np.array([-1.0 if sections.get(name) in INCOME_SECTIONS else 1.0 for name in row_accounts], dtype=np.float64)
+
+        ledger = np.zeros((len(row_accounts), len(month_keys)), dtype=np.float64)
+        np.add.at(ledger, (account_idx[keep], columns[keep]), self.amounts[keep] * flip[account_idx[keep]])
+        touched = np.zeros(len(row_accounts), dtype=bool)
+        touched[account_idx[keep]] = True
+
+        accounts = []
+        if pl is not None:
+            for row, (name, section) in enumerate(zip(pl.names, pl.sections)):
+                idx = row_accounts.get(name)
+                values = ledger[idx] if idx is not None and touched[idx] else pl.values[row]
+                accounts.append({"name": name, "section": section, "values": values.tolist(), "total": float(values.sum())})
+            labels = pl.month_labels
+        else:
+            for name, idx in row_accounts.items():
+                if touched[idx]:
+                    accounts.append({"name": name, "section": None, "values": ledger[idx].tolist(), "total": float(ledger[idx].sum())})
+            labels = month_keys
+        return {"months": month_keys, "monthLabels": labels, "accounts": accounts}
+
+
+def doctor_labels(txns: Sequence[Dict[str, Any]]) -> List[Optional[str]]:
+    # One regex pass over every description/reference joined by NUL instead of a search
+    # per transaction. A match can never span a NUL (it is neither a letter nor
+    # whitespace), so the first match in each segment is what infer_doctor_label returns.
+    texts = [f"{txn.get('description') or ''} {txn.get('reference') or ''}" for txn in txns]
+    joined = "\0".join(texts)
+    lowered = joined.lower()
+    if len(lowered) != len(joined):
+        # A few characters change length when lowercased; spans would no longer line up.
+        return [infer_doctor_label(txn.get("description") or "", txn.get("reference") or "") for txn in txns]
+    ends = list(itertools.accumulate(len(text) + 1 for text in texts))
+    labels: List[Optional[str]] = [None] * len(texts)
+    for match in LOWER_DOCTOR_PATTERN.finditer(lowered):
+        segment = bisect.bisect_right(ends, match.start())
+        if labels[segment] is None:
+            labels[segment] = f"Dr {joined[match.start(1):match.end(1)].strip()}"
+    return labels
+
+
+def resolve_treatments(
+    keys: Sequence[str],
+    labels: Sequence[Optional[str]],
+    overrides: Iterable[Any],
+    doctor_rules: Iterable[Any],
+    months: Optional[np.ndarray] = None,
+    legacy_keys: Optional[Sequence[str]] = None,
+) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+    # Vector form of resolveTreatment: treatment codes plus deferral start/months/include.
+    # Overrides match on the canonical key first, then on the legacy browser key.
+    count = len(keys)
+    override_map = {override.hash: override for override in overrides if override.hash}
+    rule_map = {rule.contact_id: rule for rule in doctor_rules if rule.enabled}
+    treatment = np.full(count, OPERATING, dtype=np.int8)
+    deferral_start = months.copy() if months is not None else np.full(count, -1, dtype=np.int64)
+    deferral_months = np.full(count, DEFAULT_DEFERRAL_MONTHS, dtype=np.float64)
+    deferral_include = np.ones(count, dtype=bool)
+    if not override_map and not rule_map:
+        return treatment, {"start": deferral_start, "months": deferral_months, "include": deferral_include}
+
+    # Resolution only depends on which override and which rule apply, so resolve each
+    # distinct (override, rule) pair once and scatter the results back to the rows.
+    override_list = list(override_map.values())
+    override_index = {txn_hash: idx for idx, txn_hash in enumerate(override_map)}
+    rule_list = list(rule_map.values())
+    rule_index = {contact_id: idx for idx, contact_id in enumerate(rule_map)}
+    label_rules = {label: rule_index.get(normalize_contact_id(label), -1) for label in set(labels) if label}
+    row_override = np.fromiter((override_index.get(key, -1) for key in keys), dtype=np.int64, count=count)
+    if legacy_keys is not None:
+        legacy = np.fromiter((override_index.get(key, -1) for key in legacy_keys), dtype=np.int64, count=count)
+        row_override = np.where(row_override >= 0, row_override, legacy)
+    row_rule = np.fromiter((label_rules.get(label, -1) for label in labels), dtype=np.int64, count=count)
+    touched = (row_override >= 0) | (row_rule >= 0)
+    if not touched.any():
+        return treatment, {"start": deferral_start, "months": deferral_months, "include": deferral_include}
+    pairs, inverse = np.unique(
+        row_override[touched] * (len(rule_list) + 1) + row_rule[touched] + 1,
+        return_inverse=True,
+    )
+    pair_treatment = np.empty(len(pairs), dtype=np.int8)
+    pair_start = np.full(len(pairs), -1, dtype=np.int64)
+    pair_months = np.full(len(pairs), DEFAULT_DEFERRAL_MONTHS, dtype=np.float64)
+    pair_include = np.ones(len(pairs), dtype=bool)
+    for idx, pair in enumerate(pairs.tolist()):
+        override_idx, rule_idx = divmod(pair, len(rule_list) + 1)
+        override = override_list[override_idx] if override_idx >= 0 else None
+        rule = rule_list[rule_idx - 1] if rule_idx > 0 else None
+        resolved = pick(getattr(override, "treatment", None), getattr(rule, "default_treatment", None), "OPERATING")
+        pair_treatment[idx] = TREATMENTS.index(resolved) if resolved in TREATMENTS else OPERATING
+        if pair_treatment[idx] != DEFERRED:
+            continue
+        pair_start[idx] = month_index(pick(getattr(override, "deferral_start_month", None), getattr(rule, "deferral_start_month", None)))
+        pair_months[idx] = pick(getattr(override, "deferral_months", None), getattr(rule, "deferral_months", None), DEFAULT_DEFERRAL_MONTHS)
+        pair_include[idx] = pick(
+            getattr(override, "deferral_include_in_operating_kpis", None),
+            getattr(rule, "deferral_include_in_operating_kpis", None),
+            True,
+        )
+    treatment[touched] = pair_treatment[inverse]
+    deferral_start[touched] = np.where(pair_start[inverse] >= 0, pair_start[inverse], deferral_start[touched])
+    deferral_months[touched] = pair_months[inverse]
+    deferral_include[touched] = pair_include[inverse]
+    return treatment, {"start": deferral_start, "months": deferral_months, "include": deferral_include}
+
+
+def build_effective_ledger(
+    txns: Sequence[Dict[str, Any]],
+    overrides: Iterable[Any] = (),
+    doctor_rules: Iterable[Any] = (),
+) -> EffectiveLedger:
+    count = len(txns)
+    overrides = list(overrides)
+    keys = txn_hashes(txns)
+    legacy_keys = legacy_txn_hashes(txns) if needs_legacy_hashes(overrides) else None
+    labels = doctor_labels(txns)
+    months = np.fromiter((txn_month_index(txn.get("date") or "") for txn in txns), dtype=np.int64, count=count)
+    amounts = np.fromiter((float(txn.get("amount") or 0.0) for txn in txns), dtype=np.float64, count=count)
+    treatment, deferral = resolve_treatments(keys, labels, overrides, doctor_rules, months, legacy_keys)
+    deferral_start, deferral_months, deferral_include = deferral["start"], deferral["months"], deferral["include"]
+
+    # Expand deferred lines into straight-line instalments in one batch, in cents, with
+    # the rounding remainder on the last instalment (buildDeferralSchedule).
+    instalments = np.where(treatment == DEFERRED, np.maximum(1, js_round(deferral_months)).astype(np.int64), 1)
+    instalments[treatment == EXCLUDE] = 0
+    source = np.repeat(np.arange(count), instalments)
+    first_row = np.cumsum(instalments) - instalments
+    part = np.arange(source.size) - first_row[source]
+    deferred = treatment[source] == DEFERRED
+
+    cents = js_round(amounts * 100)
+    base = np.trunc(cents / instalments.clip(min=1))
+    remainder = cents - base * instalments
+    last = part == instalments[source] - 1
+    row_amounts = np.where(deferred, (base[source] + np.where(last, remainder[source], 0)) / 100, amounts[source])
+    row_months = np.where(deferred, np.where(deferral_start[source] >= 0, deferral_start[source] + part, -1), months[source])
+    non_operating = np.where(deferred, ~deferral_include[source], treatment[source] == NON_OPERATING)
+
+    return EffectiveLedger(
+        txns,
+        keys,
+        labels,
+        treatment,
+        {"start": deferral_start, "months": instalments, "include": deferral_include},
+        source,
+        np.where(deferred, part, -1),
+        row_months,
+        row_amounts,
+        non_operating,
+    )
@@ -0,0 +1,267 @@
+from collections import defaultdict
+from datetime import date, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from . import models
+from .db import chunked, dialect_insert
+from .effective_ledger import DEFERRED, EXCLUDE, TREATMENTS, build_effective_ledger, month_index, month_key, txn_month_index
+from .gl_store import load_gl_txns
+
+CUBE_WRITE_CHUNK = 500
+
+# (month, account, treatment, non_operating) -> [amount, count]
+CellKey = Tuple[str, str, str, bool]
+
+
+def month_runs(months: Iterable[int]) -> List[Tuple[int, int]]:
+    # Month indexes collapsed into inclusive (first, last) runs of consecutive months.
+    runs: List[Tuple[int, int]] = []
+    for index in sorted(set(months)):
+        if runs and index == runs[-1][1] + 1:
+            runs[-1] = (runs[-1][0], index)
+        else:
+            runs.append((index, index))
+    return runs
+
+
+def month_bounds(first: int, last: int) -> Tuple[date, date]:
+    following = last + 1
+    return date(first // 12, first % 12 + 1, 1), date(following // 12, following % 12 + 1, 1) - timedelta(days=1)
+
+
+def months_between(start: date, end: date) -> List[int]:
+    return list(range(start.year * 12 + start.month - 1, end.year * 12 + end.month))
+
+
+def ledger_cells(
+    txns: Sequence[Dict[str, Any]],
+    overrides: Sequence[Any],
+    rules: Sequence[Any],
+    months: Optional[Set[int]] = None,
+) -> Dict[CellKey, List[float]]:
+    # Lines summed in their own posting month by treatment. Excluded lines are kept under
+    # EXCLUDE so they stay visible; deferred instalments come from the schedules instead.
+    ledger = build_effective_ledger(txns, overrides, rules)
+    account_ids: Dict[str, int] = {}
+    accounts = np.fromiter(
+        (account_ids.setdefault(txn.get("account") or "", len(account_ids)) for txn in txns), dtype=np.int64, count=len(txns)
+    )
+    rows = np.flatnonzero(ledger.part < 0)
+    src = ledger.source[rows]
+    row_months = ledger.months[rows]
+    treatment = ledger.treatment[src].astype(np.int64)
+    non_operating = ledger.non_operating[rows].astype(np.int64)
+    amounts = ledger.amounts[rows]
+    excluded = np.flatnonzero(ledger.treatment == EXCLUDE)
+    if excluded.size:
+        src = np.concatenate([src, excluded])
+        row_months = np.concatenate([row_months, [txn_month_index(txns[idx].get("date") or "") for idx in excluded]])
+        treatment = np.concatenate([treatment, np.full(excluded.size, EXCLUDE, dtype=np.int64)])
+        non_operating = np.concatenate([non_operating, np.zeros(excluded.size, dtype=np.int64)])
+        amounts = np.concatenate([amounts, [float(txns[idx].get("amount") or 0.0) for idx in excluded]])
+
+    keep = row_months >= 0
+    if months is not None:
+        keep &= np.isin(row_months, list(months))
+    cells: Dict[CellKey, List[float]] = defaultdict(lambda: [0.0, 0])
+    if not keep.any():
+        return cells
+    columns = np.stack([accounts[src], row_months, treatment, non_operating], axis=1)[keep]
+    unique, inverse = np.unique(columns, axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    sums = np.bincount(inverse, weights=amounts[keep], minlength=len(unique))
+    counts = np.bincount(inverse, minlength=len(unique))
+    names = list(account_ids)
+    for (account, month, code, flag), amount, count in zip(unique.tolist(), sums.tolist(), counts.tolist()):
+        cells[(month_key(month), names[account], TREATMENTS[code], bool(flag))] = [amount, count]
+    return cells
+
+
+def add_schedule_cells(
+    db: Session,
+    user_id: str,
+    cells: Dict[CellKey, List[float]],
+    months: Optional[List[str]] = None,
+    accounts: Optional[List[str]] = None,
+) -> None:
+    query = db.query(
+        models.DeferralSchedule.month,
+        models.DeferralSchedule.account,
+        models.DeferralSchedule.non_operating,
+        models.DeferralSchedule.amount,
+    ).filter(
+        models.DeferralSchedule.tenant_id == user_id,
+        models.DeferralSchedule.user_id == user_id,
+        models.DeferralSchedule.part >= 0,
+    )
+    if accounts is not None:
+        query = query.filter(models.DeferralSchedule.account.in_(accounts))
+    batches = [query] if months is None else [
+        query.filter(models.DeferralSchedule.month.in_(chunk)) for chunk in chunked(months, CUBE_WRITE_CHUNK)
+    ]
+    for batch in batches:
+        for month, account, non_operating, amount in batch:
+            cell = cells[(month, account, TREATMENTS[DEFERRED], bool(non_operating))]
+            cell[0] += amount
+            cell[1] += 1
+
+
+def refresh_gl_cube(
+    db: Session,
+    user_id: str,
+    months: Optional[Iterable[int]] = None,
+    cells: Optional[Iterable[Tuple[int, str]]] = None,
+) -> int:
+    # Recompute the user's cells from the stored GL, current overrides/rules and the
+    # deferral schedules: every account in `months` (month indexes) after a GL sync, only
+    # the (month index, account) `cells` an override/rule write touched, or everything
+    # when neither is given. Partial refreshes are skipped until the cube has been built
+    # in full (ensure_gl_cube). The caller commits.
+    #
+    # Cells are keyed by user (tenant_id == user_id, as in the other ledger tables) rather
+    # than by Xero tenant: two users on one Xero organisation see the same GL through
+    # different overrides and doctor rules, so their cubes differ.
+    connection = db.query(models.XeroConnection).filter(models.XeroConnection.user_id == user_id).first()
+    tenant_id = connection.tenant_id if connection else None
+    state = db.query(models.GLCubeState).filter(models.GLCubeState.user_id == user_id).first()
+    full = months is None and cells is None
+    # Month index -> accounts to recompute (None: every account).
+    scope: Dict[int, Optional[Set[str]]] = {}
+    for index in months or ():
+        scope[index] = None
+    for index, account in cells or ():
+        if scope.get(index, set()) is not None:
+            scope.setdefault(index, set()).add(account)
+    scope = {index: accounts for index, accounts in scope.items() if index >= 0}
+    if not full and (not scope or state is None or state.gl_tenant_id != tenant_id):
+        return 0
+    db.flush()
+
+    overrides = db.query(models.TxnOverride).filter(models.TxnOverride.user_id == user_id, models.TxnOverride.tenant_id == user_id).all()
+    rules = db.query(models.DoctorRule).filter(models.DoctorRule.user_id == user_id, models.DoctorRule.tenant_id == user_id).all()
+    month_keys = None if full else [month_key(index) for index in sorted(scope)]
+    accounts = None
+    if not full and all(value is not None for value in scope.values()):
+        accounts = sorted(set().union(*scope.values()))
+    if not tenant_id:
+        txns = []
+    elif full:
+        txns = load_gl_txns(db, tenant_id)
+    else:
+        txns = [
+            txn
+            for first, last in month_runs(scope)
+            for txn in load_gl_txns(db, tenant_id, *month_bounds(first, last), accounts=accounts)
+        ]
+    fresh = ledger_cells(txns, overrides, rules, None if full else set(scope))
+    add_schedule_cells(db, user_id, fresh, month_keys, accounts)
+    if not full:
+        wanted = {month_key(index): value for index, value in scope.items()}
+        fresh = {key: value for key, value in fresh.items() if wanted[key[0]] is None or key[1] in wanted[key[0]]}
+
+    query = db.query(models.GLCubeCell).filter(models.GLCubeCell.tenant_id == user_id, models.GLCubeCell.user_id == user_id)
+    if full:
+        query.delete(synchronize_session=False)
+    else:
+        whole_months = [month_key(index) for index, value in scope.items() if value is None]
+        for chunk in chunked(whole_months, CUBE_WRITE_CHUNK):
+            query.filter(models.GLCubeCell.month.in_(chunk)).delete(synchronize_session=False)
+        for index, value in scope.items():
+            if value is not None:
+                query.filter(models.GLCubeCell.month == month_key(index), models.GLCubeCell.account.in_(sorted(value))).delete(
+                    synchronize_session=False
+                )
+    values = [
+        {
+            "id": models.generate_uuid(),
+            "tenant_id": user_id,
+            "user_id": user_id,
+            "month": month,
+            "account": account,
+            "treatment": treatment,
+            "non_operating": non_operating,
+            "amount": amount,
+            "count": count,
+        }
+        for (month, account, treatment, non_operating), (amount, count) in fresh.items()
+    ]
+    for chunk in chunked(values, CUBE_WRITE_CHUNK):
+        db.execute(dialect_insert(db, models.GLCubeCell).values(chunk))
+
+    if full:
+        if not tenant_id:
+            if state is not None:
+                db.delete(state)
+        elif state is None:
+            db.add(models.GLCubeState(user_id=user_id, gl_tenant_id=tenant_id, built_at=models.utc_now()))
+        else:
+            state.gl_tenant_id = tenant_id
+            state.built_at = models.utc_now()
+    return len(values)
+
+
+def ensure_gl_cube(db: Session, user_id: str) -> bool:
+    # Build the cube in full on first use, or when the user has switched Xero tenant.
+    # Returns whether it was (re)built; the caller commits.
+    connection = db.query(models.XeroConnection).filter(models.XeroConnection.user_id == user_id).first()
+    state = db.query(models.GLCubeState).filter(models.GLCubeState.user_id == user_id).first()
+    tenant_id = connection.tenant_id if connection else None
+    if tenant_id and (state is None or state.gl_tenant_id != tenant_id):
+        refresh_gl_cube(db, user_id)
+        return True
+    return False
+
+
+def refresh_tenant_cubes(db: Session, tenant_id: str, start: date, end: date) -> None:
+    # A GL sync replaced [start, end] for the tenant; refresh those months for every user
+    # on it. The caller commits.
+    months = months_between(start, end)
+    connections = db.query(models.XeroConnection.user_id).filter(models.XeroConnection.tenant_id == tenant_id).all()
+    for (user_id,) in connections:
+        refresh_gl_cube(db, user_id, months)
+
+
+def cube_cells(
+    db: Session,
+    user_id: str,
+    from_month: str,
+    to_month: str,
+    accounts: Optional[List[str]] = None,
+    include_non_operating: bool = True,
+) -> List[models.GLCubeCell]:
+    query = db.query(models.GLCubeCell).filter(
+        models.GLCubeCell.tenant_id == user_id,
+        models.GLCubeCell.user_id == user_id,
+        models.GLCubeCell.month >= from_month,
+        models.GLCubeCell.month <= to_month,
+    )
+    if accounts:
+        query = query.filter(models.GLCubeCell.account.in_(accounts))
+    if not include_non_operating:
+        query = query.filter(models.GLCubeCell.non_operating.is_(False))
+    return query.order_by(models.GLCubeCell.account, models.GLCubeCell.month).all()
+
+
+def cube_aggregate(cells: List[models.GLCubeCell], from_month: str, to_month: str) -> Dict[str, Any]:
+    # Same shape as EffectiveLedger.aggregate without a P&L: raw account x month movement.
+    month_keys = [month_key(index) for index in range(month_index(from_month), month_index(to_month) + 1)]
+    column = {key: idx for idx, key in enumerate(month_keys)}
+    values: Dict[str, np.ndarray] = {}
+    counts: Dict[str, int] = defaultdict(int)
+    for cell in cells:
+        if cell.treatment == TREATMENTS[EXCLUDE]:
+            continue
+        row = values.setdefault(cell.account, np.zeros(len(month_keys), dtype=np.float64))
+        row[column[cell.month]] += cell.amount
+        counts[cell.account] += cell.count
+    return {
+        "months": month_keys,
+        "monthLabels": month_keys,
+        "accounts": [
+            {"name": name, "section": None, "values": row.tolist(), "total": float(row.sum()), "count": counts[name]}
+            for name, row in values.items()
+        ],
+    }
@@ -0,0 +1,228 @@
+import hashlib
+import os
+from datetime import date, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from . import models
+from .dates import gl_txn_date
+from .db import dialect_insert, chunked
+from .effective_ledger import doctor_labels, normalize_contact_id
+from .txn_hash import TXN_HASH_BYTES, needs_legacy_hashes, rehash_plan, txn_hashes
+
+XERO_GL_RECHECK_DAYS = max(0, int(os.environ.get("XERO_GL_RECHECK_DAYS", "7")))
+
+GL_QUERY_CHUNK = 500
+GL_TXN_FIELDS = ("account", "date", "source", "description", "reference", "debit", "credit", "amount")
+
+
+def merge_account_order(order: List[str], accounts: Iterable[str]) -> List[str]:
+    # Insert unseen accounts after the account that preceded them, keeping Xero's section order.
+    merged = list(order)
+    seen = set(merged)
+    previous = None
+    for account in accounts:
+        if account not in seen:
+            position = merged.index(previous) + 1 if previous is not None else 0
+            merged.insert(position, account)
+            seen.add(account)
+        previous = account
+    return merged
+
+
+def occurrence_keys(canonical: List[str]) -> List[str]:
+    # Stored-row identity: the canonical key, with identical lines after the first told
+    # apart by occurrence.
+    seen: Dict[str, int] = {}
+    hashes = []
+    for key in canonical:
+        occurrence = seen.get(key, 0)
+        seen[key] = occurrence + 1
+        if occurrence:
+            key = hashlib.blake2b(f"{key}|{occurrence}".encode(), digest_size=TXN_HASH_BYTES).hexdigest()
+        hashes.append(key)
+    return hashes
+
+
+def gl_txn_hashes(txns: List[Dict[str, Any]]) -> List[str]:
+    return occurrence_keys(txn_hashes(txns))
+
+
+def gl_contact_keys(txns: List[Dict[str, Any]]) -> List[Optional[str]]:
+    # The doctor-rule contact id each line falls under, if any.
+    keys: Dict[str, str] = {}
+    contacts: List[Optional[str]] = []
+    for label in doctor_labels(txns):
+        if label is not None and label not in keys:
+            keys[label] = normalize_contact_id(label)
+        contacts.append(None if label is None else keys[label])
+    return contacts
+
+
+def get_sync_state(db: Session, tenant_id: str) -> Optional[models.GLSyncState]:
+    return db.query(models.GLSyncState).filter(models.GLSyncState.tenant_id == tenant_id).first()
+
+
+def plan_gl_fetch(db: Session, tenant_id: str, start: date, end: date) -> Optional[Tuple[date, date]]:
+    state = get_sync_state(db, tenant_id)
+    if state is None or start < state.synced_from:
+        return start, end
+    fetch_start = max(start, state.synced_to - timedelta(days=XERO_GL_RECHECK_DAYS))
+    if fetch_start > end:
+        return None
+    return fetch_start, end
+
+
+def store_gl_range(db: Session, tenant_id: str, start: date, end: date, txns: List[Dict[str, Any]]) -> int:
+    # Replace everything Xero reported for [start, end]: upsert what came back and
+    # drop stored lines in the range that no longer exist (edited or deleted in Xero).
+    # The caller commits, together with whatever it derives from the stored lines.
+    now = models.utc_now()
+    canonical = txn_hashes(txns)
+    rows = []
+    for seq, (txn, row_key, txn_hash, contact_key) in enumerate(zip(txns, occurrence_keys(canonical), canonical, gl_contact_keys(txns))):
+        rows.append({
+            "id": models.generate_uuid(),
+            "tenant_id": tenant_id,
+            "hash": row_key,
+            "txn_hash": txn_hash,
+            "contact_key": contact_key,
+            "account": txn.get("account") or "",
+            "date": txn.get("date") or "",
+            "txn_date": gl_txn_date(txn.get("date") or "") or start,
+            "seq": seq,
+            "source": txn.get("source") or "",
+            "description": txn.get("description") or "",
+            "reference": txn.get("reference") or "",
+            "debit": float(txn.get("debit") or 0.0),
+            "credit": float(txn.get("credit") or 0.0),
+            "amount": float(txn.get("amount") or 0.0),
+            "created_at": now,
+            "updated_at": now,
+        })
+
+    update_columns = (
+        "txn_hash", "contact_key", "account", "date", "txn_date", "seq", "source", "description", "reference", "debit", "credit", "amount", "updated_at",
+    )
+    for chunk in chunked(rows, 500):
+        stmt = dialect_insert(db, models.GLTransaction).values(chunk)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["tenant_id", "hash"],
+            set_={column: getattr(stmt.excluded, column) for column in update_columns},
+        )
+        db.execute(stmt)
+
+    fetched = {row["hash"] for row in rows}
+    stale_ids = [
+        record_id
+        for record_id, txn_hash in db.query(models.GLTransaction.id, models.GLTransaction.hash)
+        .filter(
+            models.GLTransaction.tenant_id == tenant_id,
+            models.GLTransaction.txn_date >= start,
+            models.GLTransaction.txn_date <= end,
+        )
+        if txn_hash not in fetched
+    ]
+    for chunk in chunked(stale_ids, 500):
+        db.query(models.GLTransaction).filter(models.GLTransaction.id.in_(chunk)).delete(synchronize_session=False)
+
+    state = get_sync_state(db, tenant_id)
+    account_order = [txn.get("account") or "" for txn in txns]
+    if state is None:
+        state = models.GLSyncState(
+            tenant_id=tenant_id,
+            synced_from=start,
+            synced_to=end,
+            account_order=merge_account_order([], account_order),
+        )
+        db.add(state)
+    else:
+        state.synced_from = min(state.synced_from, start)
+        state.synced_to = max(state.synced_to, end)
+        state.account_order = merge_account_order(state.account_order or [], account_order)
+    return len(rows)
+
+
+def ordered_gl_txns(db: Session, tenant_id: str, records: Iterable[models.GLTransaction]) -> List[Dict[str, Any]]:
+    # Records in (txn_date, seq) order, regrouped by account in Xero's section order.
+    state = get_sync_state(db, tenant_id)
+    by_account: Dict[str, List[Dict[str, Any]]] = {}
+    for record in records:
+        by_account.setdefault(record.account, []).append({field: getattr(record, field) for field in GL_TXN_FIELDS})
+    account_order = merge_account_order(state.account_order if state else [], by_account)
+    return [txn for account in account_order for txn in by_account.get(account, [])]
+
+
+def load_gl_txns(
+    db: Session,
+    tenant_id: str,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    accounts: Optional[List[str]] = None,
+) -> List[Dict[str, Any]]:
+    query = db.query(models.GLTransaction).filter(models.GLTransaction.tenant_id == tenant_id)
+    if accounts is not None:
+        query = query.filter(models.GLTransaction.account.in_(accounts))
+    if start is not None:
+        query = query.filter(models.GLTransaction.txn_date >= start)
+    if end is not None:
+        query = query.filter(models.GLTransaction.txn_date <= end)
+    return ordered_gl_txns(db, tenant_id, query.order_by(models.GLTransaction.txn_date, models.GLTransaction.seq).all())
+
+
+def gl_keys_complete(db: Session, tenant_id: str) -> bool:
+    # False while lines stored before txn_hash/contact_key existed have not been backfilled.
+    missing = (
+        db.query(models.GLTransaction.id)
+        .filter(models.GLTransaction.tenant_id == tenant_id, models.GLTransaction.txn_hash.is_(None))
+        .first()
+    )
+    return missing is None
+
+
+def load_matching_gl_txns(
+    db: Session,
+    tenant_id: str,
+    hashes: Optional[Iterable[str]] = None,
+    contact_ids: Optional[Iterable[str]] = None,
+) -> List[Dict[str, Any]]:
+    # Lines with one of the canonical `hashes` or doctor `contact_ids`, found through the
+    # indexed txn_hash / contact_key columns rather than by hashing the whole ledger.
+    query = db.query(models.GLTransaction).filter(models.GLTransaction.tenant_id == tenant_id)
+    records: Dict[str, models.GLTransaction] = {}
+    for column, values in ((models.GLTransaction.txn_hash, hashes), (models.GLTransaction.contact_key, contact_ids)):
+        for chunk in chunked(sorted(set(values or ())), GL_QUERY_CHUNK):
+            for record in query.filter(column.in_(chunk)):
+                records[record.id] = record
+    return ordered_gl_txns(db, tenant_id, sorted(records.values(), key=lambda record: (record.txn_date, record.seq)))
+
+
+def rehash_overrides(db: Session, user_id: str) -> int:
+    # Moves the user's legacy-keyed overrides onto canonical keys using the stored GL.
+    # The caller commits.
+    overrides = (
+        db.query(models.TxnOverride)
+        .filter(models.TxnOverride.user_id == user_id, models.TxnOverride.tenant_id == user_id)
+        .all()
+    )
+    if not needs_legacy_hashes(overrides):
+        return 0
+    connection = db.query(models.XeroConnection).filter(models.XeroConnection.user_id == user_id).first()
+    if not connection or not connection.tenant_id:
+        return 0
+    plan = rehash_plan(overrides, load_gl_txns(db, connection.tenant_id))
+    taken = {(record.source, record.document_id, record.line_item_id or "", record.hash or "") for record in overrides}
+    now = models.utc_now()
+    moved = 0
+    for record in overrides:
+        canonical = plan.get(record.id)
+        key = (record.source, record.document_id, record.line_item_id or "", canonical)
+        if canonical is None or key in taken:
+            continue
+        taken.add(key)
+        record.legacy_hash = record.hash
+        record.hash = canonical
+        record.updated_at = now
+        moved += 1
+    return moved
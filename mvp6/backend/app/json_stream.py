@@ -0,0 +1,97 @@
+import codecs
+import json
+from typing import Any, AsyncIterable, AsyncIterator
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = " \t\r\n"
+
+
+class JsonStreamReader:
+    # Incremental reader over a byte stream. Containers are walked key by key with
+    # iter_object/iter_array so only the current value is held in memory; leaf values
+    # (and any container the caller does not need to walk) are decoded whole.
+    def __init__(self, chunks: AsyncIterable[bytes]):
+        self._chunks = chunks.__aiter__()
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    async def _fill(self) -> bool:
+        if self.eof:
+            return False
+        try:
+            chunk = await self._chunks.__anext__()
+            text = self._utf8.decode(chunk)
+        except StopAsyncIteration:
+            self.eof = True
+            text = self._utf8.decode(b"", final=True)
+        self.buf = self.buf[self.pos:] + text
+        self.pos = 0
+        return True
+
+    async def peek(self) -> str:
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not await self._fill():
+                return ""
+
+    async def expect(self, char: str) -> None:
+        found = await self.peek()
+        if found != char:
+            raise ValueError(f"Expected {char!r} at offset {self.pos}, found {found!r}")
+        self.pos += 1
+
+    async def value(self) -> Any:
+        await self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if not await self._fill():
+                    raise ValueError("Truncated JSON document") from None
+                continue
+            # A number at the very end of the buffer may continue in the next chunk.
+            if end == len(self.buf) and not self.eof:
+                await self._fill()
+                continue
+            self.pos = end
+            return value
+
+    async def skip(self) -> None:
+        await self.value()
+
+    async def iter_object(self) -> AsyncIterator[str]:
+        # Yields each key; the caller must consume the value before resuming.
+        await self.expect("{")
+        if await self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = await self.value()
+            await self.expect(":")
+            yield key
+            if await self.peek() == ",":
+                self.pos += 1
+                continue
+            await self.expect("}")
+            return
+
+    async def iter_array(self) -> AsyncIterator[int]:
+        # Yields each element index; the caller must consume the element before resuming.
+        await self.expect("[")
+        if await self.peek() == "]":
+            self.pos += 1
+            return
+        index = 0
+        while True:
+            yield index
+            index += 1
+            if await self.peek() == ",":
+                self.pos += 1
+                continue
+            await self.expect("]")
+            return
@@ -0,0 +1,100 @@
+import base64
+import hashlib
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional, Tuple, Type
+
+from fastapi import HTTPException, Request
+from sqlalchemy import and_, func, or_
+from sqlalchemy.orm import Session
+
+from . import models
+
+TOMBSTONE_OVERRIDE = "override"
+TOMBSTONE_DOCTOR_RULE = "doctor_rule"
+TOMBSTONE_PREFERENCE = "preference"
+
+
+def encode_cursor(stamp: datetime, record_id: str) -> str:
+    return base64.urlsafe_b64encode(f"{stamp.isoformat()}|{record_id}".encode()).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, param: str = "since") -> Tuple[datetime, str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        stamp, record_id = raw.split("|", 1)
+        parsed = datetime.fromisoformat(stamp)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=f"Invalid {param} cursor") from exc
+    # Stamps are UTC (models.utc_now); SQLite hands them back naive, so compare in UTC.
+    if parsed.tzinfo is None:
+        return parsed.replace(tzinfo=timezone.utc), record_id
+    return parsed.astimezone(timezone.utc), record_id
+
+
+def record_tombstone(db: Session, user_id: str, kind: str, record_id: str, record_key: Optional[str] = None) -> None:
+    db.add(models.LedgerTombstone(
+        tenant_id=user_id,
+        user_id=user_id,
+        kind=kind,
+        record_id=record_id,
+        record_key=record_key,
+        deleted_at=models.utc_now(),
+    ))
+
+
+def list_changes(
+    db: Session,
+    user_id: str,
+    model: Type[Any],
+    kind: str,
+    since: Optional[str],
+    limit: int,
+) -> Tuple[list, list, Optional[str], bool]:
+    # Upserts and tombstones are two keyset streams over (timestamp, id); both are read
+    # past the cursor, merged, and cut at `limit`, so the next cursor resumes either.
+    items = db.query(model).filter(model.tenant_id == user_id, model.user_id == user_id)
+    tombstones = db.query(models.LedgerTombstone).filter(
+        models.LedgerTombstone.tenant_id == user_id,
+        models.LedgerTombstone.user_id == user_id,
+        models.LedgerTombstone.kind == kind,
+    )
+    if since:
+        stamp, record_id = decode_cursor(since)
+        items = items.filter(or_(model.updated_at > stamp, and_(model.updated_at == stamp, model.id > record_id)))
+        tombstones = tombstones.filter(or_(
+            models.LedgerTombstone.deleted_at > stamp,
+            and_(models.LedgerTombstone.deleted_at == stamp, models.LedgerTombstone.id > record_id),
+        ))
+    changes = [(record.updated_at, record.id, False, record) for record in items.order_by(model.updated_at, model.id).limit(limit + 1)]
+    changes += [
+        (record.deleted_at, record.id, True, record)
+        for record in tombstones.order_by(models.LedgerTombstone.deleted_at, models.LedgerTombstone.id).limit(limit + 1)
+    ]
+    changes.sort(key=lambda change: (change[0], change[1]))
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+    cursor = encode_cursor(changes[-1][0], changes[-1][1]) if changes else since
+    upserted = [change[3] for change in changes if not change[2]]
+    deleted = [change[3] for change in changes if change[2]]
+    return upserted, deleted, cursor, has_more
+
+
+def tombstone_out(record: models.LedgerTombstone) -> Dict[str, Any]:
+    return {"id": record.record_id, "key": record.record_key, "deletedAt": record.deleted_at.isoformat()}
+
+
+def list_etag(db: Session, user_id: str, model: Type[Any], kind: str) -> str:
+    count, latest = db.query(func.count(model.id), func.max(model.updated_at)).filter(
+        model.tenant_id == user_id,
+        model.user_id == user_id,
+    ).one()
+    deleted = db.query(func.max(models.LedgerTombstone.deleted_at)).filter(
+        models.LedgerTombstone.tenant_id == user_id,
+        models.LedgerTombstone.user_id == user_id,
+        models.LedgerTombstone.kind == kind,
+    ).scalar()
+    return '"' + hashlib.blake2b(f"{kind}|{count}|{latest}|{deleted}".encode(), digest_size=16).hexdigest() + '"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    return etag in [tag.strip() for tag in request.headers.get("If-None-Match", "").split(",")]
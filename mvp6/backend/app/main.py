@@ -1,4 +1,5 @@
 import os
+from contextlib import asynccontextmanager
 from pathlib import Path
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
@@ -16,11 +17,24 @@ for env_path in ENV_PATHS:
         load_dotenv(env_path)
         break
 
-from .routers import auth, ledger, snapshots, state, users, xero
+from .routers import auth, dream, ledger, snapshots, state, users, xero
+from .sync_jobs import job_runner
+from .xero_client import close_http_client
 
 APP_NAME = os.environ.get("APP_NAME", "Accounting Atlas API")
 
-app = FastAPI(title=APP_NAME)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await job_runner.start()
+    try:
+        yield
+    finally:
+        await job_runner.stop()
+        await close_http_client()
+
+
+app = FastAPI(title=APP_NAME, lifespan=lifespan)
 
 raw_origins = os.environ.get("ALLOWED_ORIGINS", "http://localhost:5173,http://127.0.0.1:5173")
 origins = [origin.strip() for origin in raw_origins.split(",") if origin.strip()]
@@ -35,7 +49,8 @@ app.add_middleware(
     allow_origin_regex=allow_origin_regex,
     allow_credentials=True,
     allow_methods=["*"],
-    allow_headers=["*"]
+    allow_headers=["*"],
+    expose_headers=["ETag", "X-Next-Cursor"],
 )
 
 app.include_router(auth.router)
@@ -44,6 +59,7 @@ app.include_router(state.router)
 app.include_router(snapshots.router)
 app.include_router(users.router)
 app.include_router(xero.router)
+app.include_router(dream.router)
 
 
 @app.exception_handler(SQLAlchemyError)
@@ -1,5 +1,6 @@
 import uuid
-from sqlalchemy import Boolean, Column, DateTime, ForeignKey, Integer, String, Text, UniqueConstraint, func
+from datetime import datetime, timezone
+from sqlalchemy import Boolean, Column, Date, DateTime, Float, ForeignKey, Index, Integer, LargeBinary, String, Text, UniqueConstraint, func, literal_column
 from sqlalchemy.orm import relationship
 from sqlalchemy.types import JSON
 from .db import Base
@@ -9,6 +10,12 @@ def generate_uuid() -> str:
     return str(uuid.uuid4())
 
 
+def utc_now() -> datetime:
+    # App-side clock for columns used as keyset cursors, so every write (ORM, Core upsert
+    # or explicit assignment) stamps the same tz-aware UTC value the cursor compares.
+    return datetime.now(timezone.utc)
+
+
 def json_type():
     return JSON
 
@@ -59,6 +66,71 @@ class XeroOAuthState(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
 
 
+class GLTransaction(Base):
+    __tablename__ = 'gl_transactions'
+    __table_args__ = (
+        UniqueConstraint('tenant_id', 'hash', name='uniq_gl_txn'),
+        Index('ix_gl_transactions_tenant_date', 'tenant_id', 'txn_date'),
+        Index('ix_gl_transactions_tenant_txn_hash', 'tenant_id', 'txn_hash'),
+        Index('ix_gl_transactions_tenant_contact', 'tenant_id', 'contact_key'),
+    )
+
+    id = Column(String(36), primary_key=True, default=generate_uuid)
+    tenant_id = Column(String(40), nullable=False)
+    # Row identity (gl_store.occurrence_keys); txn_hash is the canonical key overrides use
+    # and contact_key the doctor-rule contact id, so writes can find the lines they touch.
+    hash = Column(String(64), nullable=False)
+    txn_hash = Column(String(32), nullable=True)
+    contact_key = Column(String(255), nullable=True)
+    account = Column(String(255), nullable=False)
+    date = Column(String(40), nullable=False)
+    txn_date = Column(Date, nullable=False)
+    seq = Column(Integer, nullable=False, default=0)
+    source = Column(Text, nullable=False, default='')
+    description = Column(Text, nullable=False, default='')
+    reference = Column(Text, nullable=False, default='')
+    debit = Column(Float, nullable=False, default=0.0)
+    credit = Column(Float, nullable=False, default=0.0)
+    amount = Column(Float, nullable=False, default=0.0)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
+
+
+class GLSyncState(Base):
+    __tablename__ = 'gl_sync_states'
+
+    id = Column(String(36), primary_key=True, default=generate_uuid)
+    tenant_id = Column(String(40), nullable=False, unique=True, index=True)
+    synced_from = Column(Date, nullable=False)
+    synced_to = Column(Date, nullable=False)
+    account_order = Column(json_type(), nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
+
+
+class SyncJob(Base):
+    __tablename__ = 'sync_jobs'
+    __table_args__ = (
+        Index('ix_sync_jobs_status_created', 'status', 'created_at'),
+        Index('ix_sync_jobs_status_heartbeat', 'status', 'heartbeat_at'),
+    )
+
+    id = Column(String(36), primary_key=True, default=generate_uuid)
+    user_id = Column(String(36), ForeignKey('users.id', ondelete='CASCADE'), nullable=False, index=True)
+    kind = Column(String(40), nullable=False)
+    status = Column(String(20), nullable=False, default='queued')
+    params = Column(json_type(), nullable=False)
+    progress = Column(Integer, nullable=False, default=0)
+    stage = Column(String(40), nullable=True)
+    result = Column(json_type(), nullable=True)
+    error = Column(Text, nullable=True)
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    heartbeat_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
+
+
 class UserSettings(Base):
     __tablename__ = 'user_settings'
 
@@ -118,21 +190,48 @@ class ReportConfig(Base):
 
 class Snapshot(Base):
     __tablename__ = 'snapshots'
+    __table_args__ = (Index('ix_snapshots_owner_updated', 'owner_user_id', 'updated_at', 'id'),)
 
     id = Column(String(36), primary_key=True, default=generate_uuid)
     owner_user_id = Column(String(36), ForeignKey('users.id', ondelete='CASCADE'), nullable=False, index=True)
     name = Column(String(255), nullable=False)
-    payload = Column(json_type(), nullable=False)
+    # Section name -> SnapshotChunk hash (snapshot_store.read_snapshot_payload). Rows written
+    # before the chunk store hold the payload inline instead: plain JSON, or payload_blob
+    # compressed with payload_codec. Both are SQL NULL, not JSON null, when unset.
+    manifest = Column(JSON(none_as_null=True), nullable=True)
+    payload = Column(JSON(none_as_null=True), nullable=True)
+    payload_blob = Column(LargeBinary, nullable=True)
+    payload_codec = Column(String(16), nullable=True)
     schema_version = Column(String(20), nullable=False)
-    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
-    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
+    # Listing metadata derived from payload (snapshot_store.set_snapshot_payload).
+    summary = Column(json_type(), nullable=True)
+    payload_size = Column(Integer, nullable=True)
+    payload_hash = Column(String(64), nullable=True)
+    created_at = Column(DateTime(timezone=True), default=utc_now, server_default=func.now(), nullable=False)
+    updated_at = Column(DateTime(timezone=True), default=utc_now, server_default=func.now(), onupdate=utc_now, nullable=False)
 
     shares = relationship('SnapshotShare', back_populates='snapshot', cascade='all, delete-orphan')
 
 
+class SnapshotChunk(Base):
+    # One payload section, stored once however many snapshot manifests reference it.
+    __tablename__ = 'snapshot_chunks'
+    __table_args__ = (Index('ix_snapshot_chunks_refcount', 'refcount'),)
+
+    hash = Column(String(32), primary_key=True)
+    codec = Column(String(16), nullable=True)
+    data = Column(LargeBinary, nullable=False)
+    size = Column(Integer, nullable=False)
+    refcount = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime(timezone=True), default=utc_now, server_default=func.now(), nullable=False)
+
+
 class SnapshotShare(Base):
     __tablename__ = 'snapshot_shares'
-    __table_args__ = (UniqueConstraint('snapshot_id', 'user_id', name='uniq_snapshot_user'),)
+    __table_args__ = (
+        UniqueConstraint('snapshot_id', 'user_id', name='uniq_snapshot_user'),
+        Index('ix_snapshot_shares_user', 'user_id', 'role', 'snapshot_id'),
+    )
 
     id = Column(String(36), primary_key=True, default=generate_uuid)
     snapshot_id = Column(String(36), ForeignKey('snapshots.id', ondelete='CASCADE'), nullable=False)
@@ -147,7 +246,10 @@ class SnapshotShare(Base):
 
 class TxnOverride(Base):
     __tablename__ = 'txn_overrides'
-    __table_args__ = (UniqueConstraint('tenant_id', 'user_id', 'source', 'document_id', 'line_item_id', 'hash', name='uniq_txn_override'),)
+    __table_args__ = (
+        Index('ix_txn_overrides_feed', 'tenant_id', 'user_id', 'updated_at', 'id'),
+        Index('ix_txn_overrides_hash', 'tenant_id', 'user_id', 'hash'),
+    )
 
     id = Column(String(36), primary_key=True, default=generate_uuid)
     tenant_id = Column(String(36), nullable=False, index=True)
@@ -156,17 +258,35 @@ class TxnOverride(Base):
     document_id = Column(String(255), nullable=False)
     line_item_id = Column(String(255), nullable=True)
     hash = Column(String(64), nullable=True)
+    # The browser's 32-bit key, kept after the override is rehashed to a canonical key.
+    legacy_hash = Column(String(64), nullable=True)
     treatment = Column(String(20), nullable=False, default='OPERATING')
     deferral_start_month = Column(String(7), nullable=True)
     deferral_months = Column(Integer, nullable=True)
     deferral_include_in_operating_kpis = Column(Boolean, nullable=True)
-    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
-    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
+    created_at = Column(DateTime(timezone=True), default=utc_now, server_default=func.now(), nullable=False)
+    updated_at = Column(DateTime(timezone=True), default=utc_now, server_default=func.now(), onupdate=utc_now, nullable=False)
+
+
+# NULL line items/hashes never conflict in a plain unique constraint, so the override key
+# is a unique expression index that ON CONFLICT upserts can target.
+TXN_OVERRIDE_KEY = (
+    TxnOverride.tenant_id,
+    TxnOverride.user_id,
+    TxnOverride.source,
+    TxnOverride.document_id,
+    func.coalesce(TxnOverride.line_item_id, literal_column("''")),
+    func.coalesce(TxnOverride.hash, literal_column("''")),
+)
+Index('uniq_txn_override', *TXN_OVERRIDE_KEY, unique=True)
 
 
 class DoctorRule(Base):
     __tablename__ = 'doctor_rules'
-    __table_args__ = (UniqueConstraint('tenant_id', 'user_id', 'contact_id', name='uniq_doctor_rule'),)
+    __table_args__ = (
+        UniqueConstraint('tenant_id', 'user_id', 'contact_id', name='uniq_doctor_rule'),
+        Index('ix_doctor_rules_feed', 'tenant_id', 'user_id', 'updated_at', 'id'),
+    )
 
     id = Column(String(36), primary_key=True, default=generate_uuid)
     tenant_id = Column(String(36), nullable=False, index=True)
@@ -177,18 +297,101 @@ class DoctorRule(Base):
     deferral_months = Column(Integer, nullable=True)
     deferral_include_in_operating_kpis = Column(Boolean, nullable=True)
     enabled = Column(Boolean, nullable=False, default=True)
+    created_at = Column(DateTime(timezone=True), default=utc_now, server_default=func.now(), nullable=False)
+    updated_at = Column(DateTime(timezone=True), default=utc_now, server_default=func.now(), onupdate=utc_now, nullable=False)
+
+
+class DeferralSchedule(Base):
+    # Materialised straight-line instalments for DEFERRED transactions. Part -1 reverses the
+    # original posting so the rows sum to the deferral's net effect on the P&L.
+    __tablename__ = 'deferral_schedules'
+    __table_args__ = (
+        UniqueConstraint('tenant_id', 'user_id', 'txn_hash', 'part', name='uniq_deferral_schedule'),
+        Index('ix_deferral_schedules_month', 'tenant_id', 'user_id', 'month'),
+    )
+
+    id = Column(String(36), primary_key=True, default=generate_uuid)
+    tenant_id = Column(String(36), nullable=False)
+    user_id = Column(String(36), ForeignKey('users.id', ondelete='CASCADE'), nullable=False, index=True)
+    txn_hash = Column(String(64), nullable=False)
+    part = Column(Integer, nullable=False)
+    account = Column(String(255), nullable=False)
+    month = Column(String(7), nullable=False)
+    amount = Column(Float, nullable=False)
+    non_operating = Column(Boolean, nullable=False, default=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+
+class DeferralMonthTotal(Base):
+    __tablename__ = 'deferral_month_totals'
+    __table_args__ = (
+        UniqueConstraint('tenant_id', 'user_id', 'month', 'account', 'non_operating', name='uniq_deferral_month_total'),
+    )
+
+    id = Column(String(36), primary_key=True, default=generate_uuid)
+    tenant_id = Column(String(36), nullable=False)
+    user_id = Column(String(36), ForeignKey('users.id', ondelete='CASCADE'), nullable=False, index=True)
+    month = Column(String(7), nullable=False)
+    account = Column(String(255), nullable=False)
+    non_operating = Column(Boolean, nullable=False, default=False)
+    amount = Column(Float, nullable=False, default=0.0)
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
 
 
+class GLCubeCell(Base):
+    # Effective ledger pre-summed by account x month x treatment, per user (gl_cube.py).
+    __tablename__ = 'gl_cube_cells'
+    __table_args__ = (
+        UniqueConstraint('tenant_id', 'user_id', 'month', 'account', 'treatment', 'non_operating', name='uniq_gl_cube_cell'),
+    )
+
+    id = Column(String(36), primary_key=True, default=generate_uuid)
+    tenant_id = Column(String(36), nullable=False)
+    user_id = Column(String(36), ForeignKey('users.id', ondelete='CASCADE'), nullable=False, index=True)
+    month = Column(String(7), nullable=False)
+    account = Column(String(255), nullable=False)
+    treatment = Column(String(20), nullable=False)
+    non_operating = Column(Boolean, nullable=False, default=False)
+    amount = Column(Float, nullable=False, default=0.0)
+    count = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
+
+
+class GLCubeState(Base):
+    # Which Xero tenant a user's cube was built from; no row means it has not been built.
+    __tablename__ = 'gl_cube_states'
+
+    id = Column(String(36), primary_key=True, default=generate_uuid)
+    user_id = Column(String(36), ForeignKey('users.id', ondelete='CASCADE'), nullable=False, unique=True, index=True)
+    gl_tenant_id = Column(String(40), nullable=False)
+    built_at = Column(DateTime(timezone=True), nullable=False)
+
+
+class LedgerTombstone(Base):
+    # Deleted ledger records, so change feeds can tell clients what to drop.
+    __tablename__ = 'ledger_tombstones'
+    __table_args__ = (Index('ix_ledger_tombstones_feed', 'tenant_id', 'user_id', 'kind', 'deleted_at', 'id'),)
+
+    id = Column(String(36), primary_key=True, default=generate_uuid)
+    tenant_id = Column(String(36), nullable=False)
+    user_id = Column(String(36), ForeignKey('users.id', ondelete='CASCADE'), nullable=False, index=True)
+    kind = Column(String(40), nullable=False)
+    record_id = Column(String(36), nullable=False)
+    record_key = Column(String(255), nullable=True)
+    deleted_at = Column(DateTime(timezone=True), default=utc_now, nullable=False)
+
+
 class UserPreference(Base):
     __tablename__ = 'user_preferences'
-    __table_args__ = (UniqueConstraint('tenant_id', 'user_id', 'key', name='uniq_user_pref'),)
+    __table_args__ = (
+        UniqueConstraint('tenant_id', 'user_id', 'key', name='uniq_user_pref'),
+        Index('ix_user_preferences_feed', 'tenant_id', 'user_id', 'updated_at', 'id'),
+    )
 
     id = Column(String(36), primary_key=True, default=generate_uuid)
     tenant_id = Column(String(36), nullable=False, index=True)
     user_id = Column(String(36), ForeignKey('users.id', ondelete='CASCADE'), nullable=False, index=True)
     key = Column(String(100), nullable=False)
     value_json = Column(json_type(), nullable=False)
-    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
-    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now(), nullable=False)
+    created_at = Column(DateTime(timezone=True), default=utc_now, server_default=func.now(), nullable=False)
+    updated_at = Column(DateTime(timezone=True), default=utc_now, server_default=func.now(), onupdate=utc_now, nullable=False)
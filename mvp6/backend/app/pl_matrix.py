@@ -0,0 +1,129 @@
+import base64
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from fastapi import HTTPException
+
+PL_FORMATS = ("json", "dense", "base64")
+WIRE_DTYPE = "<f8"
+
+
+def encode_f64(values: np.ndarray) -> str:
+    return base64.b64encode(np.ascontiguousarray(values, dtype=WIRE_DTYPE).tobytes()).decode("ascii")
+
+
+def decode_f64(data: str) -> np.ndarray:
+    return np.frombuffer(base64.b64decode(data), dtype=WIRE_DTYPE)
+
+
+class PLMatrix:
+    # Columnar P&L: an accounts x months float64 matrix with parallel name/section
+    # arrays. Row order matches the account order of the JSON shape.
+    __slots__ = ("months", "month_labels", "names", "sections", "values")
+
+    def __init__(self, months: List[str], month_labels: List[str], names: List[str], sections: List[str], values: np.ndarray):
+        self.months = months
+        self.month_labels = month_labels
+        self.names = names
+        self.sections = sections
+        self.values = values
+
+    @property
+    def totals(self) -> np.ndarray:
+        return self.values.sum(axis=1)
+
+    @classmethod
+    def from_parsed(cls, parsed: Dict[str, Any]) -> "PLMatrix":
+        months = list(parsed["months"])
+        accounts = parsed["accounts"]
+        values = np.zeros((len(accounts), len(months)), dtype=np.float64)
+        for row, account in enumerate(accounts):
+            account_values = account["values"][:len(months)]
+            values[row, :len(account_values)] = account_values
+        return cls(
+            months,
+            list(parsed["monthLabels"]),
+            [account["name"] for account in accounts],
+            [account["section"] for account in accounts],
+            values,
+        )
+
+    @classmethod
+    def merge(cls, windows: Sequence["PLMatrix"]) -> "PLMatrix":
+        # Month columns are unioned and sorted; accounts are keyed on (name, section) in
+        # first-seen order. Months a window does not cover stay zero.
+        labels: Dict[str, str] = {}
+        for window in windows:
+            for key, label in zip(window.months, window.month_labels):
+                labels.setdefault(key, label)
+        months = sorted(labels)
+        month_index = {key: idx for idx, key in enumerate(months)}
+
+        rows: Dict[Tuple[str, str], int] = {}
+        placements = []
+        for window in windows:
+            row_idx = np.array([rows.setdefault(key, len(rows)) for key in zip(window.names, window.sections)], dtype=np.intp)
+            col_idx = np.array([month_index[key] for key in window.months], dtype=np.intp)
+            placements.append((row_idx, col_idx, window.values))
+
+        values = np.zeros((len(rows), len(months)), dtype=np.float64)
+        for row_idx, col_idx, window_values in placements:
+            if row_idx.size and col_idx.size:
+                values[np.ix_(row_idx, col_idx)] = window_values
+        keys = list(rows)
+        return cls(months, [labels[key] for key in months], [key[0] for key in keys], [key[1] for key in keys], values)
+
+    def section_totals(self) -> Dict[str, np.ndarray]:
+        sections = np.array(self.sections, dtype=object)
+        return {section: self.values[sections == section].sum(axis=0) for section in dict.fromkeys(self.sections)}
+
+    def to_parsed(self) -> Dict[str, Any]:
+        totals = self.totals.tolist()
+        return {
+            "months": self.months,
+            "monthLabels": self.month_labels,
+            "accounts": [
+                {"name": name, "section": section, "values": values, "total": total}
+                for name, section, values, total in zip(self.names, self.sections, self.values.tolist(), totals)
+            ],
+        }
+
+    def to_wire(self, fmt: str = "json") -> Dict[str, Any]:
+        if fmt == "json":
+            return self.to_parsed()
+        wire = {
+            "format": fmt,
+            "months": self.months,
+            "monthLabels": self.month_labels,
+            "names": self.names,
+            "sections": self.sections,
+            "shape": list(self.values.shape),
+        }
+        if fmt == "dense":
+            # Row-major: account i, month j is values[i * len(months) + j].
+            wire["values"] = self.values.ravel().tolist()
+            wire["totals"] = self.totals.tolist()
+        else:
+            wire["dtype"] = WIRE_DTYPE
+            wire["values"] = encode_f64(self.values)
+            wire["totals"] = encode_f64(self.totals)
+        return wire
+
+    @classmethod
+    def from_wire(cls, wire: Dict[str, Any]) -> "PLMatrix":
+        fmt = wire.get("format", "json")
+        if fmt == "json":
+            return cls.from_parsed(wire)
+        shape = tuple(wire["shape"])
+        if fmt == "dense":
+            values = np.asarray(wire["values"], dtype=np.float64)
+        else:
+            values = decode_f64(wire["values"]).copy()
+        return cls(list(wire["months"]), list(wire["monthLabels"]), list(wire["names"]), list(wire["sections"]), values.reshape(shape))
+
+
+def validate_pl_format(fmt: Optional[str]) -> str:
+    fmt = fmt or "json"
+    if fmt not in PL_FORMATS:
+        raise HTTPException(status_code=400, detail=f"pl_format must be one of: {', '.join(PL_FORMATS)}")
+    return fmt
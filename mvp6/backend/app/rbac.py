@@ -20,10 +20,19 @@ ROLE_PRIORITY = {
 }
 
 
-def resolve_role(db: Session, snapshot: models.Snapshot, user: models.User) -> SnapshotRole | None:
+def role_for_share(owner_user_id: str, user: models.User, share_role: str | None) -> SnapshotRole | None:
+    # Role from an already-loaded share (None when the snapshot is not shared with the user).
     if normalize_user_role(getattr(user, "role", "view")) == "super_admin":
         return SnapshotRole.owner
-    if snapshot.owner_user_id == user.id:
+    if owner_user_id == user.id:
+        return SnapshotRole.owner
+    if not share_role:
+        return None
+    return SnapshotRole(share_role)
+
+
+def resolve_role(db: Session, snapshot: models.Snapshot, user: models.User) -> SnapshotRole | None:
+    if normalize_user_role(getattr(user, "role", "view")) == "super_admin" or snapshot.owner_user_id == user.id:
         return SnapshotRole.owner
     share = (
         db.query(models.SnapshotShare)
@@ -31,9 +40,7 @@ def resolve_role(db: Session, snapshot: models.Snapshot, user: models.User) -> S
         .filter(models.SnapshotShare.user_id == user.id)
         .first()
     )
-    if not share:
-        return None
-    return SnapshotRole(share.role)
+    return role_for_share(snapshot.owner_user_id, user, share.role if share else None)
 
 
 def require_role(role: SnapshotRole | None, minimum: SnapshotRole) -> None:
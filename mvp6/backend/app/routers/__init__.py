@@ -1,3 +1,3 @@
-from . import auth, state, snapshots, users, xero
+from . import auth, dream, state, snapshots, users, xero
 
-__all__ = ["auth", "state", "snapshots", "users", "xero"]
+__all__ = ["auth", "dream", "state", "snapshots", "users", "xero"]
@@ -0,0 +1,37 @@
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from sqlalchemy.orm import Session
+from ..db import get_db
+from .. import models, schemas
+from ..auth import get_current_user, require_csrf
+from ..compute_cache import compute_cache
+from ..ledger_sync import etag_matches
+from ..pl_matrix import PLMatrix
+
+router = APIRouter(prefix="/api/dream", tags=["dream"])
+
+
+@router.post("/compute")
+def dream_compute(
+    payload: schemas.DreamComputeRequest,
+    request: Request,
+    response: Response,
+    db: Session = Depends(get_db),
+    user: models.User = Depends(get_current_user),
+):
+    require_csrf(request)
+    template = payload.template
+    if template is None:
+        record = db.query(models.LayoutTemplate).filter(models.LayoutTemplate.owner_user_id == user.id).first()
+        if not record:
+            raise HTTPException(status_code=400, detail="No template saved; send one with the request")
+        template = record.data
+    try:
+        pl = PLMatrix.from_wire(payload.pl)
+    except (KeyError, TypeError, ValueError) as exc:
+        raise HTTPException(status_code=400, detail="Invalid P&L payload") from exc
+    etag, result = compute_cache.compute(pl, template, payload.scenario)
+    etag = f'"{etag}"'
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    return result
@@ -1,14 +1,58 @@
-from fastapi import APIRouter, Depends, Request
+import os
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import JSONResponse
 from sqlalchemy.orm import Session
-from ..db import get_db
+from ..db import chunked, dialect_insert, get_db
 from .. import models, schemas
 from ..auth import get_current_user, require_csrf
+from ..dates import parse_iso_date
+from ..deferrals import deferral_month_totals, refresh_deferrals
+from ..doctor_classifier import get_classifier
+from ..effective_ledger import build_effective_ledger, month_index, month_key
+from ..gl_cube import cube_aggregate, cube_cells, ensure_gl_cube
+from ..gl_store import load_gl_txns
+from ..ledger_sync import (
+    TOMBSTONE_DOCTOR_RULE,
+    TOMBSTONE_OVERRIDE,
+    TOMBSTONE_PREFERENCE,
+    etag_matches,
+    list_changes,
+    list_etag,
+    record_tombstone,
+    tombstone_out,
+)
+from ..pl_matrix import PLMatrix
+from ..txn_hash import is_canonical_hash, legacy_txn_hashes, txn_hashes
+
+LEDGER_MAX_PAGE_SIZE = int(os.environ.get("LEDGER_MAX_PAGE_SIZE", "5000"))
+LEDGER_BULK_MAX_ITEMS = int(os.environ.get("LEDGER_BULK_MAX_ITEMS", "10000"))
+LEDGER_CLASSIFY_MAX_TXNS = int(os.environ.get("LEDGER_CLASSIFY_MAX_TXNS", "500000"))
+# 11 bound parameters per override row keeps a chunk well under SQLite's variable limit.
+OVERRIDE_WRITE_CHUNK = 500
+CHANGES_DEFAULT_LIMIT = 1000
+
+OverrideKey = Tuple[str, str, str, str]
 
 router = APIRouter(prefix="/api/ledger", tags=["ledger"])
 
 
+def changes_limit(limit: int) -> int:
+    return min(max(1, limit), LEDGER_MAX_PAGE_SIZE)
+
+
 @router.get("/overrides", response_model=list[schemas.TxnOverrideOut])
-def list_overrides(db: Session = Depends(get_db), user: models.User = Depends(get_current_user)):
+def list_overrides(
+    request: Request,
+    response: Response,
+    db: Session = Depends(get_db),
+    user: models.User = Depends(get_current_user),
+):
+    etag = list_etag(db, user.id, models.TxnOverride, TOMBSTONE_OVERRIDE)
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
     records = (
         db.query(models.TxnOverride)
         .filter(models.TxnOverride.user_id == user.id, models.TxnOverride.tenant_id == user.id)
@@ -17,6 +61,22 @@ def list_overrides(db: Session = Depends(get_db), user: models.User = Depends(ge
     return [schemas.TxnOverrideOut.model_validate(record) for record in records]
 
 
+@router.get("/overrides/changes")
+def override_changes(
+    since: Optional[str] = None,
+    limit: int = CHANGES_DEFAULT_LIMIT,
+    db: Session = Depends(get_db),
+    user: models.User = Depends(get_current_user),
+):
+    items, deleted, cursor, has_more = list_changes(db, user.id, models.TxnOverride, TOMBSTONE_OVERRIDE, since, changes_limit(limit))
+    return {
+        "items": [schemas.TxnOverrideOut.model_validate(record) for record in items],
+        "deleted": [tombstone_out(record) for record in deleted],
+        "cursor": cursor,
+        "hasMore": has_more,
+    }
+
+
 @router.put("/overrides", response_model=schemas.TxnOverrideOut)
 def upsert_override(
     payload: schemas.TxnOverridePayload,
@@ -25,18 +85,18 @@ def upsert_override(
     user: models.User = Depends(get_current_user),
 ):
     require_csrf(request)
-    record = (
-        db.query(models.TxnOverride)
-        .filter(
-            models.TxnOverride.tenant_id == user.id,
-            models.TxnOverride.user_id == user.id,
-            models.TxnOverride.source == payload.source,
-            models.TxnOverride.document_id == payload.document_id,
-            models.TxnOverride.line_item_id == payload.line_item_id,
-            models.TxnOverride.hash == payload.hash,
-        )
-        .first()
+    query = db.query(models.TxnOverride).filter(
+        models.TxnOverride.tenant_id == user.id,
+        models.TxnOverride.user_id == user.id,
+        models.TxnOverride.source == payload.source,
+        models.TxnOverride.document_id == payload.document_id,
+        models.TxnOverride.line_item_id == payload.line_item_id,
     )
+    record = query.filter(models.TxnOverride.hash == payload.hash).first()
+    if record is None and payload.hash and not is_canonical_hash(payload.hash):
+        # The browser still keys by its legacy hash; update the override a sync moved
+        # onto the canonical key rather than adding a second one.
+        record = query.filter(models.TxnOverride.legacy_hash == payload.hash).first()
     if record:
         record.treatment = payload.treatment
         record.deferral_start_month = payload.deferral_start_month
@@ -56,11 +116,124 @@ def upsert_override(
             deferral_include_in_operating_kpis=payload.deferral_include_in_operating_kpis,
         )
         db.add(record)
+    record.updated_at = models.utc_now()
+    db.flush()
+    refresh_deferrals(db, user.id, hashes=[record.hash])
     db.commit()
     db.refresh(record)
     return schemas.TxnOverrideOut.model_validate(record)
 
 
+def override_key(source: str, document_id: str, line_item_id: Optional[str], txn_hash: Optional[str]) -> OverrideKey:
+    return (source, document_id, line_item_id or "", txn_hash or "")
+
+
+@router.put("/overrides/bulk")
+def bulk_upsert_overrides(
+    payload: schemas.TxnOverrideBulkPayload,
+    request: Request,
+    db: Session = Depends(get_db),
+    user: models.User = Depends(get_current_user),
+):
+    require_csrf(request)
+    if len(payload.overrides) > LEDGER_BULK_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {LEDGER_BULK_MAX_ITEMS} overrides per request")
+    now = models.utc_now()
+    # Later items win over earlier ones with the same key, as sequential PUTs would.
+    rows: Dict[OverrideKey, dict] = {}
+    for item in payload.overrides:
+        rows[override_key(item.source, item.document_id, item.line_item_id, item.hash)] = {
+            "tenant_id": user.id,
+            "user_id": user.id,
+            "source": item.source,
+            "document_id": item.document_id,
+            "line_item_id": item.line_item_id,
+            "hash": item.hash,
+            "treatment": item.treatment,
+            "deferral_start_month": item.deferral_start_month,
+            "deferral_months": item.deferral_months,
+            "deferral_include_in_operating_kpis": item.deferral_include_in_operating_kpis,
+            "created_at": now,
+            "updated_at": now,
+        }
+
+    existing: Dict[OverrideKey, str] = {}
+    rehashed: Dict[OverrideKey, str] = {}
+    keys = list(rows)
+    for chunk in chunked(sorted({key[1] for key in keys}), OVERRIDE_WRITE_CHUNK):
+        matches = (
+            db.query(
+                models.TxnOverride.id,
+                models.TxnOverride.source,
+                models.TxnOverride.document_id,
+                models.TxnOverride.line_item_id,
+                models.TxnOverride.hash,
+                models.TxnOverride.legacy_hash,
+            )
+            .filter(
+                models.TxnOverride.tenant_id == user.id,
+                models.TxnOverride.user_id == user.id,
+                models.TxnOverride.document_id.in_(chunk),
+            )
+        )
+        for record_id, source, document_id, line_item_id, txn_hash, legacy_hash in matches:
+            existing[override_key(source, document_id, line_item_id, txn_hash)] = record_id
+            if legacy_hash:
+                rehashed[override_key(source, document_id, line_item_id, legacy_hash)] = txn_hash
+
+    update_columns = ("treatment", "deferral_start_month", "deferral_months", "deferral_include_in_operating_kpis", "updated_at")
+    for key in keys:
+        if key not in existing and key in rehashed:
+            # Legacy browser key for an override already moved onto its canonical key.
+            rows[key]["hash"] = rehashed[key]
+            existing[key] = existing[override_key(key[0], key[1], key[2], rehashed[key])]
+        rows[key]["id"] = existing.get(key) or models.generate_uuid()
+    for chunk in chunked(keys, OVERRIDE_WRITE_CHUNK):
+        stmt = dialect_insert(db, models.TxnOverride).values([rows[key] for key in chunk])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=list(models.TXN_OVERRIDE_KEY),
+            set_={column: getattr(stmt.excluded, column) for column in update_columns},
+        )
+        db.execute(stmt)
+    refresh_deferrals(db, user.id, hashes=[row["hash"] for row in rows.values()])
+    db.commit()
+
+    results = []
+    for index, item in enumerate(payload.overrides):
+        key = override_key(item.source, item.document_id, item.line_item_id, item.hash)
+        results.append({"index": index, "id": rows[key]["id"], "status": "updated" if key in existing else "created"})
+    updated = sum(1 for key in keys if key in existing)
+    return {"results": results, "created": len(keys) - updated, "updated": updated}
+
+
+@router.post("/overrides/bulk-delete")
+def bulk_delete_overrides(
+    payload: schemas.TxnOverrideBulkDelete,
+    request: Request,
+    db: Session = Depends(get_db),
+    user: models.User = Depends(get_current_user),
+):
+    require_csrf(request)
+    if len(payload.ids) > LEDGER_BULK_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {LEDGER_BULK_MAX_ITEMS} ids per request")
+    deleted: List[str] = []
+    hashes: List[Optional[str]] = []
+    for chunk in chunked(sorted(set(payload.ids)), OVERRIDE_WRITE_CHUNK):
+        query = db.query(models.TxnOverride).filter(
+            models.TxnOverride.user_id == user.id,
+            models.TxnOverride.tenant_id == user.id,
+            models.TxnOverride.id.in_(chunk),
+        )
+        for record_id, txn_hash in query.with_entities(models.TxnOverride.id, models.TxnOverride.hash):
+            deleted.append(record_id)
+            hashes.append(txn_hash)
+            record_tombstone(db, user.id, TOMBSTONE_OVERRIDE, record_id, txn_hash)
+        query.delete(synchronize_session=False)
+    refresh_deferrals(db, user.id, hashes=hashes)
+    db.commit()
+    return {"deleted": len(deleted), "ids": deleted}
+
+
 @router.delete("/overrides/{override_id}")
 def delete_override(
     override_id: str,
@@ -80,12 +253,24 @@ def delete_override(
     )
     if record:
         db.delete(record)
+        record_tombstone(db, user.id, TOMBSTONE_OVERRIDE, record.id, record.hash)
+        db.flush()
+        refresh_deferrals(db, user.id, hashes=[record.hash])
         db.commit()
     return {"ok": True}
 
 
 @router.get("/doctor-rules", response_model=list[schemas.DoctorRuleOut])
-def list_doctor_rules(db: Session = Depends(get_db), user: models.User = Depends(get_current_user)):
+def list_doctor_rules(
+    request: Request,
+    response: Response,
+    db: Session = Depends(get_db),
+    user: models.User = Depends(get_current_user),
+):
+    etag = list_etag(db, user.id, models.DoctorRule, TOMBSTONE_DOCTOR_RULE)
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
     records = (
         db.query(models.DoctorRule)
         .filter(models.DoctorRule.user_id == user.id, models.DoctorRule.tenant_id == user.id)
@@ -94,6 +279,22 @@ def list_doctor_rules(db: Session = Depends(get_db), user: models.User = Depends
     return [schemas.DoctorRuleOut.model_validate(record) for record in records]
 
 
+@router.get("/doctor-rules/changes")
+def doctor_rule_changes(
+    since: Optional[str] = None,
+    limit: int = CHANGES_DEFAULT_LIMIT,
+    db: Session = Depends(get_db),
+    user: models.User = Depends(get_current_user),
+):
+    items, deleted, cursor, has_more = list_changes(db, user.id, models.DoctorRule, TOMBSTONE_DOCTOR_RULE, since, changes_limit(limit))
+    return {
+        "items": [schemas.DoctorRuleOut.model_validate(record) for record in items],
+        "deleted": [tombstone_out(record) for record in deleted],
+        "cursor": cursor,
+        "hasMore": has_more,
+    }
+
+
 @router.put("/doctor-rules", response_model=schemas.DoctorRuleOut)
 def upsert_doctor_rule(
     payload: schemas.DoctorRulePayload,
@@ -129,6 +330,9 @@ def upsert_doctor_rule(
             enabled=payload.enabled,
         )
         db.add(record)
+    record.updated_at = models.utc_now()
+    db.flush()
+    refresh_deferrals(db, user.id, contact_ids=[payload.contact_id])
     db.commit()
     db.refresh(record)
     return schemas.DoctorRuleOut.model_validate(record)
@@ -153,10 +357,29 @@ def delete_doctor_rule(
     )
     if record:
         db.delete(record)
+        record_tombstone(db, user.id, TOMBSTONE_DOCTOR_RULE, record.id, record.contact_id)
+        db.flush()
+        refresh_deferrals(db, user.id, contact_ids=[contact_id])
         db.commit()
     return {"ok": True}
 
 
+@router.get("/preferences/changes")
+def preference_changes(
+    since: Optional[str] = None,
+    limit: int = CHANGES_DEFAULT_LIMIT,
+    db: Session = Depends(get_db),
+    user: models.User = Depends(get_current_user),
+):
+    items, deleted, cursor, has_more = list_changes(db, user.id, models.UserPreference, TOMBSTONE_PREFERENCE, since, changes_limit(limit))
+    return {
+        "items": [schemas.UserPreferenceOut.model_validate(record) for record in items],
+        "deleted": [tombstone_out(record) for record in deleted],
+        "cursor": cursor,
+        "hasMore": has_more,
+    }
+
+
 @router.get("/preferences/{key}", response_model=schemas.UserPreferenceOut | None)
 def get_preference(
     key: str,
@@ -205,6 +428,152 @@ def upsert_preference(
             value_json=payload.value_json,
         )
         db.add(record)
+    record.updated_at = models.utc_now()
     db.commit()
     db.refresh(record)
     return schemas.UserPreferenceOut.model_validate(record)
+
+
+@router.get("/deferrals")
+def list_deferral_totals(
+    from_month: str,
+    to_month: str,
+    include_non_operating: bool = True,
+    db: Session = Depends(get_db),
+    user: models.User = Depends(get_current_user),
+):
+    if month_index(from_month) < 0 or month_index(to_month) < 0:
+        raise HTTPException(status_code=400, detail="from_month and to_month must be YYYY-MM")
+    return {"totals": deferral_month_totals(db, user.id, from_month, to_month, include_non_operating)}
+
+
+@router.get("/cube")
+def read_gl_cube(
+    from_month: str,
+    to_month: str,
+    account: Optional[List[str]] = Query(None),
+    include_non_operating: bool = True,
+    view: str = "aggregate",
+    db: Session = Depends(get_db),
+    user: models.User = Depends(get_current_user),
+):
+    if month_index(from_month) < 0 or month_index(to_month) < 0:
+        raise HTTPException(status_code=400, detail="from_month and to_month must be YYYY-MM")
+    if from_month > to_month:
+        raise HTTPException(status_code=400, detail="from_month must not be after to_month")
+    if view not in ("aggregate", "cells"):
+        raise HTTPException(status_code=400, detail="view must be one of: aggregate, cells")
+    if ensure_gl_cube(db, user.id):
+        db.commit()
+    cells = cube_cells(db, user.id, from_month, to_month, account, include_non_operating)
+    if view == "aggregate":
+        return cube_aggregate(cells, from_month, to_month)
+    return {
+        "cells": [
+            {
+                "month": cell.month,
+                "account": cell.account,
+                "treatment": cell.treatment,
+                "nonOperating": cell.non_operating,
+                "amount": cell.amount,
+                "count": cell.count,
+            }
+            for cell in cells
+        ]
+    }
+
+
+@router.post("/effective")
+def effective_ledger(
+    payload: schemas.EffectiveLedgerRequest,
+    request: Request,
+    db: Session = Depends(get_db),
+    user: models.User = Depends(get_current_user),
+):
+    require_csrf(request)
+    start = parse_iso_date(payload.from_date, "from_date")
+    end = parse_iso_date(payload.to_date, "to_date")
+    if start > end:
+        raise HTTPException(status_code=400, detail="from_date must not be after to_date")
+    if payload.view not in ("aggregate", "rows"):
+        raise HTTPException(status_code=400, detail="view must be one of: aggregate, rows")
+    pl = None
+    if payload.pl is not None:
+        try:
+            pl = PLMatrix.from_wire(payload.pl)
+        except (KeyError, TypeError, ValueError) as exc:
+            raise HTTPException(status_code=400, detail="Invalid P&L payload") from exc
+
+    connection = db.query(models.XeroConnection).filter(models.XeroConnection.user_id == user.id).first()
+    if not connection or not connection.tenant_id:
+        raise HTTPException(status_code=400, detail="Xero tenant is not selected")
+    txns = load_gl_txns(db, connection.tenant_id, start, end)
+    overrides = (
+        db.query(models.TxnOverride)
+        .filter(models.TxnOverride.user_id == user.id, models.TxnOverride.tenant_id == user.id)
+        .all()
+    )
+    rules = (
+        db.query(models.DoctorRule)
+        .filter(models.DoctorRule.user_id == user.id, models.DoctorRule.tenant_id == user.id)
+        .all()
+    )
+    ledger = build_effective_ledger(txns, overrides, rules)
+
+    if payload.view == "rows":
+        page = max(1, payload.page)
+        page_size = min(max(1, payload.page_size), LEDGER_MAX_PAGE_SIZE)
+        return {
+            "rows": ledger.rows((page - 1) * page_size, page_size),
+            "total": len(ledger),
+            "page": page,
+            "pageSize": page_size,
+        }
+    months = None
+    if pl is None:
+        first = start.year * 12 + start.month - 1
+        months = [month_key(index) for index in range(first, end.year * 12 + end.month)]
+    return {**ledger.aggregate(pl, months, payload.include_non_operating), "txns": len(txns), "rows": len(ledger)}
+
+
+@router.post("/hashes")
+def hash_transactions(
+    payload: schemas.TxnHashRequest,
+    request: Request,
+    user: models.User = Depends(get_current_user),
+):
+    require_csrf(request)
+    if len(payload.txns) > LEDGER_CLASSIFY_MAX_TXNS:
+        raise HTTPException(status_code=413, detail=f"At most {LEDGER_CLASSIFY_MAX_TXNS} transactions per request")
+    return JSONResponse({
+        "hashes": txn_hashes(payload.txns),
+        "legacyHashes": legacy_txn_hashes(payload.txns) if payload.include_legacy else None,
+    })
+
+
+@router.post("/classify")
+def classify_ledger(
+    payload: schemas.LedgerClassifyRequest,
+    request: Request,
+    db: Session = Depends(get_db),
+    user: models.User = Depends(get_current_user),
+):
+    require_csrf(request)
+    txns = payload.txns
+    if txns is None:
+        start = parse_iso_date(payload.from_date, "from_date") if payload.from_date else None
+        end = parse_iso_date(payload.to_date, "to_date") if payload.to_date else None
+        connection = db.query(models.XeroConnection).filter(models.XeroConnection.user_id == user.id).first()
+        if not connection or not connection.tenant_id:
+            raise HTTPException(status_code=400, detail="Xero tenant is not selected")
+        txns = load_gl_txns(db, connection.tenant_id, start, end)
+    elif len(txns) > LEDGER_CLASSIFY_MAX_TXNS:
+        raise HTTPException(status_code=413, detail=f"At most {LEDGER_CLASSIFY_MAX_TXNS} transactions per request")
+    overrides = (
+        db.query(models.TxnOverride)
+        .filter(models.TxnOverride.user_id == user.id, models.TxnOverride.tenant_id == user.id)
+        .all()
+    )
+    result = get_classifier(db, user.id).classify(txns, overrides, payload.include_hashes)
+    # Columnar lists of this size are slow through jsonable_encoder; they are plain JSON already.
+    return JSONResponse(result)
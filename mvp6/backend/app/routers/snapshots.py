@@ -1,51 +1,148 @@
-from fastapi import APIRouter, Depends, HTTPException, Request, status
-from sqlalchemy.orm import Session
+import os
+from typing import List, Optional, Tuple
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from sqlalchemy import String, and_, func, literal, or_
+from sqlalchemy.orm import Session, defer
 from ..db import get_db
 from .. import models, schemas
 from ..auth import get_current_user, require_csrf
-from ..rbac import SnapshotRole, require_role, resolve_role
+from ..ledger_sync import decode_cursor, encode_cursor
+from ..rbac import SnapshotRole, require_role, resolve_role, role_for_share
+from ..snapshot_store import copy_snapshot_payload, read_snapshot_payload, release_snapshot_payload, set_snapshot_payload
+from ..user_roles import normalize_user_role
+
+SNAPSHOT_DEFAULT_PAGE_SIZE = int(os.environ.get("SNAPSHOT_DEFAULT_PAGE_SIZE", "100"))
+SNAPSHOT_MAX_PAGE_SIZE = int(os.environ.get("SNAPSHOT_MAX_PAGE_SIZE", "500"))
+SNAPSHOT_SCOPES = ("all", "owned", "shared")
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
 
 router = APIRouter(prefix="/api/snapshots", tags=["snapshots"])
 
 
-def snapshot_to_out(db: Session, snapshot: models.Snapshot, role: SnapshotRole, include_payload: bool) -> schemas.SnapshotOut:
-    owner = db.query(models.User).filter(models.User.id == snapshot.owner_user_id).first()
+def snapshot_to_out(
+    db: Session,
+    snapshot: models.Snapshot,
+    role: SnapshotRole,
+    include_payload: bool,
+    owner_email: Optional[str] = None,
+) -> schemas.SnapshotOut:
+    if owner_email is None:
+        owner = db.query(models.User).filter(models.User.id == snapshot.owner_user_id).first()
+        owner_email = owner.email if owner else None
     payload = None
     if include_payload:
-        payload = schemas.SnapshotPayload(schema_version=snapshot.schema_version, data=snapshot.payload)
-    summary = None
-    if isinstance(snapshot.payload, dict):
-        summary = snapshot.payload.get("summary")
+        payload = schemas.SnapshotPayload(schema_version=snapshot.schema_version, data=read_snapshot_payload(db, snapshot))
     return schemas.SnapshotOut(
         id=snapshot.id,
         name=snapshot.name,
         owner_user_id=snapshot.owner_user_id,
-        owner_email=owner.email if owner else "unknown@example.com",
+        owner_email=owner_email or "unknown@example.com",
         role=role.value,
         payload=payload,
-        summary=summary,
+        summary=snapshot.summary,
+        payload_size=snapshot.payload_size,
+        payload_hash=snapshot.payload_hash,
         created_at=snapshot.created_at,
         updated_at=snapshot.updated_at,
     )
 
 
-@router.get("", response_model=list[schemas.SnapshotOut])
-def list_snapshots(db: Session = Depends(get_db), user: models.User = Depends(get_current_user)):
-    owned = db.query(models.Snapshot).filter(models.Snapshot.owner_user_id == user.id).all()
+def load_snapshot(db: Session, snapshot_id: str, with_payload: bool = False) -> models.Snapshot:
+    # Most endpoints only need the row for RBAC and metadata; the payload stays deferred.
+    query = db.query(models.Snapshot).filter(models.Snapshot.id == snapshot_id)
+    if not with_payload:
+        query = query.options(defer(models.Snapshot.payload), defer(models.Snapshot.payload_blob))
+    snap = query.first()
+    if not snap:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Snapshot not found")
+    return snap
+
+
+def list_user_snapshots(
+    db: Session,
+    user: models.User,
+    scope: str = "all",
+    role: Optional[SnapshotRole] = None,
+    name_prefix: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = SNAPSHOT_DEFAULT_PAGE_SIZE,
+) -> Tuple[List[schemas.SnapshotOut], Optional[str]]:
+    # Newest first, keyset-paginated on (updated_at, id). Owned and shared snapshots are
+    # two index-backed streams, each read past the cursor, merged and cut at `limit`.
+    # The payload is never read here; touching it would raise instead of loading it.
+    super_admin = normalize_user_role(getattr(user, "role", "view")) == "super_admin"
+    owned = (
+        db.query(models.Snapshot, literal(user.email), literal(None, String))
+        .filter(models.Snapshot.owner_user_id == user.id)
+    )
     shared = (
-        db.query(models.Snapshot)
+        db.query(models.Snapshot, models.User.email, models.SnapshotShare.role)
         .join(models.SnapshotShare, models.SnapshotShare.snapshot_id == models.Snapshot.id)
-        .filter(models.SnapshotShare.user_id == user.id)
-        .all()
+        .outerjoin(models.User, models.User.id == models.Snapshot.owner_user_id)
+        .filter(models.SnapshotShare.user_id == user.id, models.Snapshot.owner_user_id != user.id)
     )
+    streams = {"owned": owned, "shared": shared}
+    if scope != "all":
+        streams = {scope: streams[scope]}
+    if role is not None and role != SnapshotRole.owner:
+        streams.pop("owned", None)
+        if super_admin:
+            streams.pop("shared", None)
+        elif "shared" in streams:
+            streams["shared"] = streams["shared"].filter(models.SnapshotShare.role == role.value)
+    elif role == SnapshotRole.owner and not super_admin:
+        streams.pop("shared", None)
+
+    rows = []
+    for query in streams.values():
+        query = query.options(
+            defer(models.Snapshot.payload, raiseload=True),
+            defer(models.Snapshot.payload_blob, raiseload=True),
+        )
+        if name_prefix:
+            query = query.filter(func.lower(models.Snapshot.name).startswith(name_prefix.lower(), autoescape=True))
+        if cursor:
+            stamp, record_id = decode_cursor(cursor, "cursor")
+            query = query.filter(or_(
+                models.Snapshot.updated_at < stamp,
+                and_(models.Snapshot.updated_at == stamp, models.Snapshot.id < record_id),
+            ))
+        query = query.order_by(models.Snapshot.updated_at.desc(), models.Snapshot.id.desc())
+        rows += query.limit(limit + 1).all()
+    rows.sort(key=lambda row: (row[0].updated_at, row[0].id), reverse=True)
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1][0].updated_at, rows[-1][0].id)
+
     snapshots = []
-    for snap in owned:
-        snapshots.append(snapshot_to_out(db, snap, SnapshotRole.owner, include_payload=False))
-    for snap in shared:
-        role = resolve_role(db, snap, user)
-        if role:
-            snapshots.append(snapshot_to_out(db, snap, role, include_payload=False))
-    return sorted(snapshots, key=lambda s: s.updated_at, reverse=True)
+    for snap, owner_email, share_role in rows:
+        snap_role = role_for_share(snap.owner_user_id, user, share_role)
+        if snap_role:
+            snapshots.append(snapshot_to_out(db, snap, snap_role, include_payload=False, owner_email=owner_email or ""))
+    return snapshots, next_cursor
+
+
+@router.get("", response_model=list[schemas.SnapshotOut])
+def list_snapshots(
+    response: Response,
+    scope: str = "all",
+    role: Optional[SnapshotRole] = None,
+    name_prefix: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1),
+    db: Session = Depends(get_db),
+    user: models.User = Depends(get_current_user),
+):
+    # X-Next-Cursor carries the cursor for the following page while there is one.
+    if scope not in SNAPSHOT_SCOPES:
+        raise HTTPException(status_code=400, detail=f"scope must be one of: {', '.join(SNAPSHOT_SCOPES)}")
+    page_size = min(limit or SNAPSHOT_DEFAULT_PAGE_SIZE, SNAPSHOT_MAX_PAGE_SIZE)
+    snapshots, next_cursor = list_user_snapshots(db, user, scope, role, name_prefix, cursor, page_size)
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return snapshots
 
 
 @router.post("", response_model=schemas.SnapshotOut)
@@ -56,12 +153,8 @@ def create_snapshot(
     user: models.User = Depends(get_current_user),
 ):
     require_csrf(request)
-    snap = models.Snapshot(
-        owner_user_id=user.id,
-        name=payload.name,
-        payload=payload.payload.data,
-        schema_version=payload.payload.schema_version,
-    )
+    snap = models.Snapshot(owner_user_id=user.id, name=payload.name)
+    set_snapshot_payload(db, snap, payload.payload.data, payload.payload.schema_version)
     db.add(snap)
     db.commit()
     db.refresh(snap)
@@ -70,9 +163,7 @@ def create_snapshot(
 
 @router.get("/{snapshot_id}", response_model=schemas.SnapshotOut)
 def get_snapshot(snapshot_id: str, db: Session = Depends(get_db), user: models.User = Depends(get_current_user)):
-    snap = db.query(models.Snapshot).filter(models.Snapshot.id == snapshot_id).first()
-    if not snap:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Snapshot not found")
+    snap = load_snapshot(db, snapshot_id, with_payload=True)
     role = resolve_role(db, snap, user)
     require_role(role, SnapshotRole.viewer)
     return snapshot_to_out(db, snap, role, include_payload=True)
@@ -87,16 +178,13 @@ def update_snapshot(
     user: models.User = Depends(get_current_user),
 ):
     require_csrf(request)
-    snap = db.query(models.Snapshot).filter(models.Snapshot.id == snapshot_id).first()
-    if not snap:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Snapshot not found")
+    snap = load_snapshot(db, snapshot_id)
     role = resolve_role(db, snap, user)
     require_role(role, SnapshotRole.editor)
     if payload.name:
         snap.name = payload.name
     if payload.payload:
-        snap.payload = payload.payload.data
-        snap.schema_version = payload.payload.schema_version
+        set_snapshot_payload(db, snap, payload.payload.data, payload.payload.schema_version)
     db.commit()
     db.refresh(snap)
     return snapshot_to_out(db, snap, role, include_payload=False)
@@ -110,17 +198,11 @@ def duplicate_snapshot(
     user: models.User = Depends(get_current_user),
 ):
     require_csrf(request)
-    snap = db.query(models.Snapshot).filter(models.Snapshot.id == snapshot_id).first()
-    if not snap:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Snapshot not found")
+    snap = load_snapshot(db, snapshot_id)
     role = resolve_role(db, snap, user)
     require_role(role, SnapshotRole.viewer)
-    copy = models.Snapshot(
-        owner_user_id=user.id,
-        name=f"{snap.name} (Copy)",
-        payload=snap.payload,
-        schema_version=snap.schema_version,
-    )
+    copy = models.Snapshot(owner_user_id=user.id, name=f"{snap.name} (Copy)")
+    copy_snapshot_payload(db, snap, copy)
     db.add(copy)
     db.commit()
     db.refresh(copy)
@@ -135,11 +217,10 @@ def delete_snapshot(
     user: models.User = Depends(get_current_user),
 ):
     require_csrf(request)
-    snap = db.query(models.Snapshot).filter(models.Snapshot.id == snapshot_id).first()
-    if not snap:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Snapshot not found")
+    snap = load_snapshot(db, snapshot_id)
     if snap.owner_user_id != user.id:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Only owner can delete")
+    release_snapshot_payload(db, snap)
     db.delete(snap)
     db.commit()
     return {"ok": True}
@@ -147,9 +228,7 @@ def delete_snapshot(
 
 @router.get("/{snapshot_id}/shares", response_model=list[schemas.SnapshotShareOut])
 def list_shares(snapshot_id: str, db: Session = Depends(get_db), user: models.User = Depends(get_current_user)):
-    snap = db.query(models.Snapshot).filter(models.Snapshot.id == snapshot_id).first()
-    if not snap:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Snapshot not found")
+    snap = load_snapshot(db, snapshot_id)
     role = resolve_role(db, snap, user)
     require_role(role, SnapshotRole.viewer)
     shares = (
@@ -181,9 +260,7 @@ def create_share(
     user: models.User = Depends(get_current_user),
 ):
     require_csrf(request)
-    snap = db.query(models.Snapshot).filter(models.Snapshot.id == snapshot_id).first()
-    if not snap:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Snapshot not found")
+    snap = load_snapshot(db, snapshot_id)
     role = resolve_role(db, snap, user)
     require_role(role, SnapshotRole.admin)
     target = db.query(models.User).filter(models.User.email == payload.email.lower()).first()
@@ -223,9 +300,7 @@ def update_share(
     user: models.User = Depends(get_current_user),
 ):
     require_csrf(request)
-    snap = db.query(models.Snapshot).filter(models.Snapshot.id == snapshot_id).first()
-    if not snap:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Snapshot not found")
+    snap = load_snapshot(db, snapshot_id)
     role = resolve_role(db, snap, user)
     require_role(role, SnapshotRole.admin)
     share = db.query(models.SnapshotShare).filter(models.SnapshotShare.id == share_id).first()
@@ -253,9 +328,7 @@ def delete_share(
     user: models.User = Depends(get_current_user),
 ):
     require_csrf(request)
-    snap = db.query(models.Snapshot).filter(models.Snapshot.id == snapshot_id).first()
-    if not snap:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Snapshot not found")
+    snap = load_snapshot(db, snapshot_id)
     role = resolve_role(db, snap, user)
     require_role(role, SnapshotRole.admin)
     share = db.query(models.SnapshotShare).filter(models.SnapshotShare.id == share_id).first()
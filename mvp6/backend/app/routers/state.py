@@ -3,8 +3,7 @@ from sqlalchemy.orm import Session
 from ..db import get_db
 from .. import models, schemas
 from ..auth import get_current_user, require_csrf
-from ..rbac import SnapshotRole, resolve_role
-from .snapshots import snapshot_to_out
+from .snapshots import SNAPSHOT_DEFAULT_PAGE_SIZE, list_user_snapshots
 
 router = APIRouter(prefix="/api/state", tags=["state"])
 
@@ -34,20 +33,8 @@ def get_state(db: Session = Depends(get_db), user: models.User = Depends(get_cur
         .order_by(models.ImportRecord.created_at.desc())
         .all()
     )
-    owned = db.query(models.Snapshot).filter(models.Snapshot.owner_user_id == user.id).all()
-    shared = (
-        db.query(models.Snapshot)
-        .join(models.SnapshotShare, models.SnapshotShare.snapshot_id == models.Snapshot.id)
-        .filter(models.SnapshotShare.user_id == user.id)
-        .all()
-    )
-    snapshots = []
-    for snap in owned:
-        snapshots.append(snapshot_to_out(db, snap, SnapshotRole.owner, include_payload=False))
-    for snap in shared:
-        role = resolve_role(db, snap, user)
-        if role:
-            snapshots.append(snapshot_to_out(db, snap, role, include_payload=False))
+    # First page only; the rest is read from /api/snapshots?cursor=snapshots_cursor.
+    snapshots, snapshots_cursor = list_user_snapshots(db, user, limit=SNAPSHOT_DEFAULT_PAGE_SIZE)
     return schemas.StateResponse(
         template=schemas.ConfigOut.model_validate(template) if template else None,
         mapping=schemas.ConfigOut.model_validate(mapping) if mapping else None,
@@ -66,6 +53,7 @@ def get_state(db: Session = Depends(get_db), user: models.User = Depends(get_cur
             for i in imports
         ],
         snapshots=snapshots,
+        snapshots_cursor=snapshots_cursor,
     )
 
 
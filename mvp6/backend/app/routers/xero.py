@@ -1,23 +1,48 @@
+import asyncio
+import json
+import logging
 import os
 import secrets
+import threading
 import time
-from datetime import datetime, timedelta
-from typing import Any, Dict, List, Optional
+from datetime import date, datetime, timedelta
+from typing import Any, AsyncIterable, AsyncIterator, Dict, List, NamedTuple, Optional, Tuple
 
 import httpx
 from fastapi import APIRouter, Depends, HTTPException, Request, status
-from fastapi.responses import HTMLResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import HTMLResponse, StreamingResponse
 from sqlalchemy.orm import Session
-from xero_python.accounting import AccountingApi
 from xero_python.api_client import ApiClient, serialize
 from xero_python.api_client.configuration import Configuration
 from xero_python.api_client.oauth2 import OAuth2Token
 from xero_python.exceptions import AccessTokenExpiredError
 from xero_python.identity import IdentityApi
 
-from .. import models
+from .. import models, schemas
 from ..auth import get_current_user, require_csrf
+from ..dates import parse_iso_date
 from ..db import get_db
+from ..deferrals import rebuild_deferrals
+from ..gl_cube import refresh_tenant_cubes
+from ..gl_store import load_gl_txns, merge_account_order, plan_gl_fetch, rehash_overrides, store_gl_range
+from ..json_stream import JsonStreamReader
+from ..pl_matrix import PLMatrix, validate_pl_format
+from ..sync_jobs import JOB_CANCELLED, JOB_QUEUED, JOB_SUCCEEDED, ProgressCallback, enqueue_job, job_runner, register_job_handler
+from ..xero_cache import report_cache
+from ..xero_client import (
+    XeroRateLimited,
+    XeroRequestError,
+    gather_or_cancel,
+    get_report,
+    report_flights,
+    throttle_stats,
+    xero_headers,
+    xero_stream,
+)
+from .users import require_admin
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/api/xero", tags=["xero"])
 
@@ -29,6 +54,13 @@ XERO_REPORT_GL_URL = "https://api.xero.com/api.xro/2.0/Reports/GeneralLedger"
 
 DEFAULT_SCOPES = "offline_access accounting.reports.read accounting.journals.read accounting.transactions.read app.connections"
 
+XERO_GL_WINDOW_MONTHS = max(1, int(os.environ.get("XERO_GL_WINDOW_MONTHS", "1")))
+XERO_GL_CONCURRENCY = max(1, int(os.environ.get("XERO_GL_CONCURRENCY", "4")))
+# Xero returns at most 11 comparison periods (12 month columns) per P&L call.
+XERO_PL_MAX_PERIODS = min(11, max(0, int(os.environ.get("XERO_PL_MAX_PERIODS", "11"))))
+XERO_STREAM_TXN_CHUNK = max(1, int(os.environ.get("XERO_STREAM_TXN_CHUNK", "500")))
+XERO_STREAM_FLUSH_BYTES = max(1, int(os.environ.get("XERO_STREAM_FLUSH_BYTES", str(64 * 1024))))
+
 
 def get_xero_config() -> Dict[str, str]:
     client_id = os.environ.get("XERO_CLIENT_ID")
@@ -98,9 +130,14 @@ def normalize_month_label(label: str) -> Dict[str, str]:
         "december": 12,
     }
     parts = label.split()
+    if len(parts) == 3 and parts[0].isdigit():
+        # Period columns are titled by their end date, e.g. "31 Jan 2024".
+        parts = parts[1:]
     if len(parts) == 2 and parts[0].lower() in month_map and parts[1].isdigit():
         month = month_map[parts[0].lower()]
         year = int(parts[1])
+        if year < 100:
+            year += 2000
         key = f"{year}-{month:02d}"
         formatted = datetime(year, month, 1).strftime("%b %Y")
         return {"key": key, "label": formatted}
@@ -132,9 +169,19 @@ def is_summary_row(label: str) -> bool:
     }
 
 
-def parse_xero_pl(report: Dict[str, Any]) -> Dict[str, Any]:
+def report_column_titles(report: Dict[str, Any]) -> List[str]:
     columns = report.get("Columns") or []
-    titles = [str(col.get("Title") or "").strip() for col in columns]
+    if columns:
+        return [str(col.get("Title") or "").strip() for col in columns]
+    # Raw API responses carry the column titles in the leading Header row.
+    for row in report.get("Rows") or []:
+        if row.get("RowType") == "Header":
+            return [str(cell.get("Value") or "").strip() for cell in row.get("Cells") or []]
+    return []
+
+
+def parse_xero_pl(report: Dict[str, Any]) -> Dict[str, Any]:
+    titles = report_column_titles(report)
     if not titles:
         raise HTTPException(status_code=400, detail="Xero report did not include columns")
     month_titles = titles[1:]
@@ -198,22 +245,59 @@ def parse_xero_pl(report: Dict[str, Any]) -> Dict[str, Any]:
     return {"months": months, "monthLabels": month_labels, "accounts": accounts}
 
 
-def parse_xero_gl(report: Dict[str, Any]) -> Dict[str, Any]:
-    columns = report.get("Columns") or []
-    titles = [str(col.get("Title") or "").strip().lower() for col in columns]
+class GLColumns(NamedTuple):
+    date: int
+    description: int
+    source: int
+    debit: int
+    credit: int
+    amount: int
+
+
+def gl_columns(titles: List[str]) -> GLColumns:
+    titles = [title.lower() for title in titles]
+    return GLColumns(
+        date=next((i for i, t in enumerate(titles) if "date" in t), -1),
+        description=next((i for i, t in enumerate(titles) if "description" in t or "narration" in t), -1),
+        source=next((i for i, t in enumerate(titles) if "source" in t or "reference" in t), -1),
+        debit=next((i for i, t in enumerate(titles) if "debit" in t), -1),
+        credit=next((i for i, t in enumerate(titles) if "credit" in t), -1),
+        amount=next((i for i, t in enumerate(titles) if "amount" in t and "balance" not in t), -1),
+    )
 
-    def cell_value(cells: List[Dict[str, Any]], idx: int) -> Optional[str]:
+
+def gl_row_txn(cells: List[Dict[str, Any]], account: Optional[str], columns: GLColumns) -> Optional[Dict[str, Any]]:
+    def cell_value(idx: int) -> Optional[str]:
         if idx < 0 or idx >= len(cells):
             return None
         return cells[idx].get("Value")
 
-    date_idx = next((i for i, t in enumerate(titles) if "date" in t), -1)
-    desc_idx = next((i for i, t in enumerate(titles) if "description" in t or "narration" in t), -1)
-    source_idx = next((i for i, t in enumerate(titles) if "source" in t or "reference" in t), -1)
-    debit_idx = next((i for i, t in enumerate(titles) if "debit" in t), -1)
-    credit_idx = next((i for i, t in enumerate(titles) if "credit" in t), -1)
-    amount_idx = next((i for i, t in enumerate(titles) if "amount" in t and "balance" not in t), -1)
+    date = cell_value(columns.date) or ""
+    desc = cell_value(columns.description) or ""
+    source = cell_value(columns.source) or ""
+    debit = to_number(cell_value(columns.debit)) if columns.debit >= 0 else 0.0
+    credit = to_number(cell_value(columns.credit)) if columns.credit >= 0 else 0.0
+    amount = debit - credit
+    if columns.amount >= 0 and debit == 0.0 and credit == 0.0:
+        amount = to_number(cell_value(columns.amount))
+        debit = amount if amount > 0 else 0.0
+        credit = -amount if amount < 0 else 0.0
+    if not date and not desc and debit == 0.0 and credit == 0.0:
+        return None
+    return {
+        "account": account or "",
+        "date": date,
+        "source": source,
+        "description": desc,
+        "reference": source,
+        "debit": debit,
+        "credit": credit,
+        "amount": amount,
+    }
+
 
+def parse_xero_gl(report: Dict[str, Any]) -> Dict[str, Any]:
+    columns = gl_columns(report_column_titles(report))
     txns = []
 
     def walk(rows: List[Dict[str, Any]], account: Optional[str]):
@@ -223,34 +307,115 @@ def parse_xero_gl(report: Dict[str, Any]) -> Dict[str, Any]:
                 next_account = row.get("Title") or account
                 walk(row.get("Rows") or [], next_account)
             elif row_type == "Row":
-                cells = row.get("Cells") or []
-                date = cell_value(cells, date_idx) or ""
-                desc = cell_value(cells, desc_idx) or ""
-                source = cell_value(cells, source_idx) or ""
-                debit = to_number(cell_value(cells, debit_idx)) if debit_idx >= 0 else 0.0
-                credit = to_number(cell_value(cells, credit_idx)) if credit_idx >= 0 else 0.0
-                amount = debit - credit
-                if amount_idx >= 0 and debit == 0.0 and credit == 0.0:
-                    amount = to_number(cell_value(cells, amount_idx))
-                    debit = amount if amount > 0 else 0.0
-                    credit = -amount if amount < 0 else 0.0
-                if not date and not desc and debit == 0.0 and credit == 0.0:
-                    continue
-                txns.append({
-                    "account": account or "",
-                    "date": date,
-                    "source": source,
-                    "description": desc,
-                    "reference": source,
-                    "debit": debit,
-                    "credit": credit,
-                    "amount": amount,
-                })
+                txn = gl_row_txn(row.get("Cells") or [], account, columns)
+                if txn is not None:
+                    txns.append(txn)
 
     walk(report.get("Rows") or [], None)
     return {"txns": txns}
 
 
+async def iter_xero_gl_txns(chunks: AsyncIterable[bytes]) -> AsyncIterator[Dict[str, Any]]:
+    # Streaming counterpart of parse_xero_gl: walks the Reports/Rows tree straight off
+    # the byte stream and yields transactions one at a time. Column titles come from the
+    # report's Columns or its leading Header row, as in report_column_titles.
+    reader = JsonStreamReader(chunks)
+    columns = gl_columns([])
+
+    async def walk_rows(account: Optional[str]) -> AsyncIterator[Dict[str, Any]]:
+        nonlocal columns
+        async for _ in reader.iter_array():
+            row_type = None
+            title = None
+            cells = None
+            async for key in reader.iter_object():
+                if key == "RowType":
+                    row_type = await reader.value()
+                elif key == "Title":
+                    title = await reader.value()
+                elif key == "Cells":
+                    cells = await reader.value() or []
+                elif key == "Rows":
+                    async for txn in walk_rows(title or account):
+                        yield txn
+                else:
+                    await reader.skip()
+            if row_type == "Header" and cells is not None:
+                columns = gl_columns([str(cell.get("Value") or "").strip() for cell in cells])
+            elif row_type == "Row" and cells is not None:
+                txn = gl_row_txn(cells, account, columns)
+                if txn is not None:
+                    yield txn
+
+    async for key in reader.iter_object():
+        if key != "Reports":
+            await reader.skip()
+            continue
+        async for index in reader.iter_array():
+            if index > 0:
+                await reader.skip()
+                continue
+            async for report_key in reader.iter_object():
+                if report_key == "Columns":
+                    columns = gl_columns([str(col.get("Title") or "").strip() for col in await reader.value() or []])
+                elif report_key == "Rows":
+                    async for txn in walk_rows(None):
+                        yield txn
+                else:
+                    await reader.skip()
+
+
+def add_months(value: date, months: int) -> date:
+    index = value.year * 12 + value.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def split_date_range(start: date, end: date, window_months: int) -> List[Tuple[date, date]]:
+    windows = []
+    window_start = start
+    while window_start <= end:
+        next_start = add_months(window_start, window_months)
+        windows.append((window_start, min(next_start - timedelta(days=1), end)))
+        window_start = next_start
+    return windows
+
+
+def plan_pl_windows(start: date, end: date) -> List[Dict[str, Any]]:
+    # Each call anchors on the latest month of its chunk and asks for the preceding
+    # months as comparison periods, so N months cost ceil(N / 12) calls.
+    months = []
+    month = date(start.year, start.month, 1)
+    while month <= end:
+        months.append(month)
+        month = add_months(month, 1)
+    per_call = XERO_PL_MAX_PERIODS + 1
+    windows = []
+    for idx in range(0, len(months), per_call):
+        chunk = months[idx:idx + per_call]
+        anchor = chunk[-1]
+        params: Dict[str, Any] = {
+            "fromDate": anchor.isoformat(),
+            "toDate": (add_months(anchor, 1) - timedelta(days=1)).isoformat(),
+            "timeframe": "MONTH",
+        }
+        if len(chunk) > 1:
+            params["periods"] = len(chunk) - 1
+        windows.append(params)
+    return windows
+
+
+def stitch_gl_windows(windows: List[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    # Xero emits one section per account in a stable order, so rebuild that order
+    # across windows and concatenate each account's lines window by window.
+    account_order: List[str] = []
+    by_account: Dict[str, List[Dict[str, Any]]] = {}
+    for txns in windows:
+        account_order = merge_account_order(account_order, (txn["account"] for txn in txns))
+        for txn in txns:
+            by_account.setdefault(txn["account"], []).append(txn)
+    return [txn for account in account_order for txn in by_account[account]]
+
+
 def upsert_connection(db: Session, user_id: str, token_data: Dict[str, Any]) -> models.XeroConnection:
     expires_in = int(token_data.get("expires_in", 1800))
     expires_at = datetime.utcnow() + timedelta(seconds=expires_in)
@@ -307,12 +472,40 @@ def build_xero_api_client(
     return api_client
 
 
+# Striped so the lock table stays a fixed size however many connections come and go.
+# These only serialise threads within one process (and cover SQLite, which ignores
+# FOR UPDATE); the row lock in ensure_access_token serialises processes.
+TOKEN_LOCK_STRIPES = 64
+_token_locks = [threading.Lock() for _ in range(TOKEN_LOCK_STRIPES)]
+
+
+def connection_token_lock(connection_id: str) -> threading.Lock:
+    return _token_locks[hash(connection_id) % TOKEN_LOCK_STRIPES]
+
+
 def ensure_access_token(db: Session, connection: models.XeroConnection, config: Dict[str, str]) -> str:
-    api_client = build_xero_api_client(db, connection, config)
-    try:
-        return api_client.configuration.oauth2_token.get_valid_access_token(api_client)
-    except AccessTokenExpiredError as exc:
-        raise HTTPException(status_code=502, detail="Failed to refresh Xero token") from exc
+    # Xero rotates the refresh token on every refresh, so concurrent refreshes would
+    # invalidate each other. Lock the connection row and re-read it first: a caller that
+    # waited reuses the token the first one saved.
+    with connection_token_lock(connection.id):
+        try:
+            (
+                db.query(models.XeroConnection)
+                .filter(models.XeroConnection.id == connection.id)
+                .with_for_update()
+                .populate_existing()
+                .one()
+            )
+            api_client = build_xero_api_client(db, connection, config)
+            oauth2_token = api_client.configuration.oauth2_token
+            try:
+                oauth2_token.update_token(**api_client.get_oauth2_token())
+                return oauth2_token.get_valid_access_token(api_client)
+            except AccessTokenExpiredError as exc:
+                raise HTTPException(status_code=502, detail="Failed to refresh Xero token") from exc
+        finally:
+            # Ends the transaction so the row lock is released even when no refresh was saved.
+            db.commit()
 
 
 @router.get("/status")
@@ -377,6 +570,7 @@ def xero_tenants(user: models.User = Depends(get_current_user), db: Session = De
     connection = db.query(models.XeroConnection).filter(models.XeroConnection.user_id == user.id).first()
     if not connection:
         raise HTTPException(status_code=400, detail="Xero connection not found")
+    ensure_access_token(db, connection, config)
     api_client = build_xero_api_client(db, connection, config)
     identity_api = IdentityApi(api_client)
     try:
@@ -406,60 +600,410 @@ def xero_set_tenant(
     return {"ok": True, "tenantId": tenant_id}
 
 
+class XeroReportFetcher:
+    def __init__(
+        self,
+        access_token: str,
+        tenant_id: str,
+        user_id: str,
+        use_cache: bool = True,
+        progress: Optional[ProgressCallback] = None,
+        txn_chunk: Optional[int] = None,
+    ):
+        self.access_token = access_token
+        self.tenant_id = tenant_id
+        self.user_id = user_id
+        self.use_cache = use_cache
+        self.progress = progress
+        # When set, each GL window's parsed lines go out as gl_txns events of this size.
+        self.txn_chunk = txn_chunk
+        self.txns_sent = 0
+
+    async def emit_txns(self, txns: List[Dict[str, Any]], **data: Any) -> None:
+        # Offsets count lines across every gl_txns event of the sync, in emission order.
+        for offset in range(0, len(txns), self.txn_chunk):
+            chunk = txns[offset:offset + self.txn_chunk]
+            await self.emit("gl_txns", offset=self.txns_sent, txns=chunk, **data)
+            self.txns_sent += len(chunk)
+
+    async def emit(self, event: str, **data: Any) -> None:
+        if self.progress is not None:
+            await self.progress(event, data)
+
+    async def report(self, name: str, url: str, params: Dict[str, Any], parser, detail: str) -> Optional[Dict[str, Any]]:
+        key = report_cache.make_key(self.tenant_id, name, params)
+        entry = None
+        if self.use_cache:
+            entry, fresh = report_cache.lookup(key)
+            if entry is not None and fresh:
+                return entry.value
+        else:
+            report_cache.mark_bypassed()
+        # Identical windows requested by concurrent syncs share a single download.
+        return await report_flights.do(key, lambda: self.download(key, entry, url, params, parser, detail))
+
+    async def download(self, key, entry, url: str, params: Dict[str, Any], parser, detail: str) -> Optional[Dict[str, Any]]:
+        try:
+            response = await get_report(
+                url,
+                self.access_token,
+                self.tenant_id,
+                params,
+                user_id=self.user_id,
+                etag=entry.etag if entry else None,
+                last_modified=entry.last_modified if entry else None,
+            )
+        except XeroRateLimited as exc:
+            headers = {"Retry-After": str(int(exc.retry_after + 0.999))} if exc.retry_after is not None else None
+            raise HTTPException(status_code=429, detail="Xero rate limit reached; try again shortly", headers=headers) from exc
+        except (XeroRequestError, httpx.HTTPError, ValueError) as exc:
+            raise HTTPException(status_code=502, detail=detail) from exc
+        if response.not_modified and entry is not None:
+            report_cache.mark_revalidated(key)
+            return entry.value
+        report = ((response.data or {}).get("Reports") or [None])[0]
+        if not report:
+            return None
+        parsed = await run_in_threadpool(parser, report)
+        report_cache.put(key, parsed, response.size, response.etag, response.last_modified)
+        return parsed
+
+    async def profit_and_loss(self, start: date, end: date, pl_format: str = "json") -> Dict[str, Any]:
+        async def fetch_window(params: Dict[str, Any]) -> Dict[str, Any]:
+            parsed = await self.report("pl", XERO_REPORT_PL_URL, params, parse_xero_pl, "Failed to fetch Xero Profit & Loss")
+            if parsed is None:
+                raise HTTPException(status_code=502, detail="Xero Profit & Loss report was empty")
+            return parsed
+
+        results = await gather_or_cancel(*(fetch_window(params) for params in plan_pl_windows(start, end)))
+        await self.emit("pl_fetched", windows=len(results))
+        merged = PLMatrix.merge([PLMatrix.from_parsed(window) for window in results]).to_wire(pl_format)
+        await self.emit("pl_parsed", pl=merged)
+        return merged
+
+    async def general_ledger(self, start: date, end: date) -> Dict[str, Any]:
+        semaphore = asyncio.Semaphore(XERO_GL_CONCURRENCY)
+
+        windows = split_date_range(start, end, XERO_GL_WINDOW_MONTHS)
+        completed = 0
+
+        async def fetch_window(window_start: date, window_end: date) -> List[Dict[str, Any]]:
+            nonlocal completed
+            params = {"fromDate": window_start.isoformat(), "toDate": window_end.isoformat()}
+            async with semaphore:
+                parsed = await self.report("gl", XERO_REPORT_GL_URL, params, parse_xero_gl, "Failed to fetch Xero General Ledger")
+            txns = parsed["txns"] if parsed else []
+            completed += 1
+            await self.emit(
+                "gl_window",
+                fromDate=params["fromDate"],
+                toDate=params["toDate"],
+                txns=len(txns),
+                completed=completed,
+                windows=len(windows),
+            )
+            if self.txn_chunk:
+                await self.emit_txns(txns, fromDate=params["fromDate"], toDate=params["toDate"])
+            return txns
+
+        results = await gather_or_cancel(*(fetch_window(window_start, window_end) for window_start, window_end in windows))
+        return {"txns": stitch_gl_windows(results)}
+
+
+def parse_sync_request(payload: Dict[str, Any]) -> Tuple[date, date, bool]:
+    from_date = payload.get("from_date")
+    to_date = payload.get("to_date")
+    if not from_date or not to_date:
+        raise HTTPException(status_code=400, detail="from_date and to_date are required")
+    start = parse_iso_date(from_date, "from_date")
+    end = parse_iso_date(to_date, "to_date")
+    if start > end:
+        raise HTTPException(status_code=400, detail="from_date must not be after to_date")
+    validate_pl_format(payload.get("pl_format"))
+    return start, end, bool(payload.get("include_gl", True))
+
+
+def tenant_access_token(db: Session, user_id: str, config: Dict[str, str]) -> Tuple[str, str]:
+    # Blocking DB work for the async sync endpoints; run it in the threadpool.
+    connection = db.query(models.XeroConnection).filter(models.XeroConnection.user_id == user_id).first()
+    if not connection or not connection.tenant_id:
+        raise HTTPException(status_code=400, detail="Xero tenant is not selected")
+    return ensure_access_token(db, connection, config), connection.tenant_id
+
+
+def store_synced_gl(db: Session, user_id: str, tenant_id: str, start: date, end: date, txns: List[Dict[str, Any]]) -> int:
+    # The stored lines and everything derived from them are committed together.
+    stored = store_gl_range(db, tenant_id, start, end, txns)
+    rehash_overrides(db, user_id)
+    rebuild_deferrals(db, user_id)
+    refresh_tenant_cubes(db, tenant_id, start, end)
+    db.commit()
+    return stored
+
+
+async def run_xero_sync(
+    db: Session,
+    user_id: str,
+    payload: Dict[str, Any],
+    progress: Optional[ProgressCallback] = None,
+    load_gl: bool = True,
+    stream_txns: bool = False,
+) -> Dict[str, Any]:
+    async def emit(event: str, **data: Any) -> None:
+        if progress is not None:
+            await progress(event, data)
+
+    start, end, include_gl = parse_sync_request(payload)
+    access_token, tenant_id = await run_in_threadpool(tenant_access_token, db, user_id, get_xero_config())
+    await emit("token")
+    fetcher = XeroReportFetcher(
+        access_token,
+        tenant_id,
+        user_id,
+        use_cache=payload.get("cache", "use") != "bypass",
+        progress=progress,
+        txn_chunk=XERO_STREAM_TXN_CHUNK if stream_txns else None,
+    )
+    fetches = [fetcher.profit_and_loss(start, end, validate_pl_format(payload.get("pl_format")))]
+    gl_range = None
+    if include_gl:
+        # Only pull what is newer than the stored high-water mark (plus the re-check window).
+        gl_range = await run_in_threadpool(plan_gl_fetch, db, tenant_id, start, end)
+        if stream_txns:
+            # Stored lines before the fetched range go out first; fetched windows follow
+            # as each one completes.
+            stored_end = gl_range[0] - timedelta(days=1) if gl_range else end
+            if stored_end >= start:
+                stored_txns = await run_in_threadpool(load_gl_txns, db, tenant_id, start, stored_end)
+                await fetcher.emit_txns(stored_txns, fromDate=start.isoformat(), toDate=stored_end.isoformat(), stored=True)
+        if gl_range:
+            fetches.append(fetcher.general_ledger(*gl_range))
+    results = await gather_or_cancel(*fetches)
+    await emit("fetched")
+
+    pl_parsed = results[0]
+    gl_parsed = None
+    gl_sync = None
+    if include_gl:
+        stored = 0
+        if gl_range:
+            stored = await run_in_threadpool(store_synced_gl, db, user_id, tenant_id, gl_range[0], gl_range[1], results[1]["txns"])
+        gl_sync = {
+            "fetchedFrom": gl_range[0].isoformat() if gl_range else None,
+            "fetchedTo": gl_range[1].isoformat() if gl_range else None,
+            "stored": stored,
+        }
+        await emit("gl_stored", **gl_sync)
+        if load_gl:
+            gl_parsed = {"txns": await run_in_threadpool(load_gl_txns, db, tenant_id, start, end)}
+
+    return {"pl": pl_parsed, "gl": gl_parsed, "glSync": gl_sync, "tenantId": tenant_id, "txnsStreamed": fetcher.txns_sent}
+
+
 @router.post("/sync")
-def xero_sync(
+async def xero_sync(
     payload: Dict[str, Any],
     request: Request,
     user: models.User = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
     require_csrf(request)
-    from_date = payload.get("from_date")
-    to_date = payload.get("to_date")
-    include_gl = payload.get("include_gl", True)
-    if not from_date or not to_date:
-        raise HTTPException(status_code=400, detail="from_date and to_date are required")
+    return await run_xero_sync(db, user.id, payload)
 
-    config = get_xero_config()
+
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'), default=str)}\n\n"
+
+
+@router.post("/sync/stream")
+async def xero_sync_stream(
+    payload: Dict[str, Any],
+    request: Request,
+    user: models.User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    require_csrf(request)
+    parse_sync_request(payload)
+    stream_txns = bool(payload.get("stream_txns", True))
+    user_id = user.id
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def progress(event: str, data: Dict[str, Any]) -> None:
+        await queue.put((event, data))
+
+    async def run() -> None:
+        # Every outcome ends the stream with an event; nothing is raised out of the task.
+        try:
+            result = await run_xero_sync(db, user_id, payload, progress, load_gl=False, stream_txns=stream_txns)
+            await queue.put(("done", {"glSync": result["glSync"], "tenantId": result["tenantId"], "txns": result["txnsStreamed"]}))
+        except HTTPException as exc:
+            await queue.put(("error", {"status": exc.status_code, "detail": exc.detail}))
+        except Exception:
+            logger.exception("Xero sync stream failed for user %s", user_id)
+            await queue.put(("error", {"status": 500, "detail": "Sync failed"}))
+
+    async def events():
+        task = asyncio.create_task(run())
+        try:
+            while True:
+                event, data = await queue.get()
+                yield sse_event(event, data)
+                if event in ("done", "error"):
+                    break
+        finally:
+            # Client disconnects cancel the generator; stop the upstream fetches with it.
+            if not task.done():
+                task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            await run_in_threadpool(db.close)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.post("/gl/stream")
+async def xero_gl_stream(
+    payload: Dict[str, Any],
+    request: Request,
+    user: models.User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    # Constant-memory GL export: each window is parsed straight off the Xero response
+    # stream and written out as NDJSON, one transaction per line. Nothing is cached or
+    # stored, and lines come out window by window rather than grouped by account.
+    require_csrf(request)
+    start, end, _ = parse_sync_request(payload)
+    user_id = user.id
+    access_token, tenant_id = await run_in_threadpool(tenant_access_token, db, user_id, get_xero_config())
+    # Release the DB connection for the length of the stream.
+    await run_in_threadpool(db.close)
+
+    async def lines():
+        buffered: List[str] = []
+        size = 0
+        try:
+            for window_start, window_end in split_date_range(start, end, XERO_GL_WINDOW_MONTHS):
+                params = {"fromDate": window_start.isoformat(), "toDate": window_end.isoformat()}
+                async with xero_stream(
+                    "GET", XERO_REPORT_GL_URL, tenant_id, user_id, params=params, headers=xero_headers(access_token, tenant_id)
+                ) as response:
+                    if response.status_code >= 400:
+                        raise XeroRequestError(response.status_code)
+                    async for txn in iter_xero_gl_txns(response.aiter_bytes()):
+                        line = json.dumps(txn, separators=(",", ":")) + "\n"
+                        buffered.append(line)
+                        size += len(line)
+                        if size >= XERO_STREAM_FLUSH_BYTES:
+                            yield "".join(buffered)
+                            buffered, size = [], 0
+        except XeroRateLimited:
+            buffered.append(json.dumps({"error": {"status": 429, "detail": "Xero rate limit reached; try again shortly"}}) + "\n")
+        except (XeroRequestError, httpx.HTTPError, ValueError):
+            buffered.append(json.dumps({"error": {"status": 502, "detail": "Failed to fetch Xero General Ledger"}}) + "\n")
+        if buffered:
+            yield "".join(buffered)
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson", headers={"X-Accel-Buffering": "no"})
+
+
+async def xero_sync_job(db: Session, job: models.SyncJob, progress: ProgressCallback) -> Dict[str, Any]:
+    # The GL is already persisted in the store, so the job result only keeps the P&L
+    # and sync summary; /result reloads the ledger rows on demand.
+    result = await run_xero_sync(db, job.user_id, job.params, progress, load_gl=False)
+    result.pop("gl", None)
+    return result
+
+
+register_job_handler("xero_sync", xero_sync_job)
+
+
+def get_sync_job(db: Session, user_id: str, job_id: str) -> models.SyncJob:
+    job = db.query(models.SyncJob).filter(models.SyncJob.id == job_id, models.SyncJob.user_id == user_id).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Sync job not found")
+    return job
+
+
+@router.post("/jobs", response_model=schemas.SyncJobOut, status_code=status.HTTP_202_ACCEPTED)
+def xero_create_job(
+    payload: Dict[str, Any],
+    request: Request,
+    user: models.User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    require_csrf(request)
+    parse_sync_request(payload)
+    params = {key: payload[key] for key in ("from_date", "to_date", "include_gl", "cache", "pl_format") if key in payload}
+    return enqueue_job(db, user.id, "xero_sync", params)
+
+
+@router.get("/jobs", response_model=List[schemas.SyncJobOut])
+def xero_list_jobs(user: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
+    return (
+        db.query(models.SyncJob)
+        .filter(models.SyncJob.user_id == user.id)
+        .order_by(models.SyncJob.created_at.desc())
+        .limit(50)
+        .all()
+    )
+
+
+@router.get("/jobs/{job_id}", response_model=schemas.SyncJobOut)
+def xero_get_job(job_id: str, user: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
+    return get_sync_job(db, user.id, job_id)
+
+
+@router.get("/jobs/{job_id}/result")
+def xero_job_result(job_id: str, user: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
+    job = get_sync_job(db, user.id, job_id)
+    if job.status != JOB_SUCCEEDED:
+        raise HTTPException(status_code=409, detail=f"Sync job is {job.status}")
+    result = dict(job.result or {})
+    gl_parsed = None
+    if result.get("glSync") is not None:
+        start, end, _ = parse_sync_request(job.params)
+        gl_parsed = {"txns": load_gl_txns(db, result["tenantId"], start, end)}
+    return {**result, "gl": gl_parsed}
+
+
+@router.delete("/jobs/{job_id}", response_model=schemas.SyncJobOut)
+def xero_cancel_job(
+    job_id: str,
+    request: Request,
+    user: models.User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    require_csrf(request)
+    job = get_sync_job(db, user.id, job_id)
+    cancelled = (
+        db.query(models.SyncJob)
+        .filter(models.SyncJob.id == job.id, models.SyncJob.status == JOB_QUEUED)
+        .update({"status": JOB_CANCELLED, "error": "Cancelled", "finished_at": models.utc_now()}, synchronize_session=False)
+    )
+    db.commit()
+    if not cancelled:
+        job_runner.cancel(job.id)
+    db.refresh(job)
+    return job
+
+
+@router.delete("/cache")
+def xero_invalidate_cache(
+    request: Request,
+    user: models.User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    require_csrf(request)
     connection = db.query(models.XeroConnection).filter(models.XeroConnection.user_id == user.id).first()
     if not connection or not connection.tenant_id:
         raise HTTPException(status_code=400, detail="Xero tenant is not selected")
+    return {"ok": True, "invalidated": report_cache.invalidate(connection.tenant_id)}
 
-    api_client = build_xero_api_client(db, connection, config)
-    accounting_api = AccountingApi(api_client)
-    try:
-        pl_report = accounting_api.get_report_profit_and_loss(
-            connection.tenant_id,
-            from_date=from_date,
-            to_date=to_date,
-        )
-    except Exception as exc:
-        raise HTTPException(status_code=502, detail="Failed to fetch Xero Profit & Loss") from exc
-    pl_data = serialize(pl_report)
-    pl_report = (pl_data.get("Reports") or [None])[0]
-    if not pl_report:
-        raise HTTPException(status_code=502, detail="Xero Profit & Loss report was empty")
-    pl_parsed = parse_xero_pl(pl_report)
 
-    gl_parsed = None
-    if include_gl:
-        access_token = ensure_access_token(db, connection, config)
-        headers = {
-            "Authorization": f"Bearer {access_token}",
-            "xero-tenant-id": connection.tenant_id,
-            "Accept": "application/json",
-        }
-        gl_response = httpx.get(
-            XERO_REPORT_GL_URL,
-            params={"fromDate": from_date, "toDate": to_date},
-            headers=headers,
-            timeout=60,
-        )
-        if gl_response.status_code >= 400:
-            raise HTTPException(status_code=502, detail="Failed to fetch Xero General Ledger")
-        gl_data = gl_response.json()
-        gl_report = (gl_data.get("Reports") or [None])[0]
-        if gl_report:
-            gl_parsed = parse_xero_gl(gl_report)
-
-    return {"pl": pl_parsed, "gl": gl_parsed, "tenantId": connection.tenant_id}
+@router.get("/metrics")
+def xero_metrics(user: models.User = Depends(get_current_user)):
+    require_admin(user)
+    return {"cache": report_cache.stats(), "rateLimits": throttle_stats(), "singleFlight": report_flights.stats()}
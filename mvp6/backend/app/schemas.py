@@ -114,6 +114,8 @@ class SnapshotOut(BaseModel):
     role: str
     payload: Optional[SnapshotPayload] = None
     summary: Optional[Dict[str, Any]] = None
+    payload_size: Optional[int] = None
+    payload_hash: Optional[str] = None
     created_at: datetime
     updated_at: datetime
 
@@ -148,6 +150,7 @@ class StateResponse(BaseModel):
     settings: Optional[ConfigOut] = None
     imports: List[ImportOut] = []
     snapshots: List[SnapshotOut] = []
+    snapshots_cursor: Optional[str] = None
 
 
 class TxnOverridePayload(BaseModel):
@@ -169,6 +172,7 @@ class TxnOverrideOut(BaseModel):
     document_id: str
     line_item_id: Optional[str] = None
     hash: Optional[str] = None
+    legacy_hash: Optional[str] = None
     treatment: str
     deferral_start_month: Optional[str] = None
     deferral_months: Optional[int] = None
@@ -215,3 +219,55 @@ class UserPreferenceOut(BaseModel):
 
     class Config:
         from_attributes = True
+
+
+class SyncJobOut(BaseModel):
+    id: str
+    kind: str
+    status: str
+    params: Dict[str, Any]
+    progress: int
+    stage: Optional[str] = None
+    error: Optional[str] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
+
+class DreamComputeRequest(BaseModel):
+    pl: Dict[str, Any]
+    template: Optional[Dict[str, Any]] = None
+    scenario: Optional[Dict[str, Any]] = None
+
+
+class EffectiveLedgerRequest(BaseModel):
+    from_date: str
+    to_date: str
+    view: str = "aggregate"
+    include_non_operating: bool = True
+    pl: Optional[Dict[str, Any]] = None
+    page: int = 1
+    page_size: int = 500
+
+
+class TxnOverrideBulkPayload(BaseModel):
+    overrides: List[TxnOverridePayload]
+
+
+class TxnOverrideBulkDelete(BaseModel):
+    ids: List[str]
+
+
+class LedgerClassifyRequest(BaseModel):
+    from_date: Optional[str] = None
+    to_date: Optional[str] = None
+    txns: Optional[List[Dict[str, Any]]] = None
+    include_hashes: bool = False
+
+
+class TxnHashRequest(BaseModel):
+    txns: List[Dict[str, Any]]
+    include_legacy: bool = False
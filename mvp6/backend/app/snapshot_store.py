@@ -0,0 +1,367 @@
+import copy
+import gzip
+import hashlib
+import json
+import os
+from collections import Counter, defaultdict
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+from fastapi import HTTPException, status
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import flag_modified
+
+from . import models
+from .db import chunked, dialect_insert
+
+PAYLOAD_HASH_BYTES = 16
+# Opt-in at-rest codec for new chunks: "" (stored as is), "gzip" or "zstd".
+SNAPSHOT_PAYLOAD_CODEC = os.environ.get("SNAPSHOT_PAYLOAD_CODEC", "").strip().lower()
+PAYLOAD_CODECS = ("gzip", "zstd")
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+RECOMPRESS_BATCH = 200
+GC_BATCH = 500
+# Lists longer than this (the GL lines, P&L accounts) are stored as batches of this many
+# rows, so a change to one row stores one batch again rather than the whole section.
+PAYLOAD_CHUNK_ROWS = 1000
+
+# Section name -> SnapshotChunk hash, or for a section with split lists
+# {"frame": hash of the section with those lists nulled, "rows": {field: [batch hashes]}};
+# field "" is the section itself when it is the list (no frame).
+SectionRef = Union[str, Dict[str, Any]]
+Manifest = Dict[str, SectionRef]
+
+
+def encode_payload(data: Any) -> bytes:
+    return json.dumps(data, sort_keys=True, separators=(",", ":"), default=str).encode()
+
+
+def content_hash(encoded: bytes) -> str:
+    return hashlib.blake2b(encoded, digest_size=PAYLOAD_HASH_BYTES).hexdigest()
+
+
+def payload_summary(data: Any) -> Dict[str, Any] | None:
+    # Only a dict summary is surfaced; anything else the client stored there is ignored.
+    summary = data.get("summary") if isinstance(data, dict) else None
+    return summary if isinstance(summary, dict) else None
+
+
+def payload_metadata(data: Dict[str, Any], encoded: Optional[bytes] = None) -> Dict[str, Any]:
+    encoded = encode_payload(data) if encoded is None else encoded
+    return {
+        "summary": payload_summary(data),
+        "payload_size": len(encoded),
+        "payload_hash": content_hash(encoded),
+    }
+
+
+def zstd_module():
+    # zstandard is optional; only deployments that select the zstd codec need it.
+    try:
+        import zstandard
+    except ImportError as exc:
+        raise HTTPException(status_code=500, detail="The zstd payload codec needs the zstandard package") from exc
+    return zstandard
+
+
+def compress_payload(encoded: bytes, codec: str) -> bytes:
+    if codec == "gzip":
+        return gzip.compress(encoded, compresslevel=GZIP_LEVEL, mtime=0)
+    if codec == "zstd":
+        return zstd_module().ZstdCompressor(level=ZSTD_LEVEL).compress(encoded)
+    raise ValueError(f"Unknown payload codec: {codec}")
+
+
+def decompress_payload(blob: bytes, codec: str) -> bytes:
+    if codec == "gzip":
+        return gzip.decompress(blob)
+    if codec == "zstd":
+        return zstd_module().ZstdDecompressor().decompress(blob)
+    raise ValueError(f"Unknown payload codec: {codec}")
+
+
+def pack_chunk(encoded: bytes, codec: str) -> Tuple[bytes, Optional[str]]:
+    # Small sections often grow when compressed; those are kept as is.
+    if codec:
+        packed = compress_payload(encoded, codec)
+        if len(packed) < len(encoded):
+            return packed, codec
+    return encoded, None
+
+
+def unpack_chunk(data: bytes, codec: Optional[str]) -> bytes:
+    return decompress_payload(data, codec) if codec else data
+
+
+def add_chunk(chunks: Dict[str, bytes], value: Any) -> str:
+    encoded = encode_payload(value)
+    digest = content_hash(encoded)
+    chunks[digest] = encoded
+    return digest
+
+
+def add_row_batches(chunks: Dict[str, bytes], rows: List[Any]) -> List[str]:
+    return [add_chunk(chunks, rows[start:start + PAYLOAD_CHUNK_ROWS]) for start in range(0, len(rows), PAYLOAD_CHUNK_ROWS)]
+
+
+def payload_chunks(data: Dict[str, Any]) -> Tuple[Manifest, Dict[str, bytes]]:
+    # One chunk per top-level section (template, pl, gl, ...), addressed by the hash of its
+    # canonical JSON, so snapshots that share a section share its chunk. Long lists in a
+    # section, or directly under it, are split into fixed-size row batches.
+    manifest: Manifest = {}
+    chunks: Dict[str, bytes] = {}
+    for key, value in data.items():
+        if isinstance(value, list) and len(value) > PAYLOAD_CHUNK_ROWS:
+            manifest[key] = {"rows": {"": add_row_batches(chunks, value)}}
+            continue
+        long_fields = [
+            field for field, item in value.items() if isinstance(item, list) and len(item) > PAYLOAD_CHUNK_ROWS
+        ] if isinstance(value, dict) else []
+        if not long_fields:
+            manifest[key] = add_chunk(chunks, value)
+            continue
+        frame = {field: None if field in long_fields else item for field, item in value.items()}
+        manifest[key] = {
+            "frame": add_chunk(chunks, frame),
+            "rows": {field: add_row_batches(chunks, value[field]) for field in long_fields},
+        }
+    return manifest, chunks
+
+
+def manifest_digests(manifest: Manifest) -> Iterator[str]:
+    # Every chunk reference in the manifest, once per occurrence.
+    for ref in manifest.values():
+        if isinstance(ref, str):
+            yield ref
+            continue
+        if ref.get("frame"):
+            yield ref["frame"]
+        for digests in ref["rows"].values():
+            yield from digests
+
+
+def digests_by_count(counts: Dict[str, int]) -> Dict[int, List[str]]:
+    grouped: Dict[int, List[str]] = defaultdict(list)
+    for digest, count in counts.items():
+        grouped[count].append(digest)
+    return grouped
+
+
+def put_chunks(db: Session, chunks: Dict[str, bytes], codec: str, refcounts: Optional[Dict[str, int]] = None) -> None:
+    # Inserts the chunks not stored yet; stored ones keep their data and codec.
+    stored = {digest for (digest,) in db.query(models.SnapshotChunk.hash).filter(models.SnapshotChunk.hash.in_(list(chunks)))}
+    values = []
+    for digest, encoded in chunks.items():
+        if digest in stored:
+            continue
+        data, chunk_codec = pack_chunk(encoded, codec)
+        refcount = (refcounts or {}).get(digest, 0)
+        values.append({"hash": digest, "codec": chunk_codec, "data": data, "size": len(encoded), "refcount": refcount})
+    for batch in chunked(values, GC_BATCH):
+        db.execute(dialect_insert(db, models.SnapshotChunk).values(batch).on_conflict_do_nothing(index_elements=["hash"]))
+
+
+def adjust_refcounts(db: Session, manifest: Manifest, delta: int) -> Counter:
+    # A section repeated within one manifest holds one reference per occurrence.
+    counts = Counter(manifest_digests(manifest))
+    column = models.SnapshotChunk.refcount
+    for count, digests in digests_by_count(counts).items():
+        db.query(models.SnapshotChunk).filter(models.SnapshotChunk.hash.in_(digests)).update(
+            {column: column + delta * count}, synchronize_session=False
+        )
+    return counts
+
+
+def reference_chunks(db: Session, manifest: Manifest, chunks: Optional[Dict[str, bytes]], codec: str) -> None:
+    # Takes a reference on every chunk in `manifest`, storing missing ones from `chunks`.
+    # Incrementing locks the rows until commit, so a chunk that is still missing afterwards
+    # was collected after put_chunks saw it and is stored again with its full count.
+    if chunks:
+        put_chunks(db, chunks, codec)
+    counts = adjust_refcounts(db, manifest, 1)
+    present = {digest for (digest,) in db.query(models.SnapshotChunk.hash).filter(models.SnapshotChunk.hash.in_(list(counts)))}
+    lost = set(counts) - present
+    if not lost:
+        return
+    if not chunks:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Snapshot payload changed while copying; try again")
+    put_chunks(db, {digest: chunks[digest] for digest in lost}, codec, refcounts=counts)
+
+
+def store_snapshot_payload(db: Session, snapshot: models.Snapshot, data: Dict[str, Any], codec: str) -> None:
+    # New references are taken before the old ones are dropped, so sections the new
+    # payload shares with the old one never reach a zero refcount.
+    manifest, chunks = payload_chunks(data)
+    reference_chunks(db, manifest, chunks, codec)
+    if snapshot.manifest:
+        adjust_refcounts(db, snapshot.manifest, -1)
+    snapshot.manifest = manifest
+    snapshot.payload = None
+    snapshot.payload_blob = None
+    snapshot.payload_codec = None
+
+
+def set_snapshot_payload(db: Session, snapshot: models.Snapshot, data: Dict[str, Any], schema_version: str) -> None:
+    # Keeps the metadata columns listings read in step with the payload they describe.
+    store_snapshot_payload(db, snapshot, data, SNAPSHOT_PAYLOAD_CODEC)
+    snapshot.schema_version = schema_version
+    for column, value in payload_metadata(data).items():
+        setattr(snapshot, column, value)
+
+
+def copy_snapshot_payload(db: Session, source: models.Snapshot, target: models.Snapshot) -> None:
+    # Sharing the manifest costs the same whatever the payload size; only rows that
+    # predate the chunk store copy their inline payload.
+    if source.manifest:
+        reference_chunks(db, source.manifest, None, SNAPSHOT_PAYLOAD_CODEC)
+        target.manifest = copy.deepcopy(source.manifest)
+    else:
+        target.payload = source.payload
+        target.payload_blob = source.payload_blob
+        target.payload_codec = source.payload_codec
+    target.schema_version = source.schema_version
+    target.summary = source.summary
+    target.payload_size = source.payload_size
+    target.payload_hash = source.payload_hash
+
+
+def release_snapshot_payload(db: Session, snapshot: models.Snapshot) -> None:
+    # Called before a snapshot is deleted; collect_chunks reclaims what drops to zero.
+    if snapshot.manifest:
+        adjust_refcounts(db, snapshot.manifest, -1)
+
+
+def load_manifest(db: Session, manifest: Manifest) -> Dict[str, Any]:
+    digests = set(manifest_digests(manifest))
+    rows = db.query(models.SnapshotChunk.hash, models.SnapshotChunk.codec, models.SnapshotChunk.data).filter(
+        models.SnapshotChunk.hash.in_(list(digests))
+    )
+    sections = {digest: json.loads(unpack_chunk(data, codec)) for digest, codec, data in rows}
+    if digests - set(sections):
+        raise HTTPException(status_code=500, detail="Snapshot payload is missing stored sections")
+
+    def joined(batches: List[str]) -> List[Any]:
+        return [row for digest in batches for row in sections[digest]]
+
+    payload: Dict[str, Any] = {}
+    for key, ref in manifest.items():
+        if isinstance(ref, str):
+            payload[key] = sections[ref]
+        elif "" in ref["rows"]:
+            payload[key] = joined(ref["rows"][""])
+        else:
+            # Each chunk is decoded once; a frame shared by several sections is copied.
+            section = dict(sections[ref["frame"]])
+            section.update({field: joined(batches) for field, batches in ref["rows"].items()})
+            payload[key] = section
+    return payload
+
+
+def read_snapshot_payload(db: Session, snapshot: models.Snapshot) -> Dict[str, Any]:
+    if snapshot.manifest is not None:
+        return load_manifest(db, snapshot.manifest)
+    if snapshot.payload_codec:
+        return json.loads(decompress_payload(snapshot.payload_blob, snapshot.payload_codec))
+    return snapshot.payload
+
+
+def recompress_snapshots(db: Session, codec: str, batch_size: int = RECOMPRESS_BATCH) -> Tuple[int, int]:
+    # Moves snapshots still holding an inline payload into the chunk store, then rewrites
+    # every chunk not stored with `codec` ("" stores them uncompressed). Works a batch at
+    # a time in key order, committing after each batch so the command can be stopped and
+    # resumed. Returns (snapshots moved, chunks rewritten).
+    if codec and codec not in PAYLOAD_CODECS:
+        raise ValueError(f"Unknown payload codec: {codec}")
+    moved = 0
+    last_id = ""
+    while True:
+        batch = (
+            db.query(models.Snapshot)
+            .filter(models.Snapshot.id > last_id, models.Snapshot.manifest.is_(None))
+            .order_by(models.Snapshot.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not batch:
+            break
+        for snapshot in batch:
+            store_snapshot_payload(db, snapshot, read_snapshot_payload(db, snapshot), codec)
+            # Only storage changes, so updated_at (the listing cursor) is kept.
+            flag_modified(snapshot, "updated_at")
+        moved += len(batch)
+        last_id = batch[-1].id
+        db.commit()
+        db.expunge_all()
+
+    codec_column = models.SnapshotChunk.codec
+    pending = codec_column.isnot(None) if not codec else or_(codec_column.is_(None), codec_column != codec)
+    rewritten = 0
+    last_hash = ""
+    while True:
+        batch = (
+            db.query(models.SnapshotChunk)
+            .filter(models.SnapshotChunk.hash > last_hash, pending)
+            .order_by(models.SnapshotChunk.hash)
+            .limit(batch_size)
+            .all()
+        )
+        if not batch:
+            return moved, rewritten
+        for chunk in batch:
+            data, chunk_codec = pack_chunk(unpack_chunk(chunk.data, chunk.codec), codec)
+            if chunk_codec != chunk.codec:
+                chunk.data, chunk.codec = data, chunk_codec
+                rewritten += 1
+        last_hash = batch[-1].hash
+        db.commit()
+        db.expunge_all()
+
+
+def recount_chunks(db: Session, batch_size: int = RECOMPRESS_BATCH) -> None:
+    # Rebuilds refcounts from the manifests, for rows removed without
+    # release_snapshot_payload (e.g. snapshots dropped by a user cascade). Run it while
+    # nothing else writes snapshots; the caller commits.
+    counts: Counter = Counter()
+    last_id = ""
+    while True:
+        rows = (
+            db.query(models.Snapshot.id, models.Snapshot.manifest)
+            .filter(models.Snapshot.id > last_id, models.Snapshot.manifest.isnot(None))
+            .order_by(models.Snapshot.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not rows:
+            break
+        for _, manifest in rows:
+            counts.update(manifest_digests(manifest))
+        last_id = rows[-1][0]
+    db.query(models.SnapshotChunk).update({models.SnapshotChunk.refcount: 0}, synchronize_session=False)
+    for count, digests in digests_by_count(counts).items():
+        for batch in chunked(digests, GC_BATCH):
+            db.query(models.SnapshotChunk).filter(models.SnapshotChunk.hash.in_(batch)).update(
+                {models.SnapshotChunk.refcount: count}, synchronize_session=False
+            )
+
+
+def collect_chunks(db: Session, batch_size: int = GC_BATCH) -> int:
+    # Deletes chunks no manifest references, committing per batch. The refcount is checked
+    # again in the DELETE so a chunk referenced since it was selected is kept.
+    collected = 0
+    while True:
+        digests = [
+            digest
+            for (digest,) in db.query(models.SnapshotChunk.hash)
+            .filter(models.SnapshotChunk.refcount <= 0)
+            .order_by(models.SnapshotChunk.hash)
+            .limit(batch_size)
+        ]
+        if not digests:
+            return collected
+        collected += (
+            db.query(models.SnapshotChunk)
+            .filter(models.SnapshotChunk.hash.in_(digests), models.SnapshotChunk.refcount <= 0)
+            .delete(synchronize_session=False)
+        )
+        db.commit()
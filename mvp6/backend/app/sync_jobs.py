@@ -0,0 +1,268 @@
+import asyncio
+import logging
+import os
+from datetime import timedelta
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import func, or_, select, update
+from sqlalchemy.orm import Session, aliased
+
+from . import models
+from .db import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+SYNC_WORKERS = max(1, int(os.environ.get("SYNC_WORKERS", "2")))
+SYNC_JOBS_PER_USER = max(1, int(os.environ.get("SYNC_JOBS_PER_USER", "1")))
+SYNC_MAX_QUEUED_PER_USER = max(1, int(os.environ.get("SYNC_MAX_QUEUED_PER_USER", "5")))
+SYNC_JOB_POLL_SECONDS = float(os.environ.get("SYNC_JOB_POLL_SECONDS", "5"))
+SYNC_JOB_HEARTBEAT_SECONDS = float(os.environ.get("SYNC_JOB_HEARTBEAT_SECONDS", "30"))
+# A running job whose heartbeat is older than this is presumed orphaned and requeued.
+SYNC_JOB_STALE_SECONDS = float(os.environ.get("SYNC_JOB_STALE_SECONDS", "120"))
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+ACTIVE_JOB_STATUSES = (JOB_QUEUED, JOB_RUNNING)
+
+ProgressCallback = Callable[[str, Dict[str, Any]], Awaitable[None]]
+JobHandler = Callable[[Session, models.SyncJob, ProgressCallback], Awaitable[Dict[str, Any]]]
+
+# Rough share of the work done once each sync stage has been reported.
+STAGE_PROGRESS = {
+    "token": 10,
+    "pl_parsed": 40,
+    "fetched": 70,
+    "gl_stored": 90,
+}
+
+_handlers: Dict[str, JobHandler] = {}
+
+
+def register_job_handler(kind: str, handler: JobHandler) -> None:
+    _handlers[kind] = handler
+
+
+def enqueue_job(db: Session, user_id: str, kind: str, params: Dict[str, Any]) -> models.SyncJob:
+    if kind not in _handlers:
+        raise HTTPException(status_code=400, detail=f"Unknown job kind: {kind}")
+    pending = (
+        db.query(func.count(models.SyncJob.id))
+        .filter(models.SyncJob.user_id == user_id, models.SyncJob.status.in_(ACTIVE_JOB_STATUSES))
+        .scalar()
+    )
+    if pending >= SYNC_MAX_QUEUED_PER_USER:
+        raise HTTPException(status_code=429, detail="Too many sync jobs queued; wait for one to finish")
+    job = models.SyncJob(user_id=user_id, kind=kind, status=JOB_QUEUED, params=params, progress=0)
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    job_runner.notify()
+    return job
+
+
+def claim_job(db: Session, job_id: str, user_id: str, per_user: int) -> bool:
+    # Conditional UPDATE: of several workers (or processes) racing for the same job, only
+    # the one whose statement still sees it queued gets the row. The per-user running count
+    # is re-checked in the same statement.
+    peer = aliased(models.SyncJob)
+    running = select(func.count(peer.id)).where(peer.user_id == user_id, peer.status == JOB_RUNNING).scalar_subquery()
+    now = models.utc_now()
+    claimed = db.execute(
+        update(models.SyncJob)
+        .where(models.SyncJob.id == job_id, models.SyncJob.status == JOB_QUEUED, running < per_user)
+        .values(status=JOB_RUNNING, started_at=now, heartbeat_at=now)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.commit()
+    return claimed == 1
+
+
+class SyncJobRunner:
+    # Worker pool per process. Jobs live in the sync_jobs table and are claimed with a
+    # conditional update, so several API processes can share the queue; running jobs send
+    # a heartbeat and any process requeues the ones whose heartbeat has gone stale.
+    def __init__(self, session_factory=SessionLocal, workers: int = SYNC_WORKERS, per_user: int = SYNC_JOBS_PER_USER):
+        self.session_factory = session_factory
+        self.workers = workers
+        self.per_user = per_user
+        self._tasks: list = []
+        self._running: Dict[str, asyncio.Task] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    async def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        await run_in_threadpool(self.requeue_interrupted)
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        running = list(self._running.values())
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        # Let cancelled jobs record their final status before the loop goes away.
+        await asyncio.gather(*running, return_exceptions=True)
+        self._tasks = []
+        self._loop = None
+
+    def notify(self) -> None:
+        if self._loop is not None and self._wakeup is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def cancel(self, job_id: str) -> bool:
+        task = self._running.get(job_id)
+        if task is None or self._loop is None:
+            return False
+        self._loop.call_soon_threadsafe(task.cancel)
+        return True
+
+    def requeue_interrupted(self, stale_seconds: float = SYNC_JOB_STALE_SECONDS) -> int:
+        # Only jobs whose worker has stopped beating: a job running in another process is
+        # left alone.
+        cutoff = models.utc_now() - timedelta(seconds=stale_seconds)
+        db = self.session_factory()
+        try:
+            count = (
+                db.query(models.SyncJob)
+                .filter(
+                    models.SyncJob.status == JOB_RUNNING,
+                    or_(models.SyncJob.heartbeat_at.is_(None), models.SyncJob.heartbeat_at < cutoff),
+                )
+                .update(
+                    {"status": JOB_QUEUED, "progress": 0, "stage": None, "started_at": None, "heartbeat_at": None},
+                    synchronize_session=False,
+                )
+            )
+            db.commit()
+            return count
+        finally:
+            db.close()
+
+    def claim_next(self) -> Optional[str]:
+        db = self.session_factory()
+        try:
+            running = dict(
+                db.query(models.SyncJob.user_id, func.count(models.SyncJob.id))
+                .filter(models.SyncJob.status == JOB_RUNNING)
+                .group_by(models.SyncJob.user_id)
+                .all()
+            )
+            candidates = (
+                db.query(models.SyncJob.id, models.SyncJob.user_id)
+                .filter(models.SyncJob.status == JOB_QUEUED)
+                .order_by(models.SyncJob.created_at, models.SyncJob.id)
+                .limit(100)
+                .all()
+            )
+            for job_id, user_id in candidates:
+                if running.get(user_id, 0) >= self.per_user:
+                    continue
+                if claim_job(db, job_id, user_id, self.per_user):
+                    return job_id
+            return None
+        finally:
+            db.close()
+
+    def beat(self, job_id: str) -> None:
+        db = self.session_factory()
+        try:
+            db.query(models.SyncJob).filter(models.SyncJob.id == job_id, models.SyncJob.status == JOB_RUNNING).update(
+                {"heartbeat_at": models.utc_now()}, synchronize_session=False
+            )
+            db.commit()
+        finally:
+            db.close()
+
+    async def _heartbeat(self, job_id: str) -> None:
+        while True:
+            await asyncio.sleep(SYNC_JOB_HEARTBEAT_SECONDS)
+            try:
+                await run_in_threadpool(self.beat, job_id)
+            except Exception:
+                logger.warning("Heartbeat for sync job %s failed", job_id, exc_info=True)
+
+    async def _work(self) -> None:
+        while True:
+            job_id = await run_in_threadpool(self.claim_next)
+            if job_id is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=SYNC_JOB_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    # Idle: pick up jobs orphaned by a process that died mid-run.
+                    await run_in_threadpool(self.requeue_interrupted)
+                continue
+            task = asyncio.create_task(self._run(job_id))
+            self._running[job_id] = task
+            try:
+                await asyncio.shield(task)
+            except asyncio.CancelledError:
+                if not task.done():
+                    task.cancel()
+                    raise
+            finally:
+                self._running.pop(job_id, None)
+            self._wakeup.set()
+
+    async def _run(self, job_id: str) -> None:
+        db = self.session_factory()
+        heartbeat = asyncio.create_task(self._heartbeat(job_id))
+        try:
+            job = await run_in_threadpool(db.get, models.SyncJob, job_id)
+            handler = _handlers.get(job.kind)
+            # Fetches report progress concurrently; serialise the commits on the job's session.
+            commit_lock = asyncio.Lock()
+
+            async def progress(event: str, data: Dict[str, Any]) -> None:
+                async with commit_lock:
+                    job.stage = event
+                    job.progress = max(job.progress or 0, STAGE_PROGRESS.get(event, job.progress or 0))
+                    await run_in_threadpool(db.commit)
+
+            try:
+                if handler is None:
+                    raise HTTPException(status_code=400, detail=f"Unknown job kind: {job.kind}")
+                result = await handler(db, job, progress)
+            except asyncio.CancelledError:
+                await run_in_threadpool(self._finish, db, job, JOB_CANCELLED, error="Cancelled", rollback=True)
+                return
+            except HTTPException as exc:
+                await run_in_threadpool(self._finish, db, job, JOB_FAILED, error=str(exc.detail), rollback=True)
+                return
+            except Exception:
+                logger.exception("Sync job %s failed", job_id)
+                await run_in_threadpool(self._finish, db, job, JOB_FAILED, error="Sync failed", rollback=True)
+                return
+            await run_in_threadpool(self._finish, db, job, JOB_SUCCEEDED, result=result)
+        finally:
+            heartbeat.cancel()
+            await run_in_threadpool(db.close)
+
+    @staticmethod
+    def _finish(
+        db: Session,
+        job: models.SyncJob,
+        status: str,
+        result: Optional[Dict[str, Any]] = None,
+        error: Optional[str] = None,
+        rollback: bool = False,
+    ) -> None:
+        if rollback:
+            db.rollback()
+        job.status = status
+        job.finished_at = models.utc_now()
+        job.error = error
+        if status == JOB_SUCCEEDED:
+            job.progress = 100
+            job.stage = "done"
+            job.result = result
+        db.commit()
+
+
+job_runner = SyncJobRunner()
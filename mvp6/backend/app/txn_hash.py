@@ -0,0 +1,170 @@
+import hashlib
+import math
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+from .dates import gl_txn_date
+
+# Canonical transaction keys are 128-bit blake2b digests (32 hex chars). Keys written by
+# the browser's 32-bit buildTxnHash are at most 8 hex chars and are still matched, but
+# collide often enough at GL scale that new keys should be canonical.
+TXN_HASH_BYTES = 16
+FIELD_SEPARATOR = "\x1f"
+HASH_CHUNK_ROWS = 8192
+
+
+def is_canonical_hash(value: Optional[str]) -> bool:
+    return bool(value) and len(value) == TXN_HASH_BYTES * 2
+
+
+def normalise_text(value: Any) -> str:
+    return " ".join(str(value or "").split())
+
+
+def txn_hashes(txns: Sequence[Dict[str, Any]]) -> List[str]:
+    # Fields are whitespace-normalised, dates reduced to ISO form and amounts to cents, so
+    # the same line hashes identically whichever report or parser it came from.
+    # Text and amount values repeat heavily across a ledger, so each is normalised once.
+    dates: Dict[str, str] = {}
+    texts: Dict[Any, str] = {}
+    cents: Dict[Any, str] = {}
+    blake2b = hashlib.blake2b
+    hashes = []
+    for txn in txns:
+        raw_date = str(txn.get("date") or "")
+        day = dates.get(raw_date)
+        if day is None:
+            parsed = gl_txn_date(raw_date)
+            day = dates[raw_date] = parsed.isoformat() if parsed else raw_date.strip()
+        fields = []
+        for name in ("account", "description", "reference", "source"):
+            value = txn.get(name)
+            text = texts.get(value)
+            if text is None:
+                text = texts[value] = normalise_text(value)
+            fields.append(text)
+        raw_amount = txn.get("amount")
+        amount = cents.get(raw_amount)
+        if amount is None:
+            amount = cents[raw_amount] = f"{round(float(raw_amount or 0.0), 2) + 0.0:.2f}"
+        canonical = FIELD_SEPARATOR.join((fields[0], day, amount, fields[1], fields[2], fields[3]))
+        hashes.append(blake2b(canonical.encode(), digest_size=TXN_HASH_BYTES).hexdigest())
+    return hashes
+
+
+def txn_hash(txn: Dict[str, Any]) -> str:
+    return txn_hashes([txn])[0]
+
+
+def needs_legacy_hashes(overrides: Iterable[Any]) -> bool:
+    return any(override.hash and not is_canonical_hash(override.hash) for override in overrides)
+
+
+# Port of the browser's buildTxnHash, kept so overrides saved with it keep matching.
+
+def js_number(value: float) -> str:
+    # Number#toString as the browser formats amounts when hashing a transaction.
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "Infinity" if value > 0 else "-Infinity"
+    if value == 0:
+        return "0"
+    if value.is_integer() and abs(value) < 1e16:
+        return str(int(value))
+    text = repr(value)
+    if "e" not in text:
+        # Python and JavaScript agree on shortest round-trip digits in fixed notation.
+        return text
+    sign = "-" if value < 0 else ""
+    parts = Decimal(repr(abs(value))).as_tuple()
+    digits = "".join(str(digit) for digit in parts.digits)
+    point = parts.exponent + len(digits)
+    digits = digits.rstrip("0")
+    k = len(digits)
+    if k <= point <= 21:
+        return sign + digits + "0" * (point - k)
+    if 0 < point <= 21:
+        return sign + digits[:point] + "." + digits[point:]
+    if -6 < point <= 0:
+        return sign + "0." + "0" * -point + digits
+    exponent = point - 1
+    mantissa = digits if k == 1 else digits[0] + "." + digits[1:]
+    return f"{sign}{mantissa}e{'+' if exponent > 0 else '-'}{abs(exponent)}"
+
+
+def js_string_hashes(values: Sequence[str]) -> List[str]:
+    # Vectorised hashString from src/lib/ledger.ts: h = h * 31 + charCode over UTF-16 code
+    # units, wrapping in 32 bits, then |int32(h)| in hex. Strings are bucketed by length
+    # and right-aligned in a zero-padded matrix (leading zeros leave h unchanged), so the
+    # loop runs once per column instead of once per character.
+    if not values:
+        return []
+    units = np.frombuffer("".join(values).encode("utf-16-le"), dtype="<u2")
+    lengths = np.fromiter(map(len, values), dtype=np.int64, count=len(values))
+    if units.size != lengths.sum():
+        # Astral characters take two UTF-16 code units but count once in len().
+        lengths = np.fromiter((len(value.encode("utf-16-le")) // 2 for value in values), dtype=np.int64, count=len(values))
+    starts = np.cumsum(lengths) - lengths
+    hashes = np.zeros(len(values), dtype=np.uint32)
+    order = np.argsort(lengths, kind="stable")
+    for offset in range(0, len(order), HASH_CHUNK_ROWS):
+        rows = order[offset:offset + HASH_CHUNK_ROWS]
+        width = int(lengths[rows[-1]])
+        if not width:
+            continue
+        position = np.arange(width) - width + lengths[rows][:, None]
+        present = position >= 0
+        matrix = np.zeros((len(rows), width), dtype=np.uint32)
+        matrix[present] = units[(starts[rows][:, None] + position)[present]]
+        h = np.zeros(len(rows), dtype=np.uint32)
+        for column in matrix.T:
+            h = h * np.uint32(31) + column
+        hashes[rows] = h
+    return [format(value, "x") for value in np.abs(hashes.view(np.int32).astype(np.int64)).tolist()]
+
+
+def legacy_hash_input(txn: Dict[str, Any]) -> str:
+    get = txn.get
+    return (
+        f"{get('account') or ''}|{get('date') or ''}|{js_number(float(get('amount') or 0.0))}"
+        f"|{get('description') or ''}|{get('reference') or ''}|{get('source') or ''}"
+    )
+
+
+def legacy_txn_hashes(txns: Sequence[Dict[str, Any]]) -> List[str]:
+    # Amounts repeat a lot in a ledger, so format each distinct one once.
+    numbers: Dict[float, str] = {}
+    inputs = []
+    for txn in txns:
+        get = txn.get
+        amount = float(get("amount") or 0.0)
+        number = numbers.get(amount)
+        if number is None:
+            number = numbers[amount] = js_number(amount)
+        inputs.append(
+            f"{get('account') or ''}|{get('date') or ''}|{number}"
+            f"|{get('description') or ''}|{get('reference') or ''}|{get('source') or ''}"
+        )
+    return js_string_hashes(inputs)
+
+
+def rehash_plan(overrides: Sequence[Any], txns: Sequence[Dict[str, Any]]) -> Dict[str, str]:
+    # Maps override id -> canonical key for overrides still keyed by a legacy hash. A legacy
+    # hash that several distinct lines share is exactly the collision being fixed, so
+    # those overrides are left alone rather than guessed at.
+    legacy = [(override.id, override.hash) for override in overrides if override.hash and not is_canonical_hash(override.hash)]
+    if not legacy:
+        return {}
+    candidates: Dict[str, set] = {}
+    for canonical, old in zip(txn_hashes(txns), legacy_txn_hashes(txns)):
+        candidates.setdefault(old, set()).add(canonical)
+    plan = {}
+    for override_id, old in legacy:
+        matches = candidates.get(old)
+        if matches and len(matches) == 1:
+            plan[override_id] = next(iter(matches))
+    return plan
+
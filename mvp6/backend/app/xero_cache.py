@@ -0,0 +1,111 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+XERO_CACHE_TTL_SECONDS = float(os.environ.get("XERO_CACHE_TTL_SECONDS", "300"))
+XERO_CACHE_MAX_BYTES = int(os.environ.get("XERO_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+CacheKey = Tuple[str, str, str, str, Tuple[Tuple[str, str], ...]]
+
+
+class CacheEntry:
+    __slots__ = ("value", "size", "stored_at", "etag", "last_modified")
+
+    def __init__(self, value: Any, size: int, etag: Optional[str], last_modified: Optional[str]):
+        self.value = value
+        self.size = size
+        self.stored_at = time.monotonic()
+        self.etag = etag
+        self.last_modified = last_modified
+
+
+class ReportCache:
+    def __init__(self, ttl_seconds: float = XERO_CACHE_TTL_SECONDS, max_bytes: int = XERO_CACHE_MAX_BYTES):
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[CacheKey, CacheEntry]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "stale": 0, "revalidated": 0, "bypassed": 0, "evictions": 0, "invalidations": 0}
+
+    @staticmethod
+    def make_key(tenant_id: str, report: str, params: Dict[str, Any]) -> CacheKey:
+        extra = tuple(sorted((k, str(v)) for k, v in params.items() if k not in {"fromDate", "toDate"}))
+        return (tenant_id, report, str(params.get("fromDate", "")), str(params.get("toDate", "")), extra)
+
+    def lookup(self, key: CacheKey) -> Tuple[Optional[CacheEntry], bool]:
+        # Returns the entry (fresh or stale, for revalidation) and whether it is still fresh.
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._counters["misses"] += 1
+                return None, False
+            self._entries.move_to_end(key)
+            if time.monotonic() - entry.stored_at <= self.ttl_seconds:
+                self._counters["hits"] += 1
+                return entry, True
+            self._counters["stale"] += 1
+            return entry, False
+
+    def put(self, key: CacheKey, value: Any, size: int, etag: Optional[str] = None, last_modified: Optional[str] = None) -> None:
+        # `size` is the raw response length from the caller; re-serializing a parsed GL
+        # just to weigh it cost as much as parsing it.
+        with self._lock:
+            self._discard(key)
+            if size > self.max_bytes:
+                return
+            self._entries[key] = CacheEntry(value, size, etag, last_modified)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._discard(oldest)
+                self._counters["evictions"] += 1
+
+    def mark_revalidated(self, key: CacheKey) -> None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.stored_at = time.monotonic()
+                self._counters["revalidated"] += 1
+
+    def mark_bypassed(self) -> None:
+        with self._lock:
+            self._counters["bypassed"] += 1
+
+    def invalidate(self, tenant_id: Optional[str] = None, report: Optional[str] = None) -> int:
+        with self._lock:
+            keys = [
+                key for key in self._entries
+                if (tenant_id is None or key[0] == tenant_id) and (report is None or key[1] == report)
+            ]
+            for key in keys:
+                self._discard(key)
+            self._counters["invalidations"] += len(keys)
+            return len(keys)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                **self._counters,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "maxBytes": self.max_bytes,
+                "ttlSeconds": self.ttl_seconds,
+            }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            for name in self._counters:
+                self._counters[name] = 0
+
+    def _discard(self, key: CacheKey) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.size
+
+
+report_cache = ReportCache()
@@ -0,0 +1,378 @@
+import asyncio
+import os
+import random
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, Hashable, List, NamedTuple, Optional
+
+import httpx
+
+XERO_HTTP_TIMEOUT = float(os.environ.get("XERO_HTTP_TIMEOUT", "60"))
+XERO_HTTP_MAX_CONNECTIONS = int(os.environ.get("XERO_HTTP_MAX_CONNECTIONS", "20"))
+XERO_HTTP_MAX_KEEPALIVE = int(os.environ.get("XERO_HTTP_MAX_KEEPALIVE", "10"))
+
+# Xero allows 60 calls per minute, 5,000 per day and 5 in flight per tenant.
+XERO_MINUTE_LIMIT = int(os.environ.get("XERO_MINUTE_LIMIT", "60"))
+XERO_CONCURRENT_LIMIT = int(os.environ.get("XERO_CONCURRENT_LIMIT", "5"))
+XERO_MAX_RETRIES = int(os.environ.get("XERO_MAX_RETRIES", "4"))
+XERO_BACKOFF_BASE = float(os.environ.get("XERO_BACKOFF_BASE", "0.5"))
+XERO_BACKOFF_MAX = float(os.environ.get("XERO_BACKOFF_MAX", "30"))
+XERO_MAX_RETRY_WAIT = float(os.environ.get("XERO_MAX_RETRY_WAIT", "60"))
+# Idle tenant throttles beyond this many are dropped, least recently used first.
+XERO_THROTTLE_MAX_TENANTS = int(os.environ.get("XERO_THROTTLE_MAX_TENANTS", "1000"))
+
+_client: Optional[httpx.AsyncClient] = None
+_client_loop: Optional[asyncio.AbstractEventLoop] = None
+_transport: Optional[httpx.AsyncBaseTransport] = None
+
+
+class XeroRequestError(Exception):
+    def __init__(self, status_code: int, detail: str = ""):
+        super().__init__(detail or f"Xero request failed with status {status_code}")
+        self.status_code = status_code
+
+
+class XeroRateLimited(XeroRequestError):
+    def __init__(self, retry_after: Optional[float]):
+        super().__init__(429, "Xero rate limit reached")
+        self.retry_after = retry_after
+
+
+class TenantThrottle:
+    # Token bucket for the per-minute limit plus a concurrency cap. Waiters are queued
+    # per user and served round-robin so one user's large sync cannot starve others.
+    def __init__(self, minute_limit: int = XERO_MINUTE_LIMIT, concurrent_limit: int = XERO_CONCURRENT_LIMIT):
+        self.minute_limit = max(1, minute_limit)
+        self.concurrent_limit = max(1, concurrent_limit)
+        self.tokens = float(self.minute_limit)
+        self.refilled_at = time.monotonic()
+        self.blocked_until = 0.0
+        self.active = 0
+        self.waiters: "OrderedDict[str, Deque[asyncio.Future]]" = OrderedDict()
+        self.timer: Optional[asyncio.TimerHandle] = None
+        self.counters: Dict[str, Any] = {
+            "requests": 0,
+            "queued": 0,
+            "waitSeconds": 0.0,
+            "throttled": 0,
+            "retries": 0,
+            "minRemaining": None,
+            "dayRemaining": None,
+        }
+
+    async def acquire(self, user_id: str) -> None:
+        future = asyncio.get_running_loop().create_future()
+        self.waiters.setdefault(user_id, deque()).append(future)
+        self._dispatch()
+        if future.done():
+            return
+        self.counters["queued"] += 1
+        started = time.monotonic()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+        finally:
+            self.counters["waitSeconds"] += time.monotonic() - started
+
+    def release(self) -> None:
+        self.active -= 1
+        self._dispatch()
+
+    def observe(self, headers: httpx.Headers) -> None:
+        minute_remaining = _int_header(headers, "X-MinLimit-Remaining")
+        if minute_remaining is not None:
+            self.counters["minRemaining"] = minute_remaining
+            self._refill()
+            self.tokens = min(self.tokens, float(minute_remaining))
+        day_remaining = _int_header(headers, "X-DayLimit-Remaining")
+        if day_remaining is not None:
+            self.counters["dayRemaining"] = day_remaining
+
+    def idle(self) -> bool:
+        # Nothing in flight or queued and the bucket back to full, so a fresh throttle
+        # would behave the same; only the counters are lost by dropping it.
+        self._refill()
+        return not self.active and not self.waiters and self.tokens >= self.minute_limit and time.monotonic() >= self.blocked_until
+
+    def block_for(self, seconds: float) -> None:
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = min(self.tokens, 0.0)
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(float(self.minute_limit), self.tokens + (now - self.refilled_at) * self.minute_limit / 60.0)
+        self.refilled_at = now
+
+    def _dispatch(self) -> None:
+        while self.waiters and self.active < self.concurrent_limit:
+            now = time.monotonic()
+            if now < self.blocked_until:
+                self._schedule(self.blocked_until - now)
+                return
+            self._refill()
+            if self.tokens < 1:
+                self._schedule((1 - self.tokens) * 60.0 / self.minute_limit)
+                return
+            user_id, queue = next(iter(self.waiters.items()))
+            future = queue.popleft()
+            if queue:
+                self.waiters.move_to_end(user_id)
+            else:
+                del self.waiters[user_id]
+            if future.done():
+                continue
+            self.tokens -= 1
+            self.active += 1
+            self.counters["requests"] += 1
+            future.set_result(None)
+
+    def _schedule(self, delay: float) -> None:
+        if self.timer is not None and not self.timer.cancelled():
+            self.timer.cancel()
+        self.timer = asyncio.get_running_loop().call_later(delay, self._dispatch)
+
+
+_throttles: "OrderedDict[str, TenantThrottle]" = OrderedDict()
+
+
+def get_throttle(tenant_id: str) -> TenantThrottle:
+    throttle = _throttles.get(tenant_id)
+    if throttle is None:
+        throttle = _throttles[tenant_id] = TenantThrottle()
+        evict_idle_throttles()
+    else:
+        _throttles.move_to_end(tenant_id)
+    return throttle
+
+
+def evict_idle_throttles() -> None:
+    # Busy throttles are kept whatever the size; the one just added is never a candidate.
+    for tenant_id in list(_throttles)[:-1]:
+        if len(_throttles) <= XERO_THROTTLE_MAX_TENANTS:
+            break
+        if _throttles[tenant_id].idle():
+            del _throttles[tenant_id]
+
+
+def throttle_stats() -> Dict[str, Dict[str, Any]]:
+    return {tenant_id: {**throttle.counters, "waiting": sum(len(q) for q in throttle.waiters.values())} for tenant_id, throttle in _throttles.items()}
+
+
+def reset_throttles() -> None:
+    _throttles.clear()
+
+
+def _int_header(headers: httpx.Headers, name: str) -> Optional[int]:
+    try:
+        return int(headers[name])
+    except (KeyError, ValueError):
+        return None
+
+
+def parse_retry_after(headers: httpx.Headers) -> Optional[float]:
+    value = headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int) -> float:
+    return random.uniform(0, min(XERO_BACKOFF_MAX, XERO_BACKOFF_BASE * (2 ** attempt)))
+
+
+async def wait_before_retry(throttle: TenantThrottle, response: httpx.Response, attempt: int) -> None:
+    retry_after = parse_retry_after(response.headers)
+    if response.status_code == 429:
+        throttle.counters["throttled"] += 1
+    if attempt == XERO_MAX_RETRIES or (retry_after is not None and retry_after > XERO_MAX_RETRY_WAIT):
+        raise XeroRateLimited(retry_after)
+    throttle.counters["retries"] += 1
+    if retry_after is not None:
+        # The whole tenant waits out Retry-After; queued callers resume in order.
+        throttle.block_for(retry_after)
+    else:
+        await asyncio.sleep(backoff_delay(attempt))
+
+
+async def xero_request(method: str, url: str, tenant_id: str, user_id: str = "", **kwargs: Any) -> httpx.Response:
+    throttle = get_throttle(tenant_id)
+    for attempt in range(XERO_MAX_RETRIES + 1):
+        await throttle.acquire(user_id)
+        try:
+            response = await get_http_client().request(method, url, **kwargs)
+        finally:
+            throttle.release()
+        throttle.observe(response.headers)
+        if response.status_code not in (429, 503):
+            return response
+        await wait_before_retry(throttle, response, attempt)
+    raise XeroRateLimited(None)
+
+
+@asynccontextmanager
+async def xero_stream(method: str, url: str, tenant_id: str, user_id: str = "", **kwargs: Any) -> AsyncIterator[httpx.Response]:
+    # Like xero_request, but the body is left unread for the caller to iterate. The
+    # concurrency slot is held until the caller has finished with the stream.
+    throttle = get_throttle(tenant_id)
+    client = get_http_client()
+    for attempt in range(XERO_MAX_RETRIES + 1):
+        await throttle.acquire(user_id)
+        try:
+            response = await client.send(client.build_request(method, url, **kwargs), stream=True)
+            try:
+                throttle.observe(response.headers)
+                if response.status_code not in (429, 503):
+                    yield response
+                    return
+            finally:
+                await response.aclose()
+        finally:
+            throttle.release()
+        await wait_before_retry(throttle, response, attempt)
+    raise XeroRateLimited(None)
+
+
+class SingleFlight:
+    # Concurrent callers asking for the same key share one in-flight task and its result.
+    # The task is shielded, so a cancelled caller does not abort the fetch for the others.
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self.counters = {"started": 0, "coalesced": 0}
+
+    async def do(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._inflight.get(key)
+        if task is not None and not task.done() and task.get_loop() is asyncio.get_running_loop():
+            self.counters["coalesced"] += 1
+        else:
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+            self.counters["started"] += 1
+            task.add_done_callback(lambda done: self._forget(key, done))
+        return await asyncio.shield(task)
+
+    def _forget(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            # Mark the exception retrieved when every waiter has gone away.
+            task.exception()
+
+    def stats(self) -> Dict[str, int]:
+        return {**self.counters, "inflight": len(self._inflight)}
+
+    def clear(self) -> None:
+        self._inflight.clear()
+        for name in self.counters:
+            self.counters[name] = 0
+
+
+report_flights = SingleFlight()
+
+
+def get_http_client() -> httpx.AsyncClient:
+    # One pooled client, bound to the loop that created it; connections are reused across syncs.
+    global _client, _client_loop
+    loop = asyncio.get_running_loop()
+    if _client is None or _client.is_closed or _client_loop is not loop:
+        retire_http_client()
+        _client = httpx.AsyncClient(
+            timeout=XERO_HTTP_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=XERO_HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=XERO_HTTP_MAX_KEEPALIVE,
+            ),
+            transport=_transport,
+        )
+        _client_loop = loop
+    return _client
+
+
+def retire_http_client() -> None:
+    # Only one client is kept. One left behind by another loop is closed on that loop if
+    # it is still running; otherwise its connections went with the loop.
+    global _client, _client_loop
+    if _client is not None and not _client.is_closed and _client_loop is not None and _client_loop.is_running():
+        asyncio.run_coroutine_threadsafe(_client.aclose(), _client_loop)
+    _client = None
+    _client_loop = None
+
+
+def use_transport(transport: Optional[httpx.AsyncBaseTransport]) -> None:
+    global _transport
+    _transport = transport
+    retire_http_client()
+
+
+async def close_http_client() -> None:
+    global _client, _client_loop
+    if _client is not None and not _client.is_closed and _client_loop is asyncio.get_running_loop():
+        await _client.aclose()
+    _client = None
+    _client_loop = None
+
+
+def xero_headers(access_token: str, tenant_id: str) -> Dict[str, str]:
+    return {
+        "Authorization": f"Bearer {access_token}",
+        "xero-tenant-id": tenant_id,
+        "Accept": "application/json",
+    }
+
+
+class ReportResponse(NamedTuple):
+    data: Optional[Dict[str, Any]]
+    etag: Optional[str]
+    last_modified: Optional[str]
+    # Length of the raw body, which the report cache charges against its byte budget.
+    size: int = 0
+
+    @property
+    def not_modified(self) -> bool:
+        return self.data is None
+
+
+async def get_report(
+    url: str,
+    access_token: str,
+    tenant_id: str,
+    params: Dict[str, Any],
+    user_id: str = "",
+    etag: Optional[str] = None,
+    last_modified: Optional[str] = None,
+) -> ReportResponse:
+    headers = xero_headers(access_token, tenant_id)
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    response = await xero_request("GET", url, tenant_id, user_id, params=params, headers=headers)
+    if response.status_code == 304:
+        return ReportResponse(None, etag, last_modified)
+    if response.status_code >= 400:
+        raise XeroRequestError(response.status_code)
+    return ReportResponse(
+        response.json(), response.headers.get("ETag"), response.headers.get("Last-Modified"), len(response.content)
+    )
+
+
+async def gather_or_cancel(*aws: Awaitable[Any]) -> List[Any]:
+    tasks = [asyncio.ensure_future(aw) for aw in aws]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
@@ -0,0 +1,100 @@
+"""Compare peak memory of the full and streaming General Ledger parsers.
+
+Usage (from mvp6/backend):
+    python scripts/bench_gl_stream.py --lines 500000
+
+Each mode runs in its own process so the reported max RSS is not shared.
+"""
+
+import argparse
+import asyncio
+import json
+import resource
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.routers.xero import iter_xero_gl_txns, parse_xero_gl  # noqa: E402
+
+ACCOUNTS = 40
+CHUNK_SIZE = 64 * 1024
+
+
+def synthetic_gl(lines: int):
+    # Yields the report as text pieces so the generator itself stays small.
+    per_account = max(1, lines // ACCOUNTS)
+    yield '{"Id":"bench","Status":"OK","Reports":[{"ReportID":"GeneralLedger","Rows":['
+    yield '{"RowType":"Header","Cells":[{"Value":"Date"},{"Value":"Source"},{"Value":"Description"},{"Value":"Debit"},{"Value":"Credit"}]}'
+    emitted = 0
+    for account in range(ACCOUNTS):
+        count = per_account if account < ACCOUNTS - 1 else lines - emitted
+        yield f',{{"RowType":"Section","Title":"Account {account}","Rows":['
+        for idx in range(count):
+            row = {
+                "RowType": "Row",
+                "Cells": [
+                    {"Value": f"2024-{idx % 12 + 1:02d}-{idx % 28 + 1:02d}"},
+                    {"Value": "ACCREC"},
+                    {"Value": f"Invoice {account}-{idx}"},
+                    {"Value": f"{idx % 997 + 0.25:.2f}"},
+                    {"Value": ""},
+                ],
+            }
+            yield ("," if idx else "") + json.dumps(row, separators=(",", ":"))
+        yield "]}"
+        emitted += count
+    yield "]}]}"
+
+
+async def byte_stream(lines: int):
+    pending = []
+    size = 0
+    for piece in synthetic_gl(lines):
+        pending.append(piece)
+        size += len(piece)
+        if size >= CHUNK_SIZE:
+            yield "".join(pending).encode()
+            pending, size = [], 0
+            await asyncio.sleep(0)
+    if pending:
+        yield "".join(pending).encode()
+
+
+async def run_stream(lines: int) -> int:
+    count = 0
+    async for _ in iter_xero_gl_txns(byte_stream(lines)):
+        count += 1
+    return count
+
+
+async def run_full(lines: int) -> int:
+    body = b"".join([chunk async for chunk in byte_stream(lines)])
+    report = json.loads(body)["Reports"][0]
+    return len(parse_xero_gl(report)["txns"])
+
+
+def run_mode(mode: str, lines: int) -> None:
+    started = time.perf_counter()
+    count = asyncio.run(run_stream(lines) if mode == "stream" else run_full(lines))
+    elapsed = time.perf_counter() - started
+    max_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(json.dumps({"mode": mode, "lines": lines, "txns": count, "seconds": round(elapsed, 2), "maxRssMb": round(max_rss_mb, 1)}))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--lines", type=int, default=500_000)
+    parser.add_argument("--mode", choices=["stream", "full"])
+    args = parser.parse_args()
+    if args.mode:
+        run_mode(args.mode, args.lines)
+        return
+    for mode in ("full", "stream"):
+        subprocess.run([sys.executable, __file__, "--mode", mode, "--lines", str(args.lines)], check=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""Compare snapshot payload codecs on size and encode/decode time.
+
+Usage (from mvp6/backend):
+    python scripts/bench_snapshot_codecs.py --txns 20000 --repeat 5
+
+Payloads are synthetic but shaped like the ones the app saves: a template tree, a
+monthly P&L matrix and a GL extract with overrides. zstd is skipped when the
+zstandard package is not installed.
+"""
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from fastapi import HTTPException  # noqa: E402
+
+from app.snapshot_store import PAYLOAD_CODECS, compress_payload, decompress_payload, encode_payload, zstd_module  # noqa: E402
+
+ACCOUNTS = 120
+MONTHS = 36
+
+
+def synthetic_payload(txns: int) -> dict:
+    months = [f"{2022 + idx // 12}-{idx % 12 + 1:02d}" for idx in range(MONTHS)]
+    accounts = [f"{400 + idx} Account {idx}" for idx in range(ACCOUNTS)]
+    return {
+        "summary": {"revenue": 1_234_567.89, "netProfit": 210_987.65, "months": len(months)},
+        "template": {
+            "name": "Dream P&L",
+            "sections": [
+                {"id": f"section-{idx}", "label": f"Section {idx}", "accounts": accounts[idx::8]} for idx in range(8)
+            ],
+        },
+        "pl": {
+            "months": months,
+            "accounts": [
+                {"name": name, "values": [round((row * 37 + col * 11) % 9973 * 1.25, 2) for col in range(MONTHS)]}
+                for row, name in enumerate(accounts)
+            ],
+        },
+        "gl": {
+            "txns": [
+                {
+                    "date": f"{months[idx % MONTHS]}-{idx % 28 + 1:02d}",
+                    "account": accounts[idx % ACCOUNTS],
+                    "source": "ACCREC" if idx % 3 else "ACCPAY",
+                    "description": f"Invoice {idx % 4000} - Patient {idx % 911}",
+                    "reference": f"INV-{idx:06d}",
+                    "amount": round((idx * 7919) % 100_000 / 100, 2),
+                }
+                for idx in range(txns)
+            ],
+            "overrides": {f"{idx:032x}": {"treatment": "exclude"} for idx in range(0, txns, 50)},
+        },
+    }
+
+
+def available_codecs() -> list:
+    codecs = []
+    for codec in PAYLOAD_CODECS:
+        try:
+            if codec == "zstd":
+                zstd_module()
+        except HTTPException:
+            print(f"skipping {codec}: zstandard is not installed", file=sys.stderr)
+            continue
+        codecs.append(codec)
+    return codecs
+
+
+def best_of(repeat: int, fn) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--txns", type=int, default=20_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    payload = synthetic_payload(args.txns)
+    encoded = encode_payload(payload)
+    encode_seconds = best_of(args.repeat, lambda: encode_payload(payload))
+    decode_seconds = best_of(args.repeat, lambda: json.loads(encoded))
+    print(json.dumps({"codec": "none", "bytes": len(encoded), "ratio": 1.0, "encodeMs": round(encode_seconds * 1000, 1), "decodeMs": round(decode_seconds * 1000, 1)}))
+    for codec in available_codecs():
+        blob = compress_payload(encoded, codec)
+        assert json.loads(decompress_payload(blob, codec)) == json.loads(encoded)
+        compress_seconds = best_of(args.repeat, lambda: compress_payload(encoded, codec))
+        decompress_seconds = best_of(args.repeat, lambda: json.loads(decompress_payload(blob, codec)))
+        print(
+            json.dumps(
+                {
+                    "codec": codec,
+                    "bytes": len(blob),
+                    "ratio": round(len(encoded) / len(blob), 2),
+                    "encodeMs": round((encode_seconds + compress_seconds) * 1000, 1),
+                    "decodeMs": round(decompress_seconds * 1000, 1),
+                }
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
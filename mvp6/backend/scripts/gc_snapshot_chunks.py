@@ -0,0 +1,37 @@
+"""Delete snapshot payload chunks that no snapshot manifest references.
+
+Usage (from mvp6/backend):
+    python scripts/gc_snapshot_chunks.py
+    python scripts/gc_snapshot_chunks.py --recount   # rebuild refcounts from manifests first
+
+Deleting a snapshot through the API drops its references; this reclaims the chunks
+left at zero. --recount also catches snapshots removed outside the API (for example
+by a user delete cascading in the database); run it while snapshots are not being
+written.
+"""
+
+import argparse
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.db import SessionLocal  # noqa: E402
+from app.snapshot_store import GC_BATCH, collect_chunks, recount_chunks  # noqa: E402
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--recount", action="store_true")
+    parser.add_argument("--batch-size", type=int, default=GC_BATCH)
+    args = parser.parse_args()
+    with SessionLocal() as db:
+        if args.recount:
+            recount_chunks(db)
+            db.commit()
+        collected = collect_chunks(db, args.batch_size)
+    print(f"Deleted {collected} unreferenced chunk(s)")
+
+
+if __name__ == "__main__":
+    main()
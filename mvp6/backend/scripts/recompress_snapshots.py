@@ -0,0 +1,34 @@
+"""Move snapshot payloads into the chunk store and rewrite chunks with a payload codec.
+
+Usage (from mvp6/backend):
+    python scripts/recompress_snapshots.py --codec gzip
+    python scripts/recompress_snapshots.py --codec none   # store chunks uncompressed
+
+Snapshots that still hold an inline payload are split into chunks first, then every
+chunk not stored with the codec is rewritten. Both passes commit in key-ordered batches,
+so the command can be interrupted and re-run.
+"""
+
+import argparse
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.db import SessionLocal  # noqa: E402
+from app.snapshot_store import PAYLOAD_CODECS, RECOMPRESS_BATCH, recompress_snapshots  # noqa: E402
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--codec", choices=[*PAYLOAD_CODECS, "none"], required=True)
+    parser.add_argument("--batch-size", type=int, default=RECOMPRESS_BATCH)
+    args = parser.parse_args()
+    codec = "" if args.codec == "none" else args.codec
+    with SessionLocal() as db:
+        moved, rewritten = recompress_snapshots(db, codec, args.batch_size)
+    print(f"Moved {moved} snapshot payload(s) into chunks; rewrote {rewritten} chunk(s) as {args.codec}")
+
+
+if __name__ == "__main__":
+    main()
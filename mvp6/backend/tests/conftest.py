@@ -5,6 +5,7 @@ from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from app.main import app
 from app.db import Base, get_db
+from app.sync_jobs import job_runner
 
 
 @pytest.fixture()
@@ -25,6 +26,7 @@ def client():
             db.close()
 
     app.dependency_overrides[get_db] = override_get_db
+    job_runner.session_factory = TestingSessionLocal
     with TestClient(app) as client:
         yield client
     app.dependency_overrides.clear()
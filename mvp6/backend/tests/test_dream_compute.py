@@ -0,0 +1,198 @@
+import copy
+
+import numpy as np
+import pytest
+
+from app.auth import CSRF_COOKIE_NAME
+from app.compute_cache import ComputeCache, compute_cache
+from app.dream_compute import apply_bundled_scenario, compile_template, compute_dream
+from app.pl_matrix import PLMatrix
+
+PL = {
+    "months": ["2024-01", "2024-02", "2024-03"],
+    "monthLabels": ["Jan 2024", "Feb 2024", "Mar 2024"],
+    "accounts": [
+        {"name": "Sales", "section": "trading_income", "values": [100.0, 200.0, 300.0], "total": 600.0},
+        {"name": "Interest", "section": "other_income", "values": [1.0, 2.0, 3.0], "total": 6.0},
+        {"name": "Consumables", "section": "cost_of_sales", "values": [10.0, 20.0], "total": 30.0},
+        {"name": "Rent", "section": "operating_expenses", "values": [50.0, 50.0, 50.0], "total": 150.0},
+        {"name": "Wages", "section": "operating_expenses", "values": [70.0, 80.0, 90.0], "total": 240.0},
+    ],
+}
+
+TEMPLATE = {
+    "id": "t1",
+    "name": "Dream",
+    "schemaVersion": "v1",
+    "version": 1,
+    "root": {
+        "id": "root",
+        "kind": "group",
+        "label": "Dream P&L",
+        "children": [
+            {"id": "rev", "kind": "group", "label": "Revenue", "children": [
+                {"id": "rev_sales", "kind": "line", "label": "Sales", "mappedAccounts": ["Sales", "Interest"]},
+            ]},
+            {"id": "cogs", "kind": "group", "label": "COGS", "children": [
+                {"id": "cogs_cons", "kind": "line", "label": "Consumables", "mappedAccounts": ["Consumables", "Missing"]},
+            ]},
+            {"id": "opex", "kind": "group", "label": "Opex", "children": [
+                {"id": "occupancy", "kind": "group", "label": "Occupancy", "children": [
+                    {"id": "opex_rent", "kind": "line", "label": "Rent", "mappedAccounts": ["Rent"]},
+                ]},
+                {"id": "opex_people", "kind": "line", "label": "People", "mappedAccounts": ["Wages", "Wages"]},
+                {"id": "opex_empty", "kind": "line", "label": "Unmapped", "mappedAccounts": []},
+            ]},
+        ],
+    },
+}
+
+
+def browser_compute(pl, template):
+    # Straight port of computeDream/computeDreamTotals, used as the reference.
+    def flatten(node):
+        out = []
+        for child in node["children"]:
+            out.extend([child] if child["kind"] == "line" else flatten(child))
+        return out
+
+    def find(node, group_id):
+        if node["id"] == group_id:
+            return node
+        for child in node["children"]:
+            if child["kind"] == "group":
+                hit = find(child, group_id)
+                if hit:
+                    return hit
+        return None
+
+    n = len(pl["months"])
+    by_account = {account["name"]: account["values"] for account in pl["accounts"]}
+    by_line = {}
+    for line in flatten(template["root"]):
+        sums = [0.0] * n
+        for name in line["mappedAccounts"]:
+            values = by_account.get(name)
+            if values is None:
+                continue
+            for idx in range(n):
+                sums[idx] += values[idx] if idx < len(values) else 0.0
+        by_line[line["id"]] = sums
+    totals = {}
+    for key, group_id in (("revenue", "rev"), ("cogs", "cogs"), ("opex", "opex")):
+        sums = [0.0] * n
+        for line in flatten(find(template["root"], group_id)):
+            for idx in range(n):
+                sums[idx] += by_line[line["id"]][idx]
+        totals[key] = sums
+    totals["net"] = [totals["revenue"][i] - totals["cogs"][i] - totals["opex"][i] for i in range(n)]
+    return by_line, totals
+
+
+def test_compute_matches_browser_engine():
+    result = compute_dream(PLMatrix.from_parsed(PL), compile_template(TEMPLATE))
+    by_line, totals = browser_compute(PL, TEMPLATE)
+
+    assert result["months"] == PL["months"]
+    assert result["byLineId"] == by_line
+    for key, values in totals.items():
+        assert result["totals"][key] == pytest.approx(values)
+    assert result["byLineId"]["opex_people"] == [140.0, 160.0, 180.0]
+    assert result["xeroTotals"]["revenue"] == [101.0, 202.0, 303.0]
+    assert result["xeroTotals"]["net"] == [-29.0, 52.0, 163.0]
+
+
+def test_cache_recomputes_only_changed_lines():
+    cache = ComputeCache()
+    pl = PLMatrix.from_parsed(PL)
+    etag, first = cache.compute(pl, TEMPLATE)
+    assert cache.compute(pl, copy.deepcopy(TEMPLATE)) == (etag, first)
+    assert cache.stats()["hits"] == 1
+
+    edited = copy.deepcopy(TEMPLATE)
+    edited["root"]["children"][2]["children"][1]["mappedAccounts"] = ["Wages", "Rent"]
+    edited_etag, result = cache.compute(pl, edited)
+    assert edited_etag != etag
+    assert result == compute_dream(pl, compile_template(edited))
+    assert result["totals"]["opex"] == [170.0, 180.0, 190.0]
+    stats = cache.stats()
+    assert (stats["full"], stats["incremental"], stats["linesRecomputed"]) == (1, 1, 5 + 1)
+
+    tiny = ComputeCache(max_bytes=2048)
+    tiny.compute(pl, TEMPLATE)
+    tiny.compute(pl, edited)
+    assert tiny.stats()["evictions"] > 0
+    assert tiny.stats()["bytes"] <= 2048
+
+
+def test_bundled_scenario_matches_browser_rules():
+    pl = PLMatrix.from_parsed({
+        "months": ["2024-01", "2024-02"],
+        "monthLabels": ["Jan 2024", "Feb 2024"],
+        "accounts": [
+            {"name": "TMS Revenue", "section": "trading_income", "values": [150.0, 150.0], "total": 300.0},
+            {"name": "Consult Revenue", "section": "trading_income", "values": [50.0, 50.0], "total": 100.0},
+            {"name": "Consult Income", "section": "trading_income", "values": [50.0, 50.0], "total": 100.0},
+            {"name": "Office Rent", "section": "operating_expenses", "values": [1000.0, 1000.0], "total": 2000.0},
+        ],
+    })
+    base = np.array([[1000.0, 1000.0], [0.0, 0.0], [1000.0, 1000.0]])
+    scenario = {
+        "enabled": True,
+        "legacyTmsAccounts": ["TMS Revenue"],
+        "includeDoctorConsultsInBundle": True,
+        "legacyConsultAccounts": ["Consult Revenue", "Consult Income"],
+        "excludedConsultAccounts": ["Consult Income"],
+        "cbaMonthlyCount": 10,
+        "cbaPrice": 100,
+        "programMonthlyCount": 5,
+        "programPrice": 200,
+        "addBundleCostsToScenario": True,
+        "cbaIncludeMRI": True,
+        "progIncludePostMRI": True,
+        "progMriCost": 20,
+        "state": "WA",
+        "rentEnabled": True,
+        "rentAccountMatchers": [],
+        "rentMode": "percent",
+        "rentPercentPerMonth": -10,
+    }
+    revenue, cogs, opex = apply_bundled_scenario(base, pl, scenario)
+    assert revenue.tolist() == [1000.0 - 200.0 + 2000.0] * 2
+    assert cogs.tolist() == [10 * 750.0 + 5 * 20.0] * 2
+    assert opex.tolist() == pytest.approx([1000.0, 1000.0 - 100.0])
+    assert apply_bundled_scenario(base, pl, {**scenario, "enabled": False}) is base
+
+
+def test_compute_endpoint_uses_saved_template(client):
+    compute_cache.clear()
+    resp = client.post(
+        "/api/auth/register",
+        json={"email": "dream@example.com", "password": "pass1234", "remember": False, "invite_code": "test-code"},
+    )
+    assert resp.status_code == 200
+    csrf = client.cookies.get(CSRF_COOKIE_NAME)
+
+    missing = client.post("/api/dream/compute", json={"pl": PL}, headers={"X-CSRF-Token": csrf})
+    assert missing.status_code == 400
+
+    saved = client.put("/api/state/template", json={"name": "Dream", "data": TEMPLATE}, headers={"X-CSRF-Token": csrf})
+    assert saved.status_code == 200
+    wire = PLMatrix.from_parsed(PL).to_wire("base64")
+    resp = client.post("/api/dream/compute", json={"pl": wire}, headers={"X-CSRF-Token": csrf})
+    assert resp.status_code == 200
+    assert resp.json()["totals"]["net"] == pytest.approx(browser_compute(PL, TEMPLATE)[1]["net"])
+    etag = resp.headers["ETag"]
+    cached = client.post("/api/dream/compute", json={"pl": wire}, headers={"X-CSRF-Token": csrf, "If-None-Match": etag})
+    assert cached.status_code == 304
+    scenario = client.post(
+        "/api/dream/compute",
+        json={"pl": wire, "scenario": {"enabled": True, "cbaMonthlyCount": 1, "cbaPrice": 10}},
+        headers={"X-CSRF-Token": csrf, "If-None-Match": etag},
+    )
+    assert scenario.status_code == 200
+    assert scenario.headers["ETag"] != etag
+    assert scenario.json()["totals"]["revenue"][0] == 111.0
+
+    bad = client.post("/api/dream/compute", json={"pl": {"months": []}}, headers={"X-CSRF-Token": csrf})
+    assert bad.status_code == 400
@@ -0,0 +1,488 @@
+import math
+import re
+from datetime import date, datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from app import deferrals, models
+from app.auth import CSRF_COOKIE_NAME
+from app.db import get_db
+from app.effective_ledger import build_effective_ledger
+from app.gl_cube import refresh_tenant_cubes
+from app.gl_store import load_gl_txns, rehash_overrides, store_gl_range
+from app.main import app
+from app.pl_matrix import PLMatrix
+from app.txn_hash import js_number, js_string_hashes, txn_hash, txn_hashes
+
+TXNS = [
+    {"account": "Sales", "date": "2024-01-10", "source": "ACCREC", "description": "Consult Dr Jane Smith", "reference": "INV-1", "debit": 0.0, "credit": 330.0, "amount": -330.0},
+    {"account": "Sales", "date": "2024-02-03", "source": "ACCREC", "description": "Consult", "reference": "INV-2", "debit": 0.0, "credit": 110.0, "amount": -110.0},
+    {"account": "Equipment Lease", "date": "2024-01-15", "source": "ACCPAY", "description": "Lease bill", "reference": "", "debit": 1000.01, "credit": 0.0, "amount": 1000.01},
+    {"account": "Legal", "date": "2024-02-20", "source": "ACCPAY", "description": "Settlement", "reference": "", "debit": 500.0, "credit": 0.0, "amount": 500.0},
+    {"account": "Wages", "date": "2024-03-01", "source": "MANJOURNAL", "description": "Payroll", "reference": "", "debit": 0.1, "credit": 0.0, "amount": 0.1},
+    {"account": "Wages", "date": "2024-03-31", "source": "MANJOURNAL", "description": "Payroll reversal", "reference": "", "debit": 0.0, "credit": 20.0, "amount": -20.0},
+]
+
+PL = {
+    "months": ["2024-01", "2024-02", "2024-03"],
+    "monthLabels": ["Jan 2024", "Feb 2024", "Mar 2024"],
+    "accounts": [
+        {"name": "Sales", "section": "trading_income", "values": [330.0, 110.0, 0.0], "total": 440.0},
+        {"name": "Equipment Lease", "section": "operating_expenses", "values": [1000.01, 0.0, 0.0], "total": 1000.01},
+        {"name": "Legal", "section": "operating_expenses", "values": [0.0, 500.0, 0.0], "total": 500.0},
+        {"name": "Wages", "section": "operating_expenses", "values": [0.0, 0.0, -19.9], "total": -19.9},
+        {"name": "Rent", "section": "operating_expenses", "values": [40.0, 40.0, 40.0], "total": 120.0},
+    ],
+}
+
+
+def browser_hash(value):
+    h = 0
+    for unit in [value.encode("utf-16-le")[i:i + 2] for i in range(0, len(value.encode("utf-16-le")), 2)]:
+        h = (h * 31 + int.from_bytes(unit, "little")) & 0xFFFFFFFF
+    h = h - 2 ** 32 if h >= 2 ** 31 else h
+    return format(abs(h), "x")
+
+
+def browser_effective(txns, overrides, rules, pl):
+    # Straight port of buildEffectiveLedger/buildEffectivePl, used as the reference.
+    override_map = {o.hash: o for o in overrides if o.hash}
+    rule_map = {r.contact_id: r for r in rules if r.enabled}
+
+    def first(*values):
+        return next((value for value in values if value is not None), None)
+
+    rows = []
+    for txn in txns:
+        key = browser_hash("|".join([txn["account"], txn["date"], js_number(txn["amount"]), txn["description"], txn["reference"], txn["source"]]))
+        match = re.search(r"(?:dr\.?\s+|doctor\s+)([a-z][a-z'\-]*(?:\s+[a-z][a-z'\-]*){0,2})", f"{txn['description']} {txn['reference']}".strip(), re.I)
+        contact = re.sub(r"[^a-z0-9]+", "-", f"Dr {match.group(1).strip()}".lower()).strip("-") if match else None
+        override, rule = override_map.get(key), rule_map.get(contact)
+        treatment = first(getattr(override, "treatment", None), getattr(rule, "default_treatment", None), "OPERATING")
+        month = txn["date"][:7]
+        if treatment == "EXCLUDE":
+            continue
+        if treatment != "DEFERRED":
+            rows.append((txn["account"], month, txn["amount"], treatment == "NON_OPERATING"))
+            continue
+        start = first(getattr(override, "deferral_start_month", None), getattr(rule, "deferral_start_month", None)) or month
+        months = max(1, math.floor(first(getattr(override, "deferral_months", None), getattr(rule, "deferral_months", None), 12) + 0.5))
+        include = first(getattr(override, "deferral_include_in_operating_kpis", None), getattr(rule, "deferral_include_in_operating_kpis", None), True)
+        cents = math.floor(txn["amount"] * 100 + 0.5)
+        base = int(cents / months)
+        year, mon = map(int, start.split("-"))
+        for idx in range(months):
+            amount = (base + (cents - base * months if idx == months - 1 else 0)) / 100
+            index = year * 12 + mon - 1 + idx
+            rows.append((txn["account"], f"{index // 12:04d}-{index % 12 + 1:02d}", amount, not include))
+
+    sections = {account["name"]: account["section"] for account in pl["accounts"]}
+    sums = {}
+    for account, month, amount, _ in rows:
+        if month not in pl["months"]:
+            continue
+        values = sums.setdefault(account, [0.0] * len(pl["months"]))
+        values[pl["months"].index(month)] += -amount if sections.get(account) in ("trading_income", "other_income") else amount
+    return rows, {account["name"]: sums.get(account["name"], account["values"]) for account in pl["accounts"]}
+
+
+def test_js_number_and_hash_match_browser():
+    assert js_number(100.0) == "100"
+    assert js_number(-0.0) == "0"
+    assert js_number(-12.5) == "-12.5"
+    assert js_number(0.1 + 0.2) == "0.30000000000000004"
+    assert js_number(1e21) == "1e+21"
+    assert js_number(1.5e-7) == "1.5e-7"
+    assert js_number(123456789012345680000.0) == "123456789012345680000"
+    values = ["", "a", "abc", "Sales|2024-01-10|-330|Consult Dr Jane Smith|INV-1|ACCREC", "é€😀" * 40]
+    assert js_string_hashes(values)[:3] == ["0", "61", "17862"]
+    assert js_string_hashes(values) == [browser_hash(value) for value in values]
+
+
+def test_effective_ledger_matches_browser_port():
+    hashes = js_string_hashes(["|".join([t["account"], t["date"], js_number(t["amount"]), t["description"], t["reference"], t["source"]]) for t in TXNS])
+    overrides = [
+        SimpleNamespace(hash=hashes[2], treatment="DEFERRED", deferral_start_month=None, deferral_months=3, deferral_include_in_operating_kpis=None),
+        SimpleNamespace(hash=hashes[3], treatment="NON_OPERATING", deferral_start_month=None, deferral_months=None, deferral_include_in_operating_kpis=None),
+        SimpleNamespace(hash=hashes[5], treatment="EXCLUDE", deferral_start_month=None, deferral_months=None, deferral_include_in_operating_kpis=None),
+    ]
+    rules = [SimpleNamespace(contact_id="dr-jane-smith-inv", enabled=True, default_treatment="DEFERRED", deferral_start_month="2024-02", deferral_months=2, deferral_include_in_operating_kpis=False)]
+    ledger = build_effective_ledger(TXNS, overrides, rules)
+    expected_rows, expected_pl = browser_effective(TXNS, overrides, rules, PL)
+
+    rows = ledger.rows()
+    assert [(r["account"], r["month"], r["amount"], r["nonOperating"]) for r in rows] == expected_rows
+    deferred = [r for r in rows if r["account"] == "Equipment Lease"]
+    assert [r["amount"] for r in deferred] == [333.33, 333.33, 333.35]
+    # Row keys are canonical even when the override matched on its legacy hash.
+    assert [r["key"] for r in deferred] == [f"{txn_hashes(TXNS)[2]}-def-{idx}" for idx in range(3)]
+    assert rows[0]["doctorContactId"] == "dr-jane-smith-inv" and rows[0]["date"] == "2024-02-01"
+    assert ledger.rows(2, 2) == rows[2:4]
+
+    result = ledger.aggregate(PLMatrix.from_parsed(PL))
+    assert {a["name"]: a["values"] for a in result["accounts"]} == pytest.approx(expected_pl)
+    operating = {a["name"]: a["values"] for a in ledger.aggregate(PLMatrix.from_parsed(PL), include_non_operating=False)["accounts"]}
+    # Accounts with no operating movement keep their Xero values, as in buildEffectivePl.
+    assert operating["Legal"] == [0.0, 500.0, 0.0]
+    assert operating["Sales"] == [0.0, 110.0, 0.0]
+
+
+def test_canonical_txn_hash_normalises_fields():
+    txn = TXNS[2]
+    assert len(txn_hash(txn)) == 32
+    assert txn_hash({**txn, "description": "  Lease   bill ", "date": "15 Jan 2024", "amount": 1000.0100000001}) == txn_hash(txn)
+    assert txn_hash({**txn, "amount": 1000.02}) != txn_hash(txn)
+    assert txn_hash({**txn, "description": "Lease", "reference": "bill"}) != txn_hash(txn)
+    assert txn_hash({**txn, "amount": -0.0}) == txn_hash({**txn, "amount": 0.0})
+    assert len(set(txn_hashes(TXNS))) == len(TXNS)
+
+
+@pytest.fixture()
+def ledger_user(client):
+    resp = client.post(
+        "/api/auth/register",
+        json={"email": "ledger@example.com", "password": "pass1234", "remember": False, "invite_code": "test-code"},
+    )
+    user_id = resp.json()["user"]["id"]
+    db = next(app.dependency_overrides[get_db]())
+    db.add(models.XeroConnection(
+        user_id=user_id,
+        access_token="access-token",
+        refresh_token="refresh-token",
+        expires_at=datetime.utcnow() + timedelta(hours=1),
+        tenant_id="tenant-1",
+    ))
+    store_gl_range(db, "tenant-1", date(2024, 1, 1), date(2024, 3, 31), TXNS)
+    db.commit()
+    db.close()
+    return {"X-CSRF-Token": client.cookies.get(CSRF_COOKIE_NAME)}
+
+
+def test_effective_endpoint(client, ledger_user):
+    headers = ledger_user
+    legal_hash = js_string_hashes(["Legal|2024-02-20|500|Settlement||ACCPAY"])[0]
+    resp = client.put("/api/ledger/overrides", headers=headers, json={
+        "source": "gl", "document_id": "doc-1", "hash": legal_hash, "treatment": "EXCLUDE",
+    })
+    assert resp.status_code == 200
+
+    body = {"from_date": "2024-01-01", "to_date": "2024-03-31"}
+    resp = client.post("/api/ledger/effective", headers=headers, json=body)
+    assert resp.status_code == 200
+    accounts = {a["name"]: a["values"] for a in resp.json()["accounts"]}
+    assert resp.json()["months"] == ["2024-01", "2024-02", "2024-03"]
+    assert "Legal" not in accounts
+    assert accounts["Wages"] == pytest.approx([0.0, 0.0, -19.9])
+
+    resp = client.post("/api/ledger/effective", headers=headers, json={**body, "pl": PLMatrix.from_parsed(PL).to_wire("base64")})
+    accounts = {a["name"]: a["values"] for a in resp.json()["accounts"]}
+    assert accounts["Sales"] == [330.0, 110.0, 0.0]
+    assert accounts["Legal"] == [0.0, 500.0, 0.0]
+
+    resp = client.post("/api/ledger/effective", headers=headers, json={**body, "view": "rows", "page": 2, "page_size": 2})
+    assert resp.json()["total"] == 5
+    assert [r["account"] for r in resp.json()["rows"]] == [r["account"] for r in build_effective_ledger(TXNS).rows() if r["account"] != "Legal"][2:4]
+
+    assert client.post("/api/ledger/effective", headers=headers, json={**body, "view": "cube"}).status_code == 400
+
+
+def test_deferral_schedules_follow_override_and_rule_writes(client, ledger_user):
+    headers = ledger_user
+
+    def totals():
+        resp = client.get("/api/ledger/deferrals", params={"from_month": "2024-01", "to_month": "2024-12"})
+        assert resp.status_code == 200
+        return {(t["month"], t["account"], t["nonOperating"]): t["amount"] for t in resp.json()["totals"]}
+
+    def schedule_count():
+        db = next(app.dependency_overrides[get_db]())
+        try:
+            return db.query(models.DeferralSchedule).count()
+        finally:
+            db.close()
+
+    resp = client.put("/api/ledger/doctor-rules", headers=headers, json={
+        "contact_id": "dr-jane-smith-inv", "default_treatment": "DEFERRED", "deferral_months": 2, "enabled": True,
+    })
+    assert resp.status_code == 200
+    assert totals() == {
+        ("2024-01", "Sales", False): 165.0,
+        ("2024-02", "Sales", False): -165.0,
+    }
+
+    lease_hash = js_string_hashes(["Equipment Lease|2024-01-15|1000.01|Lease bill||ACCPAY"])[0]
+    resp = client.put("/api/ledger/overrides", headers=headers, json={
+        "source": "gl", "document_id": "doc-2", "hash": lease_hash, "treatment": "DEFERRED",
+        "deferral_start_month": "2024-02", "deferral_months": 2, "deferral_include_in_operating_kpis": False,
+    })
+    assert resp.status_code == 200
+    override_id = resp.json()["id"]
+    assert totals()[("2024-01", "Equipment Lease", False)] == -1000.01
+    assert totals()[("2024-03", "Equipment Lease", True)] == 500.01
+    assert schedule_count() == 3 + 3
+    assert totals()[("2024-02", "Sales", False)] == -165.0
+
+    resp = client.delete("/api/ledger/doctor-rules/dr-jane-smith-inv", headers=headers)
+    assert resp.status_code == 200
+    assert all(key[1] == "Equipment Lease" for key in totals())
+    assert schedule_count() == 3
+
+    resp = client.delete(f"/api/ledger/overrides/{override_id}", headers=headers)
+    assert resp.status_code == 200
+    assert totals() == {}
+    assert schedule_count() == 0
+
+
+def test_identical_deferred_lines_share_one_schedule(client, ledger_user):
+    headers = ledger_user
+    db = next(app.dependency_overrides[get_db]())
+    store_gl_range(db, "tenant-1", date(2024, 1, 1), date(2024, 3, 31), TXNS + [dict(TXNS[0])])
+    db.commit()
+    db.close()
+
+    resp = client.put("/api/ledger/doctor-rules", headers=headers, json={
+        "contact_id": "dr-jane-smith-inv", "default_treatment": "DEFERRED", "deferral_months": 2, "enabled": True,
+    })
+    assert resp.status_code == 200
+    totals = client.get("/api/ledger/deferrals", params={"from_month": "2024-01", "to_month": "2024-12"}).json()["totals"]
+    assert {(t["month"], t["account"]): t["amount"] for t in totals} == {("2024-01", "Sales"): 330.0, ("2024-02", "Sales"): -330.0}
+
+    db = next(app.dependency_overrides[get_db]())
+    assert db.query(models.DeferralSchedule).count() == 3
+    db.close()
+    # A GL sync rebuilds the same schedules without tripping the unique key.
+    db = next(app.dependency_overrides[get_db]())
+    user_id = db.query(models.User.id).scalar()
+    assert deferrals.rebuild_deferrals(db, user_id) == 3
+    db.commit()
+    db.close()
+
+
+def test_deferral_writes_find_lines_through_key_columns(client, ledger_user, monkeypatch):
+    headers = ledger_user
+    db = next(app.dependency_overrides[get_db]())
+    stored = {(row.account, row.date): row for row in db.query(models.GLTransaction)}
+    assert stored[("Equipment Lease", "2024-01-15")].txn_hash == txn_hash(TXNS[2])
+    assert {row.contact_key for row in stored.values()} == {"dr-jane-smith-inv", None}
+    db.close()
+
+    def full_scan(*args, **kwargs):
+        raise AssertionError("override and rule writes should not load the whole ledger")
+
+    monkeypatch.setattr(deferrals, "load_gl_txns", full_scan)
+    client.put("/api/ledger/doctor-rules", headers=headers, json={
+        "contact_id": "dr-jane-smith-inv", "default_treatment": "DEFERRED", "deferral_months": 2, "enabled": True,
+    })
+    resp = client.put("/api/ledger/overrides", headers=headers, json={
+        "source": "gl", "document_id": "doc-2", "hash": txn_hash(TXNS[2]), "treatment": "DEFERRED",
+        "deferral_start_month": "2024-02", "deferral_months": 2,
+    })
+    assert resp.status_code == 200
+    totals = client.get("/api/ledger/deferrals", params={"from_month": "2024-01", "to_month": "2024-12"}).json()["totals"]
+    assert {(t["month"], t["account"]): t["amount"] for t in totals} == {
+        ("2024-01", "Sales"): 165.0,
+        ("2024-02", "Sales"): -165.0,
+        ("2024-01", "Equipment Lease"): -1000.01,
+        ("2024-02", "Equipment Lease"): 500.0,
+        ("2024-03", "Equipment Lease"): 500.01,
+    }
+
+
+def test_bulk_override_upsert_and_delete(client, ledger_user):
+    headers = ledger_user
+    resp = client.put("/api/ledger/overrides", headers=headers, json={
+        "source": "gl", "document_id": "doc-0", "treatment": "NON_OPERATING",
+    })
+    existing_id = resp.json()["id"]
+
+    items = [{"source": "gl", "document_id": f"doc-{idx}", "treatment": "NON_OPERATING"} for idx in range(1200)]
+    items.append({"source": "gl", "document_id": "doc-5", "treatment": "EXCLUDE"})
+    resp = client.put("/api/ledger/overrides/bulk", headers=headers, json={"overrides": items})
+    assert resp.status_code == 200
+    body = resp.json()
+    assert (body["created"], body["updated"]) == (1199, 1)
+    assert body["results"][0] == {"index": 0, "id": existing_id, "status": "updated"}
+    assert body["results"][5]["id"] == body["results"][1200]["id"]
+
+    # NULL line items and hashes still address the same override on a re-run.
+    resp = client.put("/api/ledger/overrides/bulk", headers=headers, json={"overrides": items[:10]})
+    assert resp.json()["updated"] == 10
+    overrides = {o["document_id"]: o for o in client.get("/api/ledger/overrides").json()}
+    assert len(overrides) == 1200
+    assert overrides["doc-5"]["treatment"] == "NON_OPERATING"
+    assert overrides["doc-6"]["treatment"] == "NON_OPERATING"
+
+    ids = [result["id"] for result in body["results"][:700]] + ["missing"]
+    resp = client.post("/api/ledger/overrides/bulk-delete", headers=headers, json={"ids": ids})
+    assert resp.json()["deleted"] == 700
+    assert len(client.get("/api/ledger/overrides").json()) == 500
+
+
+def test_override_change_feed_and_list_etag(client, ledger_user):
+    headers = ledger_user
+    items = [{"source": "gl", "document_id": f"doc-{idx}", "hash": f"hash-{idx}", "treatment": "NON_OPERATING"} for idx in range(5)]
+    ids = [result["id"] for result in client.put("/api/ledger/overrides/bulk", headers=headers, json={"overrides": items}).json()["results"]]
+
+    resp = client.get("/api/ledger/overrides")
+    etag = resp.headers["ETag"]
+    assert client.get("/api/ledger/overrides", headers={"If-None-Match": etag}).status_code == 304
+
+    seen, cursor = [], None
+    while True:
+        page = client.get("/api/ledger/overrides/changes", params={"since": cursor, "limit": 2} if cursor else {"limit": 2}).json()
+        seen += [item["id"] for item in page["items"]]
+        cursor = page["cursor"]
+        if not page["hasMore"]:
+            break
+    assert sorted(seen) == sorted(ids)
+
+    client.put("/api/ledger/overrides", headers=headers, json={**items[0], "treatment": "EXCLUDE"})
+    client.delete(f"/api/ledger/overrides/{ids[1]}", headers=headers)
+    client.post("/api/ledger/overrides/bulk-delete", headers=headers, json={"ids": [ids[2]]})
+    page = client.get("/api/ledger/overrides/changes", params={"since": cursor}).json()
+    assert [(item["id"], item["treatment"]) for item in page["items"]] == [(ids[0], "EXCLUDE")]
+    # Tombstones carry the override's txn hash so clients can drop it without knowing the id.
+    assert [(tombstone["id"], tombstone["key"]) for tombstone in page["deleted"]] == [(ids[1], "hash-1"), (ids[2], "hash-2")]
+    assert client.get("/api/ledger/overrides/changes", params={"since": page["cursor"]}).json()["items"] == []
+
+    assert client.get("/api/ledger/overrides", headers={"If-None-Match": etag}).status_code == 200
+    assert client.get("/api/ledger/overrides/changes", params={"since": "not-a-cursor"}).status_code == 400
+    assert client.get("/api/ledger/preferences/changes").json()["items"] == []
+
+
+def test_classify_endpoint_uses_cached_rules_and_patterns(client, ledger_user):
+    headers = ledger_user
+    resp = client.post("/api/ledger/classify", headers=headers, json={"include_hashes": True})
+    assert resp.status_code == 200
+    body = resp.json()
+    assert body["count"] == len(TXNS)
+    assert body["contactIds"][0] == "dr-jane-smith-inv"
+    assert body["doctorMatch"][0] is False
+    assert body["treatments"] == ["OPERATING"] * len(TXNS)
+    assert body["hashes"] == build_effective_ledger(TXNS).keys
+
+    client.put("/api/ledger/doctor-rules", headers=headers, json={
+        "contact_id": "dr-jane-smith-inv", "default_treatment": "NON_OPERATING", "enabled": True,
+    })
+    client.put("/api/ledger/preferences/doctor_patterns_v1", headers=headers, json={"value_json": {"patterns": ["smith", "(bad"]}})
+    posted = [{"description": "Dr Jane Smith", "reference": "INV-9"}, {"description": "Doctor Who"}, {"description": "Supplies"}]
+    body = client.post("/api/ledger/classify", headers=headers, json={"txns": posted}).json()
+    assert body["contactIds"] == ["dr-jane-smith-inv", "dr-who", None]
+    assert body["doctorMatch"] == [True, False, False]
+    assert body["treatments"] == ["NON_OPERATING", "OPERATING", "OPERATING"]
+    assert body["hashes"] is None
+
+    # Patterns also label lines without a "Dr" prefix, as whole words, and rules apply to them.
+    client.put("/api/ledger/preferences/doctor_patterns_v1", headers=headers, json={"value_json": {"patterns": ["ryan", "ho"]}})
+    client.put("/api/ledger/doctor-rules", headers=headers, json={
+        "contact_id": "dr-ryan", "default_treatment": "EXCLUDE", "enabled": True,
+    })
+    posted = [{"description": "Consult Ryan", "reference": "INV-3"}, {"description": "Photo supplies"}, {"description": "Dr Ho"}]
+    body = client.post("/api/ledger/classify", headers=headers, json={"txns": posted}).json()
+    assert body["doctorLabels"] == ["Dr Ryan", None, "Dr Ho"]
+    assert body["contactIds"] == ["dr-ryan", None, "dr-ho"]
+    assert body["doctorMatch"] == [True, False, True]
+    assert body["treatments"] == ["EXCLUDE", "OPERATING", "OPERATING"]
+
+
+def test_hash_endpoint_and_legacy_override_rehash(client, ledger_user):
+    headers = ledger_user
+    resp = client.post("/api/ledger/hashes", headers=headers, json={"txns": TXNS, "include_legacy": True})
+    assert resp.status_code == 200
+    body = resp.json()
+    assert body["hashes"] == txn_hashes(TXNS)
+    legal_legacy = js_string_hashes(["Legal|2024-02-20|500|Settlement||ACCPAY"])[0]
+    assert body["legacyHashes"][3] == legal_legacy
+    assert client.post("/api/ledger/hashes", headers=headers, json={"txns": TXNS}).json()["legacyHashes"] is None
+    assert client.post("/api/ledger/hashes", json={"txns": TXNS}).status_code == 403
+
+    client.put("/api/ledger/overrides", headers=headers, json={
+        "source": "gl", "document_id": "doc-1", "hash": legal_legacy, "treatment": "EXCLUDE",
+    })
+    body = {"from_date": "2024-01-01", "to_date": "2024-03-31"}
+    assert "Legal" not in {a["name"] for a in client.post("/api/ledger/effective", headers=headers, json=body).json()["accounts"]}
+
+    db = next(app.dependency_overrides[get_db]())
+    user_id = db.query(models.User).filter(models.User.email == "ledger@example.com").one().id
+    assert rehash_overrides(db, user_id) == 1
+    assert rehash_overrides(db, user_id) == 0
+    db.commit()
+    db.close()
+    (override,) = client.get("/api/ledger/overrides").json()
+    assert override["hash"] == txn_hashes(TXNS)[3]
+    assert override["legacy_hash"] == legal_legacy
+    assert "Legal" not in {a["name"] for a in client.post("/api/ledger/effective", headers=headers, json=body).json()["accounts"]}
+
+    # The browser keeps writing with its legacy key; that updates the rehashed override.
+    resp = client.put("/api/ledger/overrides", headers=headers, json={
+        "source": "gl", "document_id": "doc-1", "hash": legal_legacy, "treatment": "NON_OPERATING",
+    })
+    assert (resp.json()["id"], resp.json()["hash"]) == (override["id"], txn_hashes(TXNS)[3])
+    resp = client.put("/api/ledger/overrides/bulk", headers=headers, json={"overrides": [
+        {"source": "gl", "document_id": "doc-1", "hash": legal_legacy, "treatment": "EXCLUDE"},
+    ]})
+    assert resp.json()["results"] == [{"index": 0, "id": override["id"], "status": "updated"}]
+    assert [(o["id"], o["treatment"]) for o in client.get("/api/ledger/overrides").json()] == [(override["id"], "EXCLUDE")]
+
+
+def test_gl_cube_tracks_overrides_rules_and_gl_syncs(client, ledger_user):
+    headers = ledger_user
+    months = {"from_month": "2024-01", "to_month": "2024-04"}
+
+    def assert_cube_matches_ledger():
+        db = next(app.dependency_overrides[get_db]())
+        ledger = build_effective_ledger(load_gl_txns(db, "tenant-1"), db.query(models.TxnOverride).all(), db.query(models.DoctorRule).all())
+        db.close()
+        expected = {a["name"]: a["values"] for a in ledger.aggregate(months=["2024-01", "2024-02", "2024-03", "2024-04"])["accounts"]}
+        resp = client.get("/api/ledger/cube", params=months)
+        assert resp.status_code == 200
+        assert {a["name"]: a["values"] for a in resp.json()["accounts"]} == pytest.approx(expected)
+
+    assert_cube_matches_ledger()
+    lease_hash = txn_hashes(TXNS)[2]
+    client.put("/api/ledger/overrides", headers=headers, json={
+        "source": "gl", "document_id": "doc-1", "hash": lease_hash, "treatment": "DEFERRED", "deferral_months": 3,
+    })
+    assert_cube_matches_ledger()
+    legal_legacy = js_string_hashes(["Legal|2024-02-20|500|Settlement||ACCPAY"])[0]
+    client.put("/api/ledger/overrides", headers=headers, json={
+        "source": "gl", "document_id": "doc-2", "hash": legal_legacy, "treatment": "EXCLUDE",
+    })
+
+    def cell_ids():
+        db = next(app.dependency_overrides[get_db]())
+        try:
+            return {(cell.month, cell.account, cell.treatment): cell.id for cell in db.query(models.GLCubeCell)}
+        finally:
+            db.close()
+
+    # A rule write only rewrites the cells of the lines it reclassifies.
+    before = cell_ids()
+    client.put("/api/ledger/doctor-rules", headers=headers, json={
+        "contact_id": "dr-jane-smith-inv", "default_treatment": "NON_OPERATING", "enabled": True,
+    })
+    after = cell_ids()
+    assert {key for key in before.keys() | after.keys() if before.get(key) != after.get(key)} == {
+        ("2024-01", "Sales", "OPERATING"), ("2024-01", "Sales", "NON_OPERATING"),
+    }
+    assert_cube_matches_ledger()
+
+    cells = client.get("/api/ledger/cube", params={**months, "view": "cells"}).json()["cells"]
+    assert {"month": "2024-02", "account": "Legal", "treatment": "EXCLUDE", "nonOperating": False, "amount": 500.0, "count": 1} in cells
+    assert [c["count"] for c in cells if c["account"] == "Equipment Lease"] == [1, 1, 1]
+    resp = client.get("/api/ledger/cube", params={**months, "account": ["Sales"], "include_non_operating": False})
+    assert resp.json()["accounts"] == [{"name": "Sales", "section": None, "values": [0.0, -110.0, 0.0, 0.0], "total": -110.0, "count": 1}]
+    assert client.get("/api/ledger/cube", params={"from_month": "2024-13", "to_month": "2024-04"}).status_code == 400
+
+    # A later sync replaces March and adds April; only those months are recomputed.
+    db = next(app.dependency_overrides[get_db]())
+    march = [txn for txn in TXNS if txn["date"].startswith("2024-03")][:1]
+    april = [{**TXNS[3], "date": "2024-04-02", "description": "Retainer"}]
+    store_gl_range(db, "tenant-1", date(2024, 3, 1), date(2024, 4, 30), march + april)
+    refresh_tenant_cubes(db, "tenant-1", date(2024, 3, 1), date(2024, 4, 30))
+    db.commit()
+    db.close()
+    assert_cube_matches_ledger()
+    client.delete("/api/ledger/doctor-rules/dr-jane-smith-inv", headers=headers)
+    assert_cube_matches_ledger()
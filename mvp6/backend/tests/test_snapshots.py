@@ -55,3 +55,317 @@ def test_snapshot_share_rbac(client):
         headers={"X-CSRF-Token": csrf},
     )
     assert share_block.status_code == 403
+
+
+def test_snapshot_listing_query_count_is_constant(client):
+    from sqlalchemy import event
+
+    from app.db import get_db
+    from app.main import app
+
+    # The first account registered is a super admin, which sees everything as owner.
+    for email in ("admin@example.com", "lister@example.com"):
+        client.post("/api/auth/logout", headers={"X-CSRF-Token": register(client, email)})
+    csrf = register(client, "sharer@example.com")
+
+    def add_snapshots(count):
+        for idx in range(count):
+            snap = client.post(
+                "/api/snapshots",
+                json={"name": f"Shared {idx}", "payload": {"schema_version": "v1", "data": {"summary": {"idx": idx}}}},
+                headers={"X-CSRF-Token": csrf},
+            ).json()
+            client.post(
+                f"/api/snapshots/{snap['id']}/shares",
+                json={"email": "lister@example.com", "role": "viewer" if idx % 2 else "editor"},
+                headers={"X-CSRF-Token": csrf},
+            )
+
+    engine = next(app.dependency_overrides[get_db]()).get_bind()
+    statements = []
+
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    def query_counts():
+        counts = []
+        for path in ("/api/snapshots", "/api/state"):
+            statements.clear()
+            event.listen(engine, "before_cursor_execute", count_statement)
+            try:
+                resp = client.get(path)
+            finally:
+                event.remove(engine, "before_cursor_execute", count_statement)
+            assert resp.status_code == 200
+            counts.append(len(statements))
+        return counts
+
+    add_snapshots(1)
+    # Listing as the sharer sees its own snapshots; the other user sees the shared ones.
+    client.post("/api/auth/logout", headers={"X-CSRF-Token": csrf})
+    client.post("/api/auth/login", json={"email": "lister@example.com", "password": "pass1234", "remember": False})
+    few = query_counts()
+    listed = client.get("/api/snapshots").json()
+    assert [(s["name"], s["role"], s["owner_email"]) for s in listed] == [("Shared 0", "editor", "sharer@example.com")]
+
+    client.post("/api/auth/logout", headers={"X-CSRF-Token": client.cookies.get(CSRF_COOKIE_NAME)})
+    client.post("/api/auth/login", json={"email": "sharer@example.com", "password": "pass1234", "remember": False})
+    csrf = client.cookies.get(CSRF_COOKIE_NAME)
+    add_snapshots(10)
+    assert len(client.get("/api/state").json()["snapshots"]) == 11
+    client.post("/api/auth/logout", headers={"X-CSRF-Token": csrf})
+    client.post("/api/auth/login", json={"email": "lister@example.com", "password": "pass1234", "remember": False})
+    assert query_counts() == few
+    listed = client.get("/api/snapshots").json()
+    assert len(listed) == 11
+    assert {s["role"] for s in listed} == {"viewer", "editor"}
+
+
+def test_snapshot_metadata_columns_and_payload_free_listing(client):
+    from sqlalchemy import event
+
+    from app.db import get_db
+    from app.main import app
+
+    csrf = register(client, "meta@example.com")
+    headers = {"X-CSRF-Token": csrf}
+    data = {"summary": {"revenue": 1200}, "rows": list(range(50))}
+    created = client.post("/api/snapshots", json={"name": "Meta", "payload": {"schema_version": "v1", "data": data}}, headers=headers).json()
+    assert created["summary"] == {"revenue": 1200}
+    assert created["payload_size"] > 100
+    first_hash = created["payload_hash"]
+
+    updated = client.patch(
+        f"/api/snapshots/{created['id']}",
+        json={"payload": {"schema_version": "v2", "data": {**data, "summary": {"revenue": 900}}}},
+        headers=headers,
+    ).json()
+    assert updated["summary"] == {"revenue": 900}
+    assert updated["payload_hash"] != first_hash
+    copy = client.post(f"/api/snapshots/{created['id']}/duplicate", headers=headers).json()
+    assert (copy["summary"], copy["payload_size"], copy["payload_hash"]) == (updated["summary"], updated["payload_size"], updated["payload_hash"])
+    renamed = client.patch(f"/api/snapshots/{copy['id']}", json={"name": "Renamed"}, headers=headers).json()
+    assert renamed["payload_hash"] == copy["payload_hash"]
+
+    engine = next(app.dependency_overrides[get_db]()).get_bind()
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        listed = client.get("/api/snapshots").json()
+        state = client.get("/api/state").json()
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+    assert {s["summary"]["revenue"] for s in listed} == {900}
+    assert len(state["snapshots"]) == 2
+    assert not any("snapshots.payload," in statement or "snapshots.payload " in statement for statement in statements)
+    assert client.get(f"/api/snapshots/{created['id']}").json()["payload"]["data"]["rows"] == list(range(50))
+
+
+def test_snapshot_listing_keyset_pages_and_filters(client, monkeypatch):
+    for email in ("root@example.com", "pager@example.com"):
+        client.post("/api/auth/logout", headers={"X-CSRF-Token": register(client, email)})
+    csrf = register(client, "practice@example.com")
+    headers = {"X-CSRF-Token": csrf}
+    for idx, name in enumerate(["Month 01", "Month 02", "Board pack", "month 03", "Month 04"]):
+        snap = client.post("/api/snapshots", json={"name": name, "payload": {"schema_version": "v1", "data": {}}}, headers=headers).json()
+        if idx < 3:
+            client.post(
+                f"/api/snapshots/{snap['id']}/shares",
+                json={"email": "pager@example.com", "role": "viewer" if idx == 1 else "editor"},
+                headers=headers,
+            )
+    client.post("/api/auth/logout", headers=headers)
+    client.post("/api/auth/login", json={"email": "pager@example.com", "password": "pass1234", "remember": False})
+    headers = {"X-CSRF-Token": client.cookies.get(CSRF_COOKIE_NAME)}
+    for name in ("Mine A", "Mine B"):
+        client.post("/api/snapshots", json={"name": name, "payload": {"schema_version": "v1", "data": {}}}, headers=headers)
+
+    everything = client.get("/api/snapshots")
+    assert "X-Next-Cursor" not in everything.headers
+    first = client.get("/api/state").json()
+    assert len(first["snapshots"]) == 5 and first["snapshots_cursor"] is None
+    expected = [s["id"] for s in everything.json()]
+    assert len(expected) == 5
+
+    seen, cursor = [], None
+    for _ in range(len(expected)):
+        resp = client.get("/api/snapshots", params={"limit": 2, **({"cursor": cursor} if cursor else {})})
+        assert resp.status_code == 200
+        seen += [s["id"] for s in resp.json()]
+        cursor = resp.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+        assert len(resp.json()) == 2
+    assert seen == expected
+
+    def names(**params):
+        return sorted(s["name"] for s in client.get("/api/snapshots", params=params).json())
+
+    assert names(scope="owned") == ["Mine A", "Mine B"]
+    assert names(scope="shared") == ["Board pack", "Month 01", "Month 02"]
+    assert names(role="viewer") == ["Month 02"]
+    assert names(role="owner") == ["Mine A", "Mine B"]
+    assert names(scope="owned", role="editor") == []
+    assert names(name_prefix="MONTH") == ["Month 01", "Month 02"]
+    assert names(name_prefix="mi", scope="shared") == []
+    assert client.get("/api/snapshots", params={"scope": "public"}).status_code == 400
+    assert client.get("/api/snapshots", params={"cursor": "%%%"}).status_code == 400
+    assert client.get("/api/snapshots", params={"role": "guest"}).status_code == 422
+
+    # Unbounded reads are capped at the default page size.
+    from app.routers import snapshots as snapshots_router, state as state_router
+    monkeypatch.setattr(snapshots_router, "SNAPSHOT_DEFAULT_PAGE_SIZE", 2)
+    monkeypatch.setattr(state_router, "SNAPSHOT_DEFAULT_PAGE_SIZE", 2)
+    resp = client.get("/api/snapshots")
+    assert [s["id"] for s in resp.json()] == expected[:2] and resp.headers["X-Next-Cursor"]
+    state = client.get("/api/state").json()
+    assert [s["id"] for s in state["snapshots"]] == expected[:2]
+    rest = client.get("/api/snapshots", params={"cursor": state["snapshots_cursor"], "limit": 10}).json()
+    assert [s["id"] for s in rest] == expected[2:]
+
+
+
+def test_snapshot_payload_codec_roundtrip_and_recompress(client, monkeypatch):
+    from app import models, snapshot_store
+    from app.db import get_db
+    from app.main import app
+
+    csrf = register(client, "codec@example.com")
+    headers = {"X-CSRF-Token": csrf}
+    data = {"summary": {"revenue": 10}, "rows": [{"account": "Fees", "amount": idx} for idx in range(200)]}
+    plain = client.post("/api/snapshots", json={"name": "Plain", "payload": {"schema_version": "v1", "data": data}}, headers=headers).json()
+    monkeypatch.setattr(snapshot_store, "SNAPSHOT_PAYLOAD_CODEC", "gzip")
+    packed_data = {**data, "rows": data["rows"][::-1]}
+    packed = client.post("/api/snapshots", json={"name": "Packed", "payload": {"schema_version": "v1", "data": packed_data}}, headers=headers).json()
+    assert packed["payload"]["data"] == packed_data
+
+    db = next(app.dependency_overrides[get_db]())
+
+    def codecs():
+        db.expire_all()
+        return {chunk.hash: chunk.codec for chunk in db.query(models.SnapshotChunk)}
+
+    # The shared summary section is too small to gain from gzip and stays as is.
+    section = lambda value: snapshot_store.content_hash(snapshot_store.encode_payload(value))  # noqa: E731
+    assert codecs() == {section(data["summary"]): None, section(data["rows"]): None, section(packed_data["rows"]): "gzip"}
+
+    # Rows written before the chunk store are moved into it without touching updated_at.
+    legacy = db.get(models.Snapshot, plain["id"])
+    legacy.manifest = None
+    legacy.payload_blob = snapshot_store.compress_payload(snapshot_store.encode_payload(data), "gzip")
+    legacy.payload_codec = "gzip"
+    db.commit()
+    before = legacy.updated_at
+    assert client.get(f"/api/snapshots/{plain['id']}").json()["payload"]["data"] == data
+
+    assert snapshot_store.recompress_snapshots(db, "gzip", batch_size=1) == (1, 1)
+    legacy = db.get(models.Snapshot, plain["id"])
+    assert (legacy.payload_blob, legacy.payload_codec, legacy.updated_at) == (None, None, before)
+    assert set(legacy.manifest) == {"summary", "rows"}
+    assert snapshot_store.recompress_snapshots(db, "gzip") == (0, 0)
+    assert client.get(f"/api/snapshots/{plain['id']}").json()["payload"]["data"] == data
+
+    assert snapshot_store.recompress_snapshots(db, "", batch_size=2) == (0, 2)
+    assert set(codecs().values()) == {None}
+    assert client.get(f"/api/snapshots/{packed['id']}").json()["payload"]["data"] == packed_data
+
+
+def test_snapshot_chunks_dedupe_refcount_and_gc(client):
+    from sqlalchemy import event
+
+    from app import models, snapshot_store
+    from app.db import get_db
+    from app.main import app
+
+    csrf = register(client, "chunks@example.com")
+    headers = {"X-CSRF-Token": csrf}
+    template = {"sections": [{"id": f"s{idx}", "accounts": [f"Account {idx}-{n}" for n in range(20)]} for idx in range(10)]}
+    january = {"template": template, "pl": {"month": "2024-01", "values": list(range(100))}, "summary": {"month": "2024-01"}}
+    february = {**january, "pl": {"month": "2024-02", "values": list(range(1, 101))}, "summary": {"month": "2024-02"}}
+    first = client.post("/api/snapshots", json={"name": "Jan", "payload": {"schema_version": "v1", "data": january}}, headers=headers).json()
+    second = client.post("/api/snapshots", json={"name": "Feb", "payload": {"schema_version": "v1", "data": february}}, headers=headers).json()
+
+    db = next(app.dependency_overrides[get_db]())
+
+    def refcounts():
+        db.expire_all()
+        return {chunk.hash: chunk.refcount for chunk in db.query(models.SnapshotChunk)}
+
+    template_hash = snapshot_store.content_hash(snapshot_store.encode_payload(template))
+    assert len(refcounts()) == 5
+    assert refcounts()[template_hash] == 2
+
+    engine = next(app.dependency_overrides[get_db]()).get_bind()
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        copy = client.post(f"/api/snapshots/{second['id']}/duplicate", headers=headers).json()
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+    assert not any("snapshot_chunks.data" in statement or "INSERT INTO snapshot_chunks" in statement for statement in statements)
+    assert copy["payload_hash"] == second["payload_hash"]
+    assert client.get(f"/api/snapshots/{copy['id']}").json()["payload"]["data"] == february
+    assert refcounts()[template_hash] == 3
+    assert len(refcounts()) == 5
+
+    # Editing the copy only adds its changed section; the old one drops back to one reference.
+    march = {**february, "summary": {"month": "2024-03"}}
+    client.patch(f"/api/snapshots/{copy['id']}", json={"payload": {"schema_version": "v1", "data": march}}, headers=headers)
+    assert len(refcounts()) == 6
+    assert client.get(f"/api/snapshots/{second['id']}").json()["payload"]["data"] == february
+
+    for snapshot_id in (first["id"], second["id"]):
+        assert client.delete(f"/api/snapshots/{snapshot_id}", headers=headers).status_code == 200
+    assert sorted(refcounts().values()) == [0, 0, 0, 1, 1, 1]
+    assert snapshot_store.collect_chunks(db, batch_size=2) == 3
+    assert sorted(refcounts().values()) == [1, 1, 1]
+    assert client.get(f"/api/snapshots/{copy['id']}").json()["payload"]["data"] == march
+
+    # A snapshot removed without releasing its chunks is caught by a recount.
+    db.query(models.Snapshot).filter(models.Snapshot.id == copy["id"]).delete()
+    db.commit()
+    assert snapshot_store.collect_chunks(db) == 0
+    snapshot_store.recount_chunks(db)
+    db.commit()
+    assert snapshot_store.collect_chunks(db) == 3
+    assert refcounts() == {}
+
+
+def test_snapshot_chunks_split_long_lists_into_row_batches(client, monkeypatch):
+    from app import models, snapshot_store
+    from app.db import get_db
+    from app.main import app
+
+    monkeypatch.setattr(snapshot_store, "PAYLOAD_CHUNK_ROWS", 10)
+    csrf = register(client, "batches@example.com")
+    headers = {"X-CSRF-Token": csrf}
+    txns = [{"account": "Fees", "amount": idx} for idx in range(45)]
+    january = {"gl": {"source": "xero", "txns": txns}, "rows": list(range(25)), "summary": {"month": "2024-01"}}
+    edited = [dict(txn) for txn in txns]
+    edited[17]["amount"] = -1
+    february = {**january, "gl": {"source": "xero", "txns": edited}}
+    first = client.post("/api/snapshots", json={"name": "Jan", "payload": {"schema_version": "v1", "data": january}}, headers=headers).json()
+    second = client.post("/api/snapshots", json={"name": "Feb", "payload": {"schema_version": "v1", "data": february}}, headers=headers).json()
+    assert client.get(f"/api/snapshots/{first['id']}").json()["payload"]["data"] == january
+    assert client.get(f"/api/snapshots/{second['id']}").json()["payload"]["data"] == february
+
+    db = next(app.dependency_overrides[get_db]())
+    manifest = db.get(models.Snapshot, second["id"]).manifest
+    assert [len(manifest["gl"]["rows"]["txns"]), len(manifest["rows"]["rows"][""])] == [5, 3]
+    # gl frame, 5 + 1 GL batches, 3 row batches and the summary: one edited line stores one batch.
+    refcounts = {chunk.hash: chunk.refcount for chunk in db.query(models.SnapshotChunk)}
+    assert len(refcounts) == 11
+    assert sorted(refcounts.values()) == [1, 1] + [2] * 9
+
+    snapshot_store.recount_chunks(db)
+    db.commit()
+    db.expire_all()
+    assert {chunk.hash: chunk.refcount for chunk in db.query(models.SnapshotChunk)} == refcounts
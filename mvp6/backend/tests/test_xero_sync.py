@@ -0,0 +1,655 @@
+import asyncio
+import itertools
+import json
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from xero_python.api_client.oauth2 import OAuth2Token
+
+from app import gl_store, models, sync_jobs, xero_client
+from app.auth import CSRF_COOKIE_NAME
+from app.db import Base, get_db
+from app.main import app
+from app.pl_matrix import PLMatrix
+from app.routers import xero
+from app.txn_hash import txn_hash
+from app.xero_cache import ReportCache, report_cache
+
+LATENCY = 0.3
+TENANT_ID = "tenant-123"
+
+PL_SECTIONS = [("Trading Income", ["Sales"]), ("Operating Expenses", ["Equipment Hire", "Rent"])]
+PL_VALUES = {"2024-01": {"Sales": 100.0, "Rent": 500.0}, "2024-02": {"Sales": 200.0, "Rent": 500.0}}
+for month in range(1, 13):
+    PL_VALUES[f"2023-{month:02d}"] = {"Sales": float(month * 10), "Rent": 450.0}
+PL_VALUES["2023-02"]["Equipment Hire"] = 75.0
+
+
+def pl_report(from_date, periods):
+    anchor = date.fromisoformat(from_date)
+    months = [xero.add_months(anchor, -idx) for idx in range(periods + 1)]
+    titles = [f"{(xero.add_months(month, 1) - timedelta(days=1)).day} {month.strftime('%b %Y')}" for month in months]
+    rows = [{"RowType": "Header", "Cells": [{"Value": ""}] + [{"Value": title} for title in titles]}]
+    for section, accounts in PL_SECTIONS:
+        section_rows = []
+        for account in accounts:
+            values = [PL_VALUES.get(month.strftime("%Y-%m"), {}).get(account) for month in months]
+            if any(value is not None for value in values):
+                cells = [{"Value": account}] + [{"Value": f"{value or 0:.2f}"} for value in values]
+                section_rows.append({"RowType": "Row", "Cells": cells})
+        rows.append({"RowType": "Section", "Title": section, "Rows": section_rows})
+    return {"Reports": [{"ReportID": "ProfitAndLoss", "Rows": rows}]}
+
+
+GL_ACCOUNTS = ["Sales", "Consulting Fees", "Rent", "Wages"]
+GL_LINES = [
+    ("Sales", "2024-01-15", "Invoice 1", "", "100.00"),
+    ("Sales", "2024-02-03", "Invoice 2", "", "250.00"),
+    ("Consulting Fees", "2024-02-20", "Dr Smith consult", "", "80.00"),
+    ("Rent", "2024-01-01", "January rent", "500.00", ""),
+    ("Rent", "2024-02-01", "February rent", "500.00", ""),
+    ("Rent", "2024-03-01", "March rent", "500.00", ""),
+    ("Wages", "2024-03-28", "Payroll", "900.00", ""),
+]
+
+
+def gl_report(from_date, to_date, gl_lines=GL_LINES):
+    rows = [{"RowType": "Header", "Cells": [{"Value": "Date"}, {"Value": "Description"}, {"Value": "Debit"}, {"Value": "Credit"}]}]
+    for account in GL_ACCOUNTS:
+        lines = [line for line in gl_lines if line[0] == account and from_date <= line[1] <= to_date]
+        if lines:
+            rows.append({
+                "RowType": "Section",
+                "Title": account,
+                "Rows": [{"RowType": "Row", "Cells": [{"Value": value} for value in line[1:]]} for line in lines],
+            })
+    return {"Reports": [{"ReportID": "GeneralLedger", "Rows": rows}]}
+
+
+def make_fake_xero(latency, gl_lines=GL_LINES):
+    fake = FastAPI()
+    calls = []
+    # Most requests the fake server had open at once.
+    fake.state.active = 0
+    fake.state.peak = 0
+
+    async def respond(report):
+        fake.state.active += 1
+        fake.state.peak = max(fake.state.peak, fake.state.active)
+        try:
+            await asyncio.sleep(latency)
+        finally:
+            fake.state.active -= 1
+        return report
+
+    @fake.get("/api.xro/2.0/Reports/ProfitAndLoss")
+    async def profit_and_loss(fromDate: str, toDate: str, periods: int = 0, timeframe: str = "MONTH"):
+        calls.append(("pl", fromDate, toDate, periods, timeframe))
+        return await respond(pl_report(fromDate, periods))
+
+    @fake.get("/api.xro/2.0/Reports/GeneralLedger")
+    async def general_ledger(fromDate: str, toDate: str):
+        calls.append(("gl", fromDate, toDate))
+        return await respond(gl_report(fromDate, toDate, gl_lines))
+
+    return fake, calls
+
+
+@pytest.fixture()
+def xero_user(client, monkeypatch):
+    monkeypatch.setenv("XERO_CLIENT_ID", "client-id")
+    monkeypatch.setenv("XERO_CLIENT_SECRET", "client-secret")
+    monkeypatch.setenv("XERO_REDIRECT_URI", "http://localhost/api/xero/callback")
+    resp = client.post(
+        "/api/auth/register",
+        json={"email": "xero@example.com", "password": "pass1234", "remember": False, "invite_code": "test-code"},
+    )
+    assert resp.status_code == 200
+    db = next(app.dependency_overrides[get_db]())
+    db.add(
+        models.XeroConnection(
+            user_id=resp.json()["user"]["id"],
+            access_token="access-token",
+            refresh_token="refresh-token",
+            expires_at=datetime.utcnow() + timedelta(hours=1),
+            tenant_id=TENANT_ID,
+        )
+    )
+    db.commit()
+    db.close()
+    report_cache.clear()
+    xero_client.reset_throttles()
+    xero_client.report_flights.clear()
+    yield client.cookies.get(CSRF_COOKIE_NAME)
+    xero_client.use_transport(None)
+    xero_client.reset_throttles()
+    report_cache.clear()
+
+
+def test_sync_fetches_reports_concurrently(client, xero_user):
+    fake, calls = make_fake_xero(LATENCY)
+    xero_client.use_transport(httpx.ASGITransport(app=fake))
+
+    resp = client.post(
+        "/api/xero/sync",
+        json={"from_date": "2024-01-01", "to_date": "2024-02-29", "include_gl": True},
+        headers={"X-CSRF-Token": xero_user},
+    )
+
+    assert resp.status_code == 200
+    data = resp.json()
+    assert data["tenantId"] == TENANT_ID
+    assert data["pl"]["months"] == ["2024-01", "2024-02"]
+    assert data["pl"]["accounts"][0] == {"name": "Sales", "section": "trading_income", "values": [100.0, 200.0], "total": 300.0}
+    assert data["gl"]["txns"][0]["account"] == "Sales"
+    assert data["gl"]["txns"][0]["amount"] == -100.0
+    assert sorted(call[0] for call in calls) == ["gl", "gl", "pl"]
+    # Serial fetching would never have more than one request open at the fake server.
+    assert fake.state.peak == 3
+
+
+def test_sync_reports_upstream_failure(client, xero_user):
+    xero_client.use_transport(httpx.MockTransport(lambda request: httpx.Response(500)))
+    resp = client.post(
+        "/api/xero/sync",
+        json={"from_date": "2024-01-01", "to_date": "2024-02-29", "include_gl": False},
+        headers={"X-CSRF-Token": xero_user},
+    )
+    assert resp.status_code == 502
+    assert resp.json()["detail"] == "Failed to fetch Xero Profit & Loss"
+
+
+def test_sync_stitches_monthly_gl_windows(client, xero_user):
+    fake, calls = make_fake_xero(0)
+    xero_client.use_transport(httpx.ASGITransport(app=fake))
+
+    resp = client.post(
+        "/api/xero/sync",
+        json={"from_date": "2024-01-10", "to_date": "2024-03-31", "include_gl": True},
+        headers={"X-CSRF-Token": xero_user},
+    )
+
+    assert resp.status_code == 200
+    gl_calls = sorted(call[1:] for call in calls if call[0] == "gl")
+    assert gl_calls == [("2024-01-10", "2024-01-31"), ("2024-02-01", "2024-02-29"), ("2024-03-01", "2024-03-31")]
+    single_call = xero.parse_xero_gl(gl_report("2024-01-10", "2024-03-31")["Reports"][0])
+    assert resp.json()["gl"] == single_call
+
+
+def test_split_date_range_aligns_windows_to_months():
+    windows = xero.split_date_range(date(2023, 11, 15), date(2024, 4, 2), 2)
+    assert [(start.isoformat(), end.isoformat()) for start, end in windows] == [
+        ("2023-11-15", "2023-12-31"),
+        ("2024-01-01", "2024-02-29"),
+        ("2024-03-01", "2024-04-02"),
+    ]
+
+
+def test_sync_merges_period_windowed_profit_and_loss(client, xero_user):
+    fake, calls = make_fake_xero(0)
+    xero_client.use_transport(httpx.ASGITransport(app=fake))
+
+    resp = client.post(
+        "/api/xero/sync",
+        json={"from_date": "2023-01-01", "to_date": "2024-02-29", "include_gl": False},
+        headers={"X-CSRF-Token": xero_user},
+    )
+
+    assert resp.status_code == 200
+    pl_calls = sorted(call[1:] for call in calls if call[0] == "pl")
+    assert pl_calls == [("2023-12-01", "2023-12-31", 11, "MONTH"), ("2024-02-01", "2024-02-29", 1, "MONTH")]
+    pl = resp.json()["pl"]
+    assert pl["months"] == sorted(PL_VALUES)
+    assert pl["monthLabels"][0] == "Jan 2023"
+    accounts = {account["name"]: account for account in pl["accounts"]}
+    assert accounts["Sales"]["values"] == [PL_VALUES[month]["Sales"] for month in pl["months"]]
+    assert accounts["Equipment Hire"]["values"] == [75.0 if month == "2023-02" else 0.0 for month in pl["months"]]
+    assert accounts["Rent"]["total"] == 450.0 * 12 + 500.0 * 2
+
+
+def test_sync_returns_compact_pl_formats(client, xero_user):
+    fake, calls = make_fake_xero(0)
+    xero_client.use_transport(httpx.ASGITransport(app=fake))
+    body = {"from_date": "2023-01-01", "to_date": "2024-02-29", "include_gl": False}
+
+    expected = client.post("/api/xero/sync", json=body, headers={"X-CSRF-Token": xero_user}).json()["pl"]
+    for fmt in ("dense", "base64"):
+        resp = client.post("/api/xero/sync", json={**body, "pl_format": fmt}, headers={"X-CSRF-Token": xero_user})
+        assert resp.status_code == 200
+        wire = resp.json()["pl"]
+        assert wire["format"] == fmt
+        assert wire["shape"] == [len(expected["accounts"]), len(expected["months"])]
+        matrix = PLMatrix.from_wire(wire)
+        assert matrix.to_parsed() == expected
+        assert matrix.section_totals()["operating_expenses"].tolist()[:2] == [450.0, 525.0]
+
+    bad = client.post("/api/xero/sync", json={**body, "pl_format": "xml"}, headers={"X-CSRF-Token": xero_user})
+    assert bad.status_code == 400
+
+
+def test_resync_only_fetches_since_high_water_mark(client, xero_user):
+    gl_lines = list(GL_LINES)
+    fake, calls = make_fake_xero(0, gl_lines)
+    xero_client.use_transport(httpx.ASGITransport(app=fake))
+    payload = {"from_date": "2024-01-01", "to_date": "2024-03-31", "include_gl": True}
+
+    first = client.post("/api/xero/sync", json=payload, headers={"X-CSRF-Token": xero_user})
+    assert first.status_code == 200
+    assert first.json()["glSync"] == {"fetchedFrom": "2024-01-01", "fetchedTo": "2024-03-31", "stored": len(GL_LINES)}
+
+    # A late edit inside the re-check window replaces the stored line.
+    gl_lines[-1] = ("Wages", "2024-03-28", "Payroll", "950.00", "")
+    calls.clear()
+    second = client.post("/api/xero/sync", json=payload, headers={"X-CSRF-Token": xero_user})
+
+    assert second.status_code == 200
+    assert [call[1:] for call in calls if call[0] == "gl"] == [("2024-03-24", "2024-03-31")]
+    assert second.json()["glSync"]["stored"] == 1
+    txns = second.json()["gl"]["txns"]
+    assert len(txns) == len(GL_LINES)
+    assert [txn["debit"] for txn in txns if txn["account"] == "Wages"] == [950.0]
+    assert txns == xero.parse_xero_gl(gl_report("2024-01-01", "2024-03-31", gl_lines)["Reports"][0])["txns"]
+
+
+def test_gl_txn_hashes_distinguish_identical_lines():
+    txn = {"account": "Rent", "date": "2024-01-01", "amount": 500.0, "description": "Rent", "reference": "", "source": ""}
+    first, second = gl_store.gl_txn_hashes([txn, dict(txn)])
+    assert first == txn_hash(txn)
+    assert first != second
+    assert gl_store.gl_txn_hashes([txn]) == [first]
+
+
+def test_repeat_sync_is_served_from_cache(client, xero_user):
+    fake, calls = make_fake_xero(0)
+    xero_client.use_transport(httpx.ASGITransport(app=fake))
+    payload = {"from_date": "2024-01-01", "to_date": "2024-02-29", "include_gl": False}
+
+    first = client.post("/api/xero/sync", json=payload, headers={"X-CSRF-Token": xero_user})
+    second = client.post("/api/xero/sync", json=payload, headers={"X-CSRF-Token": xero_user})
+    assert first.json()["pl"] == second.json()["pl"]
+    assert len(calls) == 1
+    # Entries are weighed by the raw response body the client read.
+    assert report_cache.stats()["hits"] == 1 and report_cache.stats()["bytes"] > 0
+
+    client.post("/api/xero/sync", json={**payload, "cache": "bypass"}, headers={"X-CSRF-Token": xero_user})
+    assert len(calls) == 2
+
+    invalidated = client.delete("/api/xero/cache", headers={"X-CSRF-Token": xero_user})
+    assert invalidated.json()["invalidated"] == 1
+    client.post("/api/xero/sync", json=payload, headers={"X-CSRF-Token": xero_user})
+    assert len(calls) == 3
+
+    metrics = client.get("/api/xero/metrics")
+    assert metrics.status_code == 200
+    assert metrics.json()["cache"]["misses"] == 2
+
+
+def test_stale_entry_revalidates_with_etag(client, xero_user):
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        if request.headers.get("If-None-Match") == '"v1"':
+            return httpx.Response(304)
+        report = pl_report(request.url.params["fromDate"], int(request.url.params.get("periods", 0)))
+        return httpx.Response(200, json=report, headers={"ETag": '"v1"'})
+
+    xero_client.use_transport(httpx.MockTransport(handler))
+    report_cache.ttl_seconds = 0
+    try:
+        payload = {"from_date": "2024-01-01", "to_date": "2024-02-29", "include_gl": False}
+        first = client.post("/api/xero/sync", json=payload, headers={"X-CSRF-Token": xero_user})
+        second = client.post("/api/xero/sync", json=payload, headers={"X-CSRF-Token": xero_user})
+    finally:
+        report_cache.ttl_seconds = ReportCache().ttl_seconds
+
+    assert second.status_code == 200
+    assert first.json()["pl"] == second.json()["pl"]
+    assert requests[1].headers["If-None-Match"] == '"v1"'
+    assert report_cache.stats()["revalidated"] == 1
+
+
+def test_report_cache_evicts_least_recently_used():
+    cache = ReportCache(ttl_seconds=60, max_bytes=40)
+    first = cache.make_key("t1", "gl", {"fromDate": "2024-01-01", "toDate": "2024-01-31"})
+    second = cache.make_key("t1", "gl", {"fromDate": "2024-02-01", "toDate": "2024-02-29"})
+    cache.put(first, {"txns": ["a" * 10]}, 23)
+    cache.put(second, {"txns": ["b" * 10]}, 23)
+    assert cache.lookup(first)[0] is None
+    assert cache.lookup(second)[1] is True
+    assert (cache.stats()["evictions"], cache.stats()["bytes"]) == (1, 23)
+
+
+def test_sync_waits_out_retry_after(client, xero_user, monkeypatch):
+    responses = [httpx.Response(429, headers={"Retry-After": "0.2"})]
+    log = []
+    block_for = xero_client.TenantThrottle.block_for
+
+    def record_block(self, seconds):
+        log.append(("block", seconds))
+        block_for(self, seconds)
+
+    monkeypatch.setattr(xero_client.TenantThrottle, "block_for", record_block)
+
+    def handler(request):
+        log.append(("request", request.url.params["fromDate"], 429 if responses else 200))
+        if responses:
+            return responses.pop()
+        report = pl_report(request.url.params["fromDate"], int(request.url.params.get("periods", 0)))
+        return httpx.Response(200, json=report, headers={"X-MinLimit-Remaining": "58", "X-DayLimit-Remaining": "4990"})
+
+    xero_client.use_transport(httpx.MockTransport(handler))
+    resp = client.post(
+        "/api/xero/sync",
+        json={"from_date": "2024-01-01", "to_date": "2024-02-29", "include_gl": False},
+        headers={"X-CSRF-Token": xero_user},
+    )
+
+    assert resp.status_code == 200
+    # The tenant is blocked for the Retry-After period before the same report is re-requested.
+    assert log == [("request", "2024-02-01", 429), ("block", 0.2), ("request", "2024-02-01", 200)]
+    limits = client.get("/api/xero/metrics").json()["rateLimits"][TENANT_ID]
+    assert limits["throttled"] == 1
+    assert limits["retries"] == 1
+    assert limits["dayRemaining"] == 4990
+
+
+def test_sync_surfaces_exhausted_rate_limit_as_429(client, xero_user):
+    xero_client.use_transport(httpx.MockTransport(lambda request: httpx.Response(429, headers={"Retry-After": "3600"})))
+    resp = client.post(
+        "/api/xero/sync",
+        json={"from_date": "2024-01-01", "to_date": "2024-02-29", "include_gl": False},
+        headers={"X-CSRF-Token": xero_user},
+    )
+    assert resp.status_code == 429
+    assert resp.headers["Retry-After"] == "3600"
+
+
+def test_throttle_serves_users_round_robin():
+    async def scenario():
+        throttle = xero_client.TenantThrottle(minute_limit=100, concurrent_limit=1)
+        order = []
+
+        async def call(user_id, label):
+            await throttle.acquire(user_id)
+            order.append(label)
+            await asyncio.sleep(0)
+            throttle.release()
+
+        await throttle.acquire("holder")
+        tasks = [asyncio.create_task(call("alice", f"alice-{idx}")) for idx in range(3)]
+        tasks.append(asyncio.create_task(call("bob", "bob-0")))
+        await asyncio.sleep(0)
+        throttle.release()
+        await asyncio.gather(*tasks)
+        return order
+
+    assert asyncio.run(scenario()) == ["alice-0", "bob-0", "alice-1", "alice-2"]
+
+
+def test_idle_throttles_are_evicted_past_the_cap(monkeypatch):
+    monkeypatch.setattr(xero_client, "XERO_THROTTLE_MAX_TENANTS", 2)
+    xero_client.reset_throttles()
+    xero_client.get_throttle("busy").active = 1
+    for idx in range(5):
+        xero_client.get_throttle(f"idle-{idx}")
+    assert list(xero_client.throttle_stats()) == ["busy", "idle-4"]
+    xero_client.reset_throttles()
+
+
+def wait_for_job(client, job_id, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = client.get(f"/api/xero/jobs/{job_id}").json()
+        if job["status"] not in ("queued", "running"):
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"job {job_id} did not finish")
+
+
+def test_sync_job_runs_in_background(client, xero_user):
+    fake, calls = make_fake_xero(0)
+    xero_client.use_transport(httpx.ASGITransport(app=fake))
+
+    resp = client.post(
+        "/api/xero/jobs",
+        json={"from_date": "2024-01-01", "to_date": "2024-03-31", "include_gl": True},
+        headers={"X-CSRF-Token": xero_user},
+    )
+    assert resp.status_code == 202
+    assert resp.json()["status"] in ("queued", "running")
+
+    job = wait_for_job(client, resp.json()["id"])
+    assert job["status"] == "succeeded"
+    assert job["progress"] == 100
+
+    result = client.get(f"/api/xero/jobs/{job['id']}/result").json()
+    direct = client.post(
+        "/api/xero/sync",
+        json={"from_date": "2024-01-01", "to_date": "2024-03-31", "include_gl": True},
+        headers={"X-CSRF-Token": xero_user},
+    ).json()
+    assert result["pl"] == direct["pl"]
+    assert result["gl"] == direct["gl"]
+    assert [job["id"] for job in client.get("/api/xero/jobs").json()] == [resp.json()["id"]]
+
+    bad = client.post("/api/xero/jobs", json={"from_date": "2024-03-01", "to_date": "2024-01-01"}, headers={"X-CSRF-Token": xero_user})
+    assert bad.status_code == 400
+
+
+def test_job_claims_respect_per_user_limit():
+    # Separate in-memory database so the app's own workers cannot claim these jobs.
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool, future=True)
+    Base.metadata.create_all(bind=engine)
+    session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine, future=True)
+    db = session_factory()
+    first = models.User(email="first@example.com", password_hash="x")
+    second = models.User(email="second@example.com", password_hash="x")
+    db.add_all([first, second])
+    db.commit()
+    for owner in (first.id, first.id, second.id):
+        db.add(models.SyncJob(user_id=owner, kind="xero_sync", status="queued", params={}, progress=0))
+        db.commit()
+
+    runner = sync_jobs.SyncJobRunner(session_factory=session_factory, per_user=1)
+    claimed = [runner.claim_next() for _ in range(3)]
+    assert claimed[2] is None
+    assert {db.get(models.SyncJob, job_id).user_id for job_id in claimed[:2]} == {first.id, second.id}
+
+    # A job another worker already claimed cannot be claimed again.
+    assert not sync_jobs.claim_job(db, claimed[0], db.get(models.SyncJob, claimed[0]).user_id, per_user=5)
+
+    # Live heartbeats keep running jobs where they are; a stale one is requeued.
+    assert runner.requeue_interrupted() == 0
+    db.query(models.SyncJob).filter(models.SyncJob.id == claimed[0]).update(
+        {"heartbeat_at": datetime.now(timezone.utc) - timedelta(seconds=sync_jobs.SYNC_JOB_STALE_SECONDS + 1)}
+    )
+    db.commit()
+    assert runner.requeue_interrupted() == 1
+    assert db.get(models.SyncJob, claimed[0]).status == "queued"
+    assert runner.claim_next() is not None
+    db.close()
+
+
+def read_sse(response):
+    events = []
+    for block in response.text.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+def test_sync_stream_emits_progress_and_txn_chunks(client, xero_user, monkeypatch):
+    fake, calls = make_fake_xero(0)
+    xero_client.use_transport(httpx.ASGITransport(app=fake))
+    monkeypatch.setattr(xero, "XERO_STREAM_TXN_CHUNK", 3)
+    body = {"from_date": "2024-01-01", "to_date": "2024-03-31", "include_gl": True}
+
+    with client.stream("POST", "/api/xero/sync/stream", json=body, headers={"X-CSRF-Token": xero_user}) as resp:
+        assert resp.status_code == 200
+        assert resp.headers["content-type"].startswith("text/event-stream")
+        resp.read()
+    events = read_sse(resp)
+    names = [name for name, _ in events]
+
+    assert names[0] == "token"
+    assert names[-1] == "done"
+    assert names.count("gl_window") == 3
+    assert names.index("pl_fetched") < names.index("pl_parsed")
+    # Each window's lines go out as soon as that window is parsed, before anything is stored.
+    assert names.index("gl_window") < names.index("gl_txns") < names.index("gl_stored")
+    assert [name for name in names if name in ("gl_window", "gl_txns")][0] == "gl_window"
+
+    def streamed_txns(events):
+        chunks = [data for name, data in events if name == "gl_txns"]
+        assert [chunk["offset"] for chunk in chunks] == list(itertools.accumulate([0] + [len(chunk["txns"]) for chunk in chunks[:-1]]))
+        return sorted(json.dumps(txn, sort_keys=True) for chunk in chunks for txn in chunk["txns"])
+
+    direct = client.post("/api/xero/sync", json=body, headers={"X-CSRF-Token": xero_user}).json()
+    pl = next(data["pl"] for name, data in events if name == "pl_parsed")
+    assert pl == direct["pl"]
+    assert streamed_txns(events) == sorted(json.dumps(txn, sort_keys=True) for txn in direct["gl"]["txns"])
+    assert events[-1][1]["txns"] == len(GL_LINES)
+
+    # A repeat sync only fetches the re-check window; earlier lines come from the store first.
+    with client.stream("POST", "/api/xero/sync/stream", json=body, headers={"X-CSRF-Token": xero_user}) as resp:
+        resp.read()
+    events = read_sse(resp)
+    chunks = [data for name, data in events if name == "gl_txns"]
+    assert chunks[0]["stored"] is True
+    assert streamed_txns(events) == sorted(json.dumps(txn, sort_keys=True) for txn in direct["gl"]["txns"])
+
+
+def test_sync_stream_reports_errors_as_events(client, xero_user):
+    xero_client.use_transport(httpx.MockTransport(lambda request: httpx.Response(500)))
+
+    resp = client.post(
+        "/api/xero/sync/stream",
+        json={"from_date": "2024-01-01", "to_date": "2024-01-31"},
+        headers={"X-CSRF-Token": xero_user},
+    )
+    assert resp.status_code == 200
+    assert read_sse(resp)[-1] == ("error", {"status": 502, "detail": "Failed to fetch Xero Profit & Loss"})
+
+    bad = client.post("/api/xero/sync/stream", json={"from_date": "2024-01-01"}, headers={"X-CSRF-Token": xero_user})
+    assert bad.status_code == 400
+
+
+def test_sync_stream_reports_unexpected_failures_without_raising(client, xero_user, monkeypatch):
+    async def broken_sync(*args, **kwargs):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(xero, "run_xero_sync", broken_sync)
+    resp = client.post("/api/xero/sync/stream", json={"from_date": "2024-01-01", "to_date": "2024-01-31"}, headers={"X-CSRF-Token": xero_user})
+    assert resp.status_code == 200
+    assert read_sse(resp) == [("error", {"status": 500, "detail": "Sync failed"})]
+
+
+def test_concurrent_identical_fetches_share_one_download(xero_user):
+    fake, calls = make_fake_xero(0.1)
+    xero_client.use_transport(httpx.ASGITransport(app=fake))
+
+    async def run():
+        fetchers = [xero.XeroReportFetcher("token", TENANT_ID, f"user-{idx}", use_cache=False) for idx in range(3)]
+        return await asyncio.gather(
+            *(fetcher.profit_and_loss(date(2024, 1, 1), date(2024, 2, 29)) for fetcher in fetchers),
+            *(fetcher.general_ledger(date(2024, 1, 1), date(2024, 2, 29)) for fetcher in fetchers),
+        )
+
+    results = asyncio.run(run())
+    assert results[0] == results[1] == results[2]
+    assert results[3] == results[4] == results[5]
+    assert sorted(call[0] for call in calls) == ["gl", "gl", "pl"]
+    assert xero_client.report_flights.stats() == {"started": 3, "coalesced": 6, "inflight": 0}
+
+
+def test_token_refresh_is_serialised_per_connection(client, xero_user, monkeypatch):
+    refreshes = []
+
+    def fake_refresh(self, token_api):
+        refreshes.append(self.refresh_token)
+        time.sleep(0.2)
+        return {"access_token": f"new-token-{len(refreshes)}", "refresh_token": "rotated", "expires_in": 1800, "token_type": "Bearer", "scope": ["offline_access"]}
+
+    monkeypatch.setattr(OAuth2Token, "call_refresh_token_api", fake_refresh)
+    db = next(app.dependency_overrides[get_db]())
+    connection = db.query(models.XeroConnection).first()
+    connection.expires_at = datetime.utcnow() - timedelta(minutes=5)
+    db.commit()
+    db.close()
+
+    config = xero.get_xero_config()
+    tokens = []
+
+    def worker():
+        session = next(app.dependency_overrides[get_db]())
+        try:
+            tokens.append(xero.ensure_access_token(session, session.query(models.XeroConnection).first(), config))
+        finally:
+            session.close()
+
+    threads = [threading.Thread(target=worker) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert refreshes == ["refresh-token"]
+    assert tokens == ["new-token-1"] * 3
+
+
+def byte_chunks(data, size):
+    async def chunks():
+        for offset in range(0, len(data), size):
+            yield data[offset:offset + size]
+    return chunks()
+
+
+def test_streaming_gl_parser_matches_full_parse():
+    report = gl_report("2024-01-01", "2024-03-31", GL_LINES + [("Wages", "2024-03-29", "Bonus – Dr Ng", "", "(1,234.50)")])
+    report["Reports"][0]["ReportTitles"] = ["General Ledger", {"nested": [1, 2.5e3, None, True]}]
+    expected = xero.parse_xero_gl(report["Reports"][0])["txns"]
+    data = json.dumps(report, indent=1, ensure_ascii=False).encode()
+
+    async def collect(size):
+        return [txn async for txn in xero.iter_xero_gl_txns(byte_chunks(data, size))]
+
+    for size in (1, 7, 64, len(data)):
+        assert asyncio.run(collect(size)) == expected
+
+    data = data[:-40]
+    with pytest.raises(ValueError):
+        asyncio.run(collect(16))
+
+
+def test_gl_stream_endpoint_writes_ndjson(client, xero_user):
+    fake, calls = make_fake_xero(0)
+    xero_client.use_transport(httpx.ASGITransport(app=fake))
+
+    resp = client.post(
+        "/api/xero/gl/stream",
+        json={"from_date": "2024-01-01", "to_date": "2024-03-31"},
+        headers={"X-CSRF-Token": xero_user},
+    )
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("application/x-ndjson")
+    txns = [json.loads(line) for line in resp.text.splitlines()]
+    assert [call[1:] for call in calls] == [("2024-01-01", "2024-01-31"), ("2024-02-01", "2024-02-29"), ("2024-03-01", "2024-03-31")]
+    expected = xero.parse_xero_gl(gl_report("2024-01-01", "2024-03-31")["Reports"][0])["txns"]
+    key = lambda txn: (txn["account"], txn["date"], txn["description"])
+    assert sorted(txns, key=key) == sorted(expected, key=key)
+
+    xero_client.use_transport(httpx.MockTransport(lambda request: httpx.Response(500)))
+    resp = client.post(
+        "/api/xero/gl/stream",
+        json={"from_date": "2024-01-01", "to_date": "2024-01-31"},
+        headers={"X-CSRF-Token": xero_user},
+    )
+    assert resp.text.splitlines() == ['{"error": {"status": 502, "detail": "Failed to fetch Xero General Ledger"}}']
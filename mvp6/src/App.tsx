@@ -53,8 +53,11 @@ export function App() {
       setDefaults(data.settings.data)
     }
     if (Array.isArray(data?.snapshots)) {
+      const snapshots = data.snapshots_cursor
+        ? [...data.snapshots, ...(await api.listSnapshots(data.snapshots_cursor))]
+        : data.snapshots
       setSnapshots(
-        data.snapshots.map((snap: any) => ({
+        snapshots.map((snap: any) => ({
           id: snap.id,
           name: snap.name,
           ownerId: snap.owner_user_id,
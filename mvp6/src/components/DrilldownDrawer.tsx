@@ -5,7 +5,7 @@ import { computeDream } from '../lib/dream/compute'
 import { DreamGroup, DreamLine, TxnTreatment } from '../lib/types'
 import { Button, Chip, Input, Label, Mono } from './ui'
 import { api } from '../lib/api'
-import { buildTxnHash, inferDoctorLabel, monthKeyFromDate, resolveTreatment } from '../lib/ledger'
+import { buildOverrideMap, buildTxnHash, inferDoctorLabel, monthKeyFromDate, resolveTreatment } from '../lib/ledger'
 import { createCopyMenuItems, useContextMenu } from './ContextMenu'
 import { CopyAffordance } from './CopyAffordance'
 import { AnimatePresence, motion, useReducedMotion } from 'framer-motion'
@@ -60,13 +60,7 @@ export function DrilldownDrawer() {
     return selected.line.mappedAccounts
   }, [selected])
 
-  const overrideMap = useMemo(() => {
-    const map = new Map<string, any>()
-    txnOverrides.forEach(o => {
-      if (o.hash) map.set(o.hash, o)
-    })
-    return map
-  }, [txnOverrides])
+  const overrideMap = useMemo(() => buildOverrideMap(txnOverrides), [txnOverrides])
 
   const ruleMap = useMemo(() => {
     const map = new Map<string, any>()
@@ -11,6 +11,7 @@ import { PageHeader } from './PageHeader'
 import {
   buildEffectiveLedger,
   buildEffectivePl,
+  buildOverrideMap,
   buildTxnHash,
   DEFAULT_DOCTOR_PATTERNS,
   inferDoctorLabel,
@@ -462,13 +463,7 @@ export function Overview() {
     return map
   }, [doctorRules])
 
-  const overrideMap = useMemo(() => {
-    const map = new Map<string, any>()
-    txnOverrides.forEach(o => {
-      if (o.hash) map.set(o.hash, o)
-    })
-    return map
-  }, [txnOverrides])
+  const overrideMap = useMemo(() => buildOverrideMap(txnOverrides), [txnOverrides])
 
   const compiledDoctorPatterns = useMemo(() => {
     return (activeDoctorPatterns ?? [])
@@ -86,6 +86,23 @@ async function request<T>(path: string, options: RequestInit = {}): Promise<T> {
   return res.json() as Promise<T>
 }
 
+async function listAllSnapshots(cursor?: string | null): Promise<SnapshotListItem[]> {
+  // The API returns one page per call and the next page's cursor in X-Next-Cursor.
+  const items: SnapshotListItem[] = []
+  let next = cursor ?? null
+  do {
+    const query = next ? `?cursor=${encodeURIComponent(next)}` : ''
+    const res = await fetch(`${API_BASE}/snapshots${query}`, { credentials: 'include' })
+    if (!res.ok) {
+      const error = await res.json().catch(() => ({ detail: 'Request failed' }))
+      throw new Error(error.detail ?? 'Request failed')
+    }
+    items.push(...((await res.json()) as SnapshotListItem[]))
+    next = res.headers.get('X-Next-Cursor')
+  } while (next)
+  return items
+}
+
 export const api = {
   register: (payload: { email: string; password: string; remember: boolean }) =>
     request<{ user: ApiUser }>('auth/register', { method: 'POST', body: JSON.stringify(payload) }),
@@ -109,7 +126,7 @@ export const api = {
     request('state/settings', { method: 'PUT', body: JSON.stringify(payload) }),
   createImport: (payload: { name: string; kind: string; status: string; metadata: Record<string, any> }) =>
     request('state/imports', { method: 'POST', body: JSON.stringify(payload) }),
-  listSnapshots: () => request<SnapshotListItem[]>('snapshots'),
+  listSnapshots: (cursor?: string | null) => listAllSnapshots(cursor),
   createSnapshot: (payload: { name: string; payload: SnapshotPayload }) =>
     request<any>('snapshots', { method: 'POST', body: JSON.stringify(payload) }),
   getSnapshot: (snapshotId: string) => request<any>(`snapshots/${snapshotId}`),
@@ -94,15 +94,25 @@ export function buildDeferralSchedule(amount: number, config: DeferralConfig) {
   return out
 }
 
+// A GL sync moves overrides onto the server's canonical key and keeps the browser's
+// buildTxnHash value in legacy_hash, so index both.
+export function buildOverrideMap(overrides: TxnOverride[] = []) {
+  const overrideMap = new Map<string, TxnOverride>()
+  overrides.forEach(o => {
+    if (o.legacy_hash) overrideMap.set(o.legacy_hash, o)
+  })
+  overrides.forEach(o => {
+    if (o.hash) overrideMap.set(o.hash, o)
+  })
+  return overrideMap
+}
+
 export function buildEffectiveLedger(
   txns: GLTxn[],
   overrides: TxnOverride[] = [],
   doctorRules: DoctorRule[] = []
 ): EffectiveTxn[] {
-  const overrideMap = new Map<string, TxnOverride>()
-  overrides.forEach(o => {
-    if (o.hash) overrideMap.set(o.hash, o)
-  })
+  const overrideMap = buildOverrideMap(overrides)
   const ruleMap = new Map<string, DoctorRule>()
   doctorRules.forEach(r => {
     if (r.enabled) ruleMap.set(r.contact_id, r)
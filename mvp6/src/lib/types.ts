@@ -185,6 +185,7 @@ export type TxnOverride = {
   document_id: string
   line_item_id?: string | null
   hash?: string | null
+  legacy_hash?: string | null
   treatment: TxnTreatment
   deferral_start_month?: MonthKey | null
   deferral_months?: number | null